@@ -10,6 +10,9 @@ import json
 import logging
 import sys
 import os
+import random
+import threading
+import uuid
 from datetime import datetime, timedelta
 from pathlib import Path
 
@@ -47,6 +50,12 @@ class Config:
     IDLE_THRESHOLD = 15  # minutes
     SLEEP_THRESHOLD = 30  # minutes
     WARNING_DURATION = 300  # seconds (5 minutes)
+    POLICY_REFRESH_INTERVAL = 600  # seconds between policy checks
+    POLICY_CACHE_FILE = 'policy_cache.json'  # last policy fetched, used until the server answers
+    POLICY_PUSH = True  # hold a connection for pushed policy changes (polling is the fallback)
+    PUSH_READ_TIMEOUT = 90  # seconds without data (server keep-alives come every 25) before reconnecting
+    PUSH_RETRY_MIN = 5  # seconds before reconnecting, doubled per failure
+    PUSH_RETRY_MAX = 600
     
     # System
     CHECK_INTERVAL = 60  # seconds
@@ -82,6 +91,8 @@ class Config:
                 cls.SLEEP_THRESHOLD = policies.get('sleep_after_minutes', cls.SLEEP_THRESHOLD)
                 cls.WARNING_DURATION = policies.get('warning_duration_seconds', cls.WARNING_DURATION)
                 cls.ENABLE_WARNINGS = policies.get('warn_before_action', cls.ENABLE_WARNINGS)
+                cls.POLICY_REFRESH_INTERVAL = policies.get('refresh_interval_seconds', cls.POLICY_REFRESH_INTERVAL)
+                cls.POLICY_PUSH = policies.get('push', cls.POLICY_PUSH)
                 
                 system = config.get('system', {})
                 cls.POWER_WATTS = system.get('power_watts', cls.POWER_WATTS)
@@ -170,9 +181,15 @@ def hibernate_system():
 # ----------------------
 # SYSTEM INFORMATION
 # ----------------------
+def get_mac_address():
+    """Primary MAC address, which identifies this system to the server"""
+    node = uuid.getnode()
+    return ':'.join(f'{(node >> shift) & 0xFF:02X}' for shift in range(40, -1, -8))
+
 def get_system_info():
     """Get detailed system information"""
     info = {
+        'mac_address': get_mac_address(),
         'pc_id': platform.node(),
         'hostname': platform.node(),
         'os': OS,
@@ -230,9 +247,20 @@ class ServerClient:
             self.session.headers.update({
                 'Authorization': f'Bearer {Config.API_KEY}'
             })
+        
+        # Policies are resolved per system: sent with every policy request
+        self.policy_params = {'mac_address': get_mac_address()}
+        
+        # Last policy fetched and its ETag, kept across restarts
+        self.policy, self.policy_etag = self._load_cached_policy()
+        self._policy_lock = threading.Lock()
     
     def send_report(self, data, retries=0):
-        """Send activity report to server"""
+        """Send activity report to server
+        
+        Retries resend the same payload; the server drops copies it already
+        stored by MAC address and timestamp.
+        """
         url = f"{Config.SERVER_URL}/api/v1/agent/report"
         
         try:
@@ -253,20 +281,59 @@ class ServerClient:
             return None
     
     def get_policy(self):
-        """Fetch current policy from server"""
+        """Fetch current policy from server
+        
+        The request is conditional on the ETag of the policy we hold, so an
+        unchanged policy costs an empty 304. If the server cannot be reached
+        the last known policy (possibly from disk) is returned.
+        """
         url = f"{Config.SERVER_URL}/api/v1/agent/policy"
+        headers = {'If-None-Match': self.policy_etag} if self.policy and self.policy_etag else {}
         
         try:
-            response = self.session.get(url, timeout=10)
+            response = self.session.get(url, params=self.policy_params, headers=headers, timeout=10)
+            if response.status_code == 304:
+                logger.debug("Policy unchanged")
+                return self.policy
             response.raise_for_status()
             
             policy = response.json()
             logger.info(f"Policy fetched: idle_threshold={policy.get('idle_threshold')}min")
+            self.set_policy(policy, response.headers.get('ETag'))
             return policy
             
         except requests.exceptions.RequestException as e:
             logger.error(f"Failed to fetch policy: {e}")
-            return None
+            return self.policy
+    
+    def set_policy(self, policy, etag):
+        """Adopt a policy from the server and persist it"""
+        with self._policy_lock:
+            self.policy, self.policy_etag = policy, etag
+            self._save_cached_policy()
+    
+    def _load_cached_policy(self):
+        """Policy and ETag saved by a previous run, or (None, None)"""
+        if os.path.exists(Config.POLICY_CACHE_FILE):
+            try:
+                with open(Config.POLICY_CACHE_FILE, 'r') as f:
+                    cached = json.load(f)
+                logger.info(f"Using cached policy until the server answers: "
+                            f"idle_threshold={cached['policy'].get('idle_threshold')}min")
+                return cached['policy'], cached.get('etag')
+            except Exception as e:
+                logger.error(f"Failed to load cached policy: {e}")
+        return None, None
+    
+    def _save_cached_policy(self):
+        """Write the policy to disk (via a temporary file, so a crash never leaves half of it)"""
+        temporary = Config.POLICY_CACHE_FILE + '.tmp'
+        try:
+            with open(temporary, 'w') as f:
+                json.dump({'policy': self.policy, 'etag': self.policy_etag}, f, indent=2)
+            os.replace(temporary, Config.POLICY_CACHE_FILE)
+        except Exception as e:
+            logger.error(f"Failed to save policy: {e}")
     
     def check_health(self):
         """Check server health"""
@@ -279,6 +346,83 @@ class ServerClient:
         except:
             return False
 
+class PolicySubscriber:
+    """Receive policy changes pushed by the server (Server-Sent Events)
+    
+    Runs on a daemon thread and hands every pushed policy to the client.
+    While ``connected`` is false (server unreachable, push disabled or at
+    capacity) the agent polls instead; reconnects back off exponentially
+    with jitter so a restarted server is not hit by the whole fleet at once.
+    """
+    
+    def __init__(self, client):
+        self.client = client
+        self.connected = False
+        self.session = requests.Session()
+        self.session.headers.update(client.session.headers)
+        self._stopping = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='greenops-policy-push', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stopping.set()
+    
+    def _run(self):
+        delay = Config.PUSH_RETRY_MIN
+        while not self._stopping.is_set():
+            try:
+                if self._listen():
+                    delay = Config.PUSH_RETRY_MIN  # the server closed a healthy stream
+            except requests.exceptions.RequestException as e:
+                logger.debug(f"Policy push unavailable: {e}")
+            except Exception as e:
+                logger.error(f"Policy push failed: {e}")
+            
+            if self.connected:
+                logger.info("Policy push disconnected; polling until it is back")
+            self.connected = False
+            self._stopping.wait(delay * random.uniform(0.5, 1.5))
+            delay = min(delay * 2, Config.PUSH_RETRY_MAX)
+    
+    def _listen(self):
+        """Read one event stream; returns True if it ended normally"""
+        url = f"{Config.SERVER_URL}/api/v1/agent/policy/stream"
+        headers = {'Accept': 'text/event-stream'}
+        if self.client.policy and self.client.policy_etag:
+            headers['Last-Event-ID'] = self.client.policy_etag.strip('"')
+        
+        with self.session.get(url, params=self.client.policy_params, headers=headers, stream=True,
+                              timeout=(10, Config.PUSH_READ_TIMEOUT)) as response:
+            response.raise_for_status()
+            self.connected = True
+            logger.info("Policy push connected")
+            
+            event = {}
+            for line in response.iter_lines(decode_unicode=True):
+                if self._stopping.is_set():
+                    return True
+                if line is None or line.startswith(':'):
+                    continue  # keep-alive
+                if line:
+                    field, _, value = line.partition(':')
+                    value = value[1:] if value.startswith(' ') else value
+                    if field == 'data' and 'data' in event:
+                        event['data'] += '\n' + value
+                    else:
+                        event[field] = value
+                    continue
+                
+                # A blank line ends the event
+                if event.get('event') == 'policy' and 'data' in event:
+                    policy = json.loads(event['data'])
+                    self.client.set_policy(policy, f'"{event.get("id", policy.get("version"))}"')
+                    logger.info(f"Policy pushed: idle_threshold={policy.get('idle_threshold')}min")
+                event = {}
+        return True
+
 # ----------------------
 # POLICY EVALUATOR
 # ----------------------
@@ -403,8 +547,9 @@ class GreenOpsAgent:
         self.evaluator = PolicyEvaluator()
         self.stats = StatsTracker()
         self.system_info = get_system_info()
-        self.policy = None
+        self.policy = self.client.policy  # cached from the last run, if any
         self.policy_last_fetched = None
+        self.subscriber = PolicySubscriber(self.client) if Config.POLICY_PUSH else None
         
         logger.info(f"GreenOps Agent v2.0 starting on {OS}")
         logger.info(f"System: {self.system_info['pc_id']}")
@@ -416,6 +561,9 @@ class GreenOpsAgent:
         if not self.client.check_health():
             logger.warning("Server is not reachable. Will retry in background.")
         
+        if self.subscriber:
+            self.subscriber.start()
+        
         logger.info("Agent started successfully")
         logger.info(f"Monitoring interval: {Config.CHECK_INTERVAL} seconds")
         
@@ -433,9 +581,12 @@ class GreenOpsAgent:
     def run_cycle(self):
         """Run one monitoring cycle"""
         try:
-            # Fetch policy periodically (every 10 minutes)
-            if not self.policy or not self.policy_last_fetched or \
-               (datetime.now() - self.policy_last_fetched).seconds > 600:
+            # Pushed changes land on the client; without push, check for a
+            # new policy periodically (a conditional request)
+            if self.subscriber and self.subscriber.connected and self.client.policy:
+                self.policy = self.client.policy
+            elif not self.policy or not self.policy_last_fetched or \
+               (datetime.now() - self.policy_last_fetched).total_seconds() >= Config.POLICY_REFRESH_INTERVAL:
                 self.policy = self.client.get_policy()
                 self.policy_last_fetched = datetime.now()
             
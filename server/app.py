@@ -3,21 +3,41 @@ GreenOps Server v2.0
 Enterprise Carbon Governance Platform
 """
 
-from flask import Flask, request, render_template, jsonify, Response, redirect, url_for
+from flask import Flask, request, render_template, jsonify, Response, redirect, url_for, make_response, stream_with_context, send_file
 from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from functools import wraps
 import os
-import csv
+import re
+import base64
+import click
+import tempfile
+import time
 import json
-from io import StringIO
 import logging
 from logging.handlers import RotatingFileHandler
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.dialects import postgresql, sqlite
+import numpy as np
+from blinker import Namespace
+from background import PeriodicJob, WriteBehindBuffer
+from caching import CachedResponse, LRUCache, LocalCacheBackend, RedisCacheBackend, ResponseCache
+from budget import CarbonBudget, month_start
+from carbon_intensity import CarbonIntensity, read_csv as read_intensity_csv
+from fleet import FleetIndex
+from policies import POLICY_SCOPES, PolicyCache
+from forecasting import HISTORY_HOURS, ForecastStore, IdleForecaster
+from sessions import SLEEP_ACTIONS, SessionState, SessionTracker
+from simulator import POLICY_DEFAULTS, IdleTraces, action_minutes, expand_grid, normalize_candidate, simulate
+from timeutils import epoch_seconds
+from exporters import COLUMNAR_FORMATS, columnar_available, iter_csv, write_columnar, write_monthly_partitions
+import telemetry
 
 # ----------------------
 # CONFIGURATION
@@ -40,15 +60,90 @@ class Config:
     CARBON_BUDGET_MONTHLY = int(os.getenv('CARBON_BUDGET_MONTHLY', 5000))
     CO2_FACTOR = float(os.getenv('CO2_FACTOR', 0.82))
     COST_PER_KWH = float(os.getenv('COST_PER_KWH', 8))
+    BUDGET_RESYNC_INTERVAL = int(os.getenv('BUDGET_RESYNC_INTERVAL', 60))  # seconds
+    CARBON_INTENSITY_SYNC_INTERVAL = int(os.getenv('CARBON_INTENSITY_SYNC_INTERVAL', 300))  # seconds between reload checks
     
     # Power Settings
     DEFAULT_POWER_WATTS = 150
     MONITOR_POWER_WATTS = 30
     
+    # Ingest
+    HEARTBEAT_BATCH_MAX = int(os.getenv('HEARTBEAT_BATCH_MAX', 1000))
+    INGEST_WRITE_BEHIND = os.getenv('INGEST_WRITE_BEHIND', 'false').lower() == 'true'
+    INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', 10000))
+    INGEST_FLUSH_SIZE = int(os.getenv('INGEST_FLUSH_SIZE', 500))
+    INGEST_FLUSH_INTERVAL_MS = int(os.getenv('INGEST_FLUSH_INTERVAL_MS', 500))
+    INGEST_FLUSH_RETRIES = int(os.getenv('INGEST_FLUSH_RETRIES', 5))  # retries of a failed batch before it is split up
+    INGEST_DEAD_LETTER_PATH = os.getenv('INGEST_DEAD_LETTER_PATH', os.path.join('logs', 'ingest_dead_letter.jsonl'))
+    HEARTBEAT_MAX_CLOCK_SKEW = int(os.getenv('HEARTBEAT_MAX_CLOCK_SKEW', 300))  # seconds an agent clock may run ahead
+    HEARTBEAT_MAX_DELAY = int(os.getenv('HEARTBEAT_MAX_DELAY', 7 * 24 * 3600))  # oldest agent timestamp used for bucketing
+    
+    # Idle sessions
+    SESSION_MIN_IDLE_MINUTES = float(os.getenv('SESSION_MIN_IDLE_MINUTES', 5))  # shorter idle stretches are not sessions
+    SESSION_TOLERANCE_SECONDS = int(os.getenv('SESSION_TOLERANCE_SECONDS', 60))  # idle clock jitter between reports
+    SESSION_CHECKPOINT_INTERVAL = int(os.getenv('SESSION_CHECKPOINT_INTERVAL', 300))  # seconds between open session writes
+    
+    # Agent policy
+    POLICY_CACHE_TTL = int(os.getenv('POLICY_CACHE_TTL', 30))  # seconds a worker serves its policy before re-reading it
+    POLICY_PUSH_MAX_CLIENTS = int(os.getenv('POLICY_PUSH_MAX_CLIENTS', 0))  # held connections per process, 0 disables push (needs gevent/threaded workers)
+    POLICY_WATCH_INTERVAL = int(os.getenv('POLICY_WATCH_INTERVAL', 2))  # seconds between change checks while agents wait
+    POLICY_KEEPALIVE_SECONDS = int(os.getenv('POLICY_KEEPALIVE_SECONDS', 25))  # SSE comment interval (under proxy idle timeouts)
+    POLICY_STREAM_MAX_SECONDS = int(os.getenv('POLICY_STREAM_MAX_SECONDS', 300))  # streams end after this; agents reconnect
+    POLICY_LONG_POLL_MAX = int(os.getenv('POLICY_LONG_POLL_MAX', 60))  # longest ?wait= in seconds
+    
+    # Policy simulator
+    SIMULATION_MAX_DAYS = int(os.getenv('SIMULATION_MAX_DAYS', 366))  # longest history a simulation may replay
+    SIMULATION_MAX_CANDIDATES = int(os.getenv('SIMULATION_MAX_CANDIDATES', 1000))
+    
+    # System resolution cache
+    SYSTEM_CACHE_SIZE = int(os.getenv('SYSTEM_CACHE_SIZE', 50000))
+    SYSTEM_CACHE_TTL = int(os.getenv('SYSTEM_CACHE_TTL', 300))  # seconds
+    SYSTEM_TOUCH_INTERVAL = int(os.getenv('SYSTEM_TOUCH_INTERVAL', 60))  # seconds between last_seen writes
+    
+    # System listings
+    SYSTEM_PAGE_SIZE = int(os.getenv('SYSTEM_PAGE_SIZE', 500))
+    SYSTEM_PAGE_MAX = int(os.getenv('SYSTEM_PAGE_MAX', 5000))
+    
+    # Exports
+    EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 2000))  # rows fetched from the DB per chunk
+    EXPORT_ROW_GROUP_SIZE = int(os.getenv('EXPORT_ROW_GROUP_SIZE', 100000))  # rows per Parquet row group
+    
+    # Monthly range partitions for agent_logs (PostgreSQL, new databases only)
+    AGENT_LOG_PARTITIONING = os.getenv('AGENT_LOG_PARTITIONING', 'true').lower() == 'true'
+    AGENT_LOG_PARTITIONS_AHEAD = int(os.getenv('AGENT_LOG_PARTITIONS_AHEAD', 3))  # months created in advance
+    PARTITION_LOCK_TIMEOUT_MS = int(os.getenv('PARTITION_LOCK_TIMEOUT_MS', 2000))  # wait for the lock to drop a partition
+    
+    # Retention
+    LOG_RETENTION_DAYS = int(os.getenv('LOG_RETENTION_DAYS', 0))  # raw agent logs; 0 keeps them forever
+    ROLLUP_HOURLY_RETENTION_DAYS = int(os.getenv('ROLLUP_HOURLY_RETENTION_DAYS', 0))  # daily rollups are always kept
+    RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', 5000))  # rows deleted per transaction
+    RETENTION_BATCH_PAUSE_MS = int(os.getenv('RETENTION_BATCH_PAUSE_MS', 50))  # pause between delete batches
+    RETENTION_INTERVAL = int(os.getenv('RETENTION_INTERVAL', 0))  # seconds between background purges, 0 = CLI only
+    
+    # Offline detection
+    OFFLINE_GRACE_SECONDS = int(os.getenv('OFFLINE_GRACE_SECONDS', 300))  # silence before a system counts as offline
+    OFFLINE_REAPER_INTERVAL = int(os.getenv('OFFLINE_REAPER_INTERVAL', 30))  # seconds, 0 disables the background reaper
+    FLEET_SYNC_INTERVAL = int(os.getenv('FLEET_SYNC_INTERVAL', 30))  # seconds between fleet index catch-ups from the DB
+    
+    # Response cache (dashboard, admin and metrics views)
+    RESPONSE_CACHE_BACKEND = os.getenv('RESPONSE_CACHE_BACKEND', 'local')  # local, redis or none
+    RESPONSE_CACHE_REDIS_URL = os.getenv('RESPONSE_CACHE_REDIS_URL', os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+    RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 1024))
+    RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 10))  # seconds
+    RESPONSE_CACHE_VERSION_INTERVAL = int(os.getenv('RESPONSE_CACHE_VERSION_INTERVAL', 5))  # min seconds between ingest invalidations
+    
     # Features
     DEMO_MODE = os.getenv('DEMO_MODE', 'false').lower() == 'true'
     ENABLE_ML_PREDICTIONS = os.getenv('ENABLE_ML_PREDICTIONS', 'false').lower() == 'true'
     
+    # Idle forecasting (ENABLE_ML_PREDICTIONS)
+    FORECAST_MODEL_PATH = os.getenv('FORECAST_MODEL_PATH', os.path.join('instance', 'forecast_model.npz'))
+    FORECAST_TRAIN_INTERVAL = int(os.getenv('FORECAST_TRAIN_INTERVAL', 3600))  # seconds, 0 = CLI only
+    FORECAST_HISTORY_DAYS = int(os.getenv('FORECAST_HISTORY_DAYS', 28))  # history replayed when (re)training from scratch
+    FORECAST_HALF_LIFE_DAYS = float(os.getenv('FORECAST_HALF_LIFE_DAYS', 14))  # weight of old history halves every N days
+    FORECAST_HORIZON_MAX = int(os.getenv('FORECAST_HORIZON_MAX', 168))  # hours
+    FORECAST_SLEEP_THRESHOLD = float(os.getenv('FORECAST_SLEEP_THRESHOLD', 0.8))  # idle probability worth acting on
+    
     # Rate Limiting
     RATELIMIT_STORAGE_URL = "memory://"
 
@@ -81,6 +176,27 @@ app.logger.addHandler(file_handler)
 app.logger.setLevel(logging.INFO)
 app.logger.info('GreenOps startup')
 
+# Response cache
+if Config.RESPONSE_CACHE_BACKEND == 'redis':
+    response_cache = ResponseCache(
+        RedisCacheBackend(Config.RESPONSE_CACHE_REDIS_URL),
+        Config.RESPONSE_CACHE_TTL,
+        on_lookup=telemetry.record_cache_lookup
+    )
+else:
+    response_cache = ResponseCache(
+        LocalCacheBackend(Config.RESPONSE_CACHE_SIZE),
+        Config.RESPONSE_CACHE_TTL if Config.RESPONSE_CACHE_BACKEND != 'none' else 0,
+        on_lookup=telemetry.record_cache_lookup
+    )
+
+# Signals
+greenops_signals = Namespace()
+
+# Sent after commit for every system status transition, with mac_address,
+# department, lab, old_status (None for new systems) and new_status
+system_status_changed = greenops_signals.signal('system-status-changed')
+
 # ----------------------
 # DATABASE MODELS
 # ----------------------
@@ -123,7 +239,8 @@ class Department(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     users = db.relationship('User', backref='department', lazy=True)
-    systems = db.relationship('System', backref='department', lazy=True)
+    # System.department is the free-text department column, so the backref needs its own name
+    systems = db.relationship('System', backref='department_ref', lazy=True)
     
     def to_dict(self):
         return {
@@ -153,6 +270,13 @@ class System(db.Model):
     agent_version = db.Column(db.String(20))
     is_active = db.Column(db.Boolean, default=True)
     
+    # Keyset pagination and the listing filters
+    __table_args__ = (
+        db.Index('ix_systems_active_last_seen', 'is_active', 'last_seen', 'id'),
+        db.Index('ix_systems_active_status', 'is_active', 'status'),
+        db.Index('ix_systems_department_lab', 'department', 'lab'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -176,21 +300,34 @@ class AgentLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     system_id = db.Column(db.Integer, db.ForeignKey('systems.id'))
     pc_id = db.Column(db.String(100), nullable=False)
-    idle_minutes = db.Column(db.Float, nullable=False)
+    idle_minutes = db.Column(db.Float, nullable=False)  # as reported: idle time since the last input
+    idle_increment = db.Column(db.Float)  # idle minutes this report adds to its session (metrics are based on it)
     action = db.Column(db.String(50), nullable=False)
     reason = db.Column(db.String(255))
     energy_kwh = db.Column(db.Float)
     co2_kg = db.Column(db.Float)
     cost_saved = db.Column(db.Float)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # agent's clock if plausible, else arrival
+    dedupe_key = db.Column(db.String(80))  # MAC + agent timestamp (+ sequence); NULL unless stored under the agent's clock
     
     system = db.relationship('System', backref='logs')
     
+    __table_args__ = (
+        # Per-system history (newest first) in the machine/system detail views
+        db.Index('ix_agent_logs_system_timestamp', 'system_id', 'timestamp'),
+        # Retried reports are dropped on insert. The timestamp is part of the
+        # key because unique indexes on a partitioned table must include the
+        # partition key; only reports stored under the agent's own timestamp
+        # get a key, so every copy of a report lands on the same key.
+        db.Index('ux_agent_logs_dedupe_key', 'dedupe_key', 'timestamp', unique=True),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
             'pc_id': self.pc_id,
             'idle_minutes': self.idle_minutes,
+            'idle_increment': self.idle_increment,
             'action': self.action,
             'reason': self.reason,
             'energy_kwh': self.energy_kwh,
@@ -199,6 +336,39 @@ class AgentLog(db.Model):
             'timestamp': self.timestamp.isoformat() if self.timestamp else None
         }
 
+class IdleSession(db.Model):
+    """One uninterrupted idle (or idle then asleep) interval of a system"""
+    __tablename__ = 'idle_sessions'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    system_id = db.Column(db.Integer, db.ForeignKey('systems.id'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # idle, sleep
+    started_at = db.Column(db.DateTime, nullable=False)
+    ended_at = db.Column(db.DateTime, nullable=False)  # last report while open
+    idle_minutes = db.Column(db.Float, default=0)
+    samples = db.Column(db.Integer, default=0)
+    energy_kwh = db.Column(db.Float, default=0)
+    co2_kg = db.Column(db.Float, default=0)
+    cost_saved = db.Column(db.Float, default=0)
+    is_open = db.Column(db.Boolean, default=True, index=True)
+    
+    __table_args__ = (db.UniqueConstraint('system_id', 'started_at', name='uq_idle_sessions_system_start'),)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'system_id': self.system_id,
+            'kind': self.kind,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'ended_at': self.ended_at.isoformat() if self.ended_at else None,
+            'idle_minutes': self.idle_minutes,
+            'samples': self.samples,
+            'energy_kwh': self.energy_kwh,
+            'co2_kg': self.co2_kg,
+            'cost_saved': self.cost_saved,
+            'is_open': self.is_open
+        }
+
 class Policy(db.Model):
     __tablename__ = 'policies'
     
@@ -212,6 +382,12 @@ class Policy(db.Model):
     warning_duration = db.Column(db.Integer, default=300)
     schedule = db.Column(db.String(100))
     is_active = db.Column(db.Boolean, default=True)
+    # Targeting: organization (NULL on older rows), department, lab or system
+    scope = db.Column(db.String(20), default='organization')
+    department = db.Column(db.String(100))
+    lab = db.Column(db.String(100))
+    mac_address = db.Column(db.String(17))
+    priority = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -226,7 +402,12 @@ class Policy(db.Model):
             'warning_enabled': self.warning_enabled,
             'warning_duration': self.warning_duration,
             'schedule': self.schedule,
-            'is_active': self.is_active
+            'is_active': self.is_active,
+            'scope': self.scope or 'organization',
+            'department': self.department,
+            'lab': self.lab,
+            'mac_address': self.mac_address,
+            'priority': self.priority or 0
         }
 
 class AuditLog(db.Model):
@@ -243,6 +424,62 @@ class AuditLog(db.Model):
     
     user = db.relationship('User', backref='audit_logs')
 
+class IntensityPoint(db.Model):
+    """Grid carbon intensity and/or tariff in force from starts_at until the next point"""
+    __tablename__ = 'carbon_intensity'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    starts_at = db.Column(db.DateTime, nullable=False, unique=True)
+    co2_factor = db.Column(db.Float)  # kg CO2 per kWh; NULL keeps the previous value
+    cost_per_kwh = db.Column(db.Float)  # NULL keeps the previous value
+    source = db.Column(db.String(255))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'starts_at': self.starts_at.isoformat() if self.starts_at else None,
+            'co2_factor': self.co2_factor,
+            'cost_per_kwh': self.cost_per_kwh,
+            'source': self.source
+        }
+
+class RollupMixin:
+    """Per-system agent log totals for one time bucket, maintained at ingest"""
+    
+    id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.DateTime, nullable=False, index=True)
+    system_id = db.Column(db.Integer, nullable=False)
+    department = db.Column(db.String(100))
+    lab = db.Column(db.String(100))
+    energy_kwh = db.Column(db.Float, default=0)
+    co2_kg = db.Column(db.Float, default=0)
+    cost_saved = db.Column(db.Float, default=0)
+    idle_minutes = db.Column(db.Float, default=0)
+    actions = db.Column(db.Integer, default=0)
+    samples = db.Column(db.Integer, default=0)
+    
+    def to_dict(self):
+        return {
+            'bucket': self.bucket.isoformat() if self.bucket else None,
+            'system_id': self.system_id,
+            'department': self.department,
+            'lab': self.lab,
+            'energy_kwh': self.energy_kwh,
+            'co2_kg': self.co2_kg,
+            'cost_saved': self.cost_saved,
+            'idle_minutes': self.idle_minutes,
+            'actions': self.actions,
+            'samples': self.samples
+        }
+
+class HourlyRollup(RollupMixin, db.Model):
+    __tablename__ = 'rollup_hourly'
+    __table_args__ = (db.UniqueConstraint('bucket', 'system_id', name='uq_rollup_hourly_bucket_system'),)
+
+class DailyRollup(RollupMixin, db.Model):
+    __tablename__ = 'rollup_daily'
+    __table_args__ = (db.UniqueConstraint('bucket', 'system_id', name='uq_rollup_daily_bucket_system'),)
+
 # ----------------------
 # DECORATORS
 # ----------------------
@@ -266,6 +503,37 @@ def login_required_web(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def cached_view(ttl=None):
+    """Serve a view from the response cache.
+    
+    The key is the endpoint plus its arguments and query string; entries
+    expire after ttl seconds or when ingest bumps the data version. Put it
+    below any auth decorator so access is still checked on every request.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            key = '|'.join([
+                request.endpoint,
+                repr(sorted(kwargs.items())),
+                repr(sorted(request.args.items(multi=True)))
+            ])
+            state = {}
+            
+            def compute():
+                state['response'] = make_response(f(*args, **kwargs))
+                return CachedResponse(state['response'].get_data(), state['response'].status_code,
+                                      state['response'].mimetype)
+            
+            cached = response_cache.get_or_set(key, compute, ttl, cacheable=lambda cached: cached.status == 200)
+            if cached.status != 200:
+                return state['response']  # errors are never cached and keep their headers
+            response = Response(cached.body, status=cached.status, mimetype=cached.mimetype)
+            response.headers['X-Cache'] = 'MISS' if state else 'HIT'
+            return response
+        return decorated_function
+    return decorator
+
 def log_audit(action, resource=None, resource_id=None, details=None):
     """Log audit trail"""
     try:
@@ -291,14 +559,15 @@ def log_audit(action, resource=None, resource_id=None, details=None):
 # ----------------------
 # HELPER FUNCTIONS
 # ----------------------
-def calculate_metrics(idle_minutes, power_watts=None):
-    """Calculate energy, CO2, and cost metrics"""
+def calculate_metrics(idle_minutes, power_watts=None, at=None):
+    """Calculate energy, CO2, and cost metrics at the intensity and tariff in force at `at` (default: now)"""
     if power_watts is None:
         power_watts = Config.DEFAULT_POWER_WATTS
     
+    co2_factor, cost_per_kwh = carbon_intensity.lookup(at or datetime.utcnow())
     energy_kwh = (power_watts * (idle_minutes / 60)) / 1000
-    co2_kg = energy_kwh * Config.CO2_FACTOR
-    cost_saved = energy_kwh * Config.COST_PER_KWH
+    co2_kg = energy_kwh * co2_factor
+    cost_saved = energy_kwh * cost_per_kwh
     
     return {
         'energy_kwh': round(energy_kwh, 3),
@@ -316,42 +585,1556 @@ def generate_pc_id(mac_address, organization='ORG', department='DEPT', lab='LAB'
     pc_id = f"{organization}-{department}-{lab}-{last4}"
     return pc_id
 
-def get_or_create_system(mac_address, hostname=None, os_name=None, organization='ORG', department='DEPT', lab='LAB'):
+def normalize_mac(mac_address):
+    """Normalize MAC address format (upper case, colon separated)"""
+    return mac_address.upper().replace('-', ':')
+
+class CachedSystem:
+    """Snapshot of the System columns the ingest path needs"""
+    
+    __slots__ = ('id', 'pc_id', 'mac_address', 'power_watts', 'status',
+                 'hostname', 'os', 'department', 'lab', 'last_seen')
+    
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+    
+    def updated(self, changes):
+        """Copy of this snapshot with column changes applied"""
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return CachedSystem(**fields)
+
+# Normalized MAC -> CachedSystem, shared by registration and heartbeats
+system_cache = LRUCache(maxsize=Config.SYSTEM_CACHE_SIZE, ttl=Config.SYSTEM_CACHE_TTL)
+
+def invalidate_system_cache(mac_address=None):
+    """Drop one MAC (or every entry) from the system cache"""
+    if mac_address is None:
+        system_cache.clear()
+    else:
+        system_cache.pop(normalize_mac(mac_address))
+
+@event.listens_for(System, 'after_update')
+@event.listens_for(System, 'after_delete')
+def _invalidate_cached_system(mapper, connection, target):
+    """Any ORM edit to a system invalidates its cached snapshot"""
+    if target.mac_address:
+        invalidate_system_cache(target.mac_address)
+
+def note_status_change(system, old_status, new_status):
+    """Queue a status transition; system_status_changed fires once the session commits"""
+    db.session.info.setdefault('status_changes', []).append({
+        'mac_address': system.mac_address,
+        'department': system.department,
+        'lab': system.lab,
+        'old_status': old_status,
+        'new_status': new_status
+    })
+
+@event.listens_for(db.session, 'after_commit')
+def _publish_status_changes(session):
+    for change in session.info.pop('status_changes', []):
+        system_status_changed.send(app, **change)
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_status_changes(session):
+    session.info.pop('status_changes', None)
+
+@system_status_changed.connect
+def _record_status_metrics(sender, department, old_status, new_status, **extra):
+    telemetry.record_status_change(department, old_status, new_status)
+
+@system_status_changed.connect
+def _update_fleet_status(sender, mac_address, new_status, **extra):
+    fleet.set_status(mac_address, new_status)
+
+def _system_changes(entry, sighting, now):
+    """Columns worth writing for a sighting of a known system.
+    
+    Status, hostname and os are written only when they change. last_seen
+    is refreshed at most once per SYSTEM_TOUCH_INTERVAL seconds unless the
+    row is being written anyway.
+    """
+    changes = {}
+    for column in ('status', 'hostname', 'os'):
+        value = sighting.get(column)
+        if value and value != getattr(entry, column):
+            changes[column] = value
+    
+    if changes or entry.last_seen is None or \
+       (now - entry.last_seen).total_seconds() >= Config.SYSTEM_TOUCH_INTERVAL:
+        changes['last_seen'] = now
+    
+    return changes
+
+def _may_be_reaped(entry, now):
+    # Past the grace period any worker's reaper may have marked the row
+    # offline behind this cache, so its status has to be re-read
+    return entry.last_seen is None or \
+        (now - entry.last_seen).total_seconds() >= Config.OFFLINE_GRACE_SECONDS
+
+def _reconcile_statuses(reported, chunk_size=500):
+    """Write reported statuses that cached snapshots say are already stored.
+    
+    Another worker or the reaper may have changed a row since this worker
+    cached it. Only rows whose stored status differs are locked and
+    written, so the usual case costs one indexed read and no write.
+    `reported` is [(CachedSystem, status)]; returns the number of rows written.
+    """
+    by_status = {}
+    for entry, status in reported:
+        by_status.setdefault(status, {})[entry.id] = entry
+    
+    written = 0
+    for status, entries in by_status.items():
+        ids = list(entries)
+        for start in range(0, len(ids), chunk_size):
+            stale = db.session.execute(
+                db.select(System.id, System.status)
+                .where(System.id.in_(ids[start:start + chunk_size]), System.status != status)
+                .with_for_update()
+            ).all()
+            if not stale:
+                continue
+            db.session.execute(
+                db.update(System).where(System.id.in_([row.id for row in stale])).values(status=status)
+                .execution_options(synchronize_session=False)
+            )
+            for row in stale:
+                note_status_change(entries[row.id], row.status, status)
+            written += len(stale)
+    return written
+
+def resolve_systems(sightings, chunk_size=500):
+    """Resolve {normalized MAC: sighting} to systems in one pass.
+    
+    A sighting carries hostname, os, organization, department, lab and the
+    status to record. Cached MACs skip loading the row (their status is
+    only checked against the stored one), the rest are loaded with chunked
+    IN queries and unknown MACs are created. Changed columns go out as one
+    bulk UPDATE. The session is flushed, not committed: hand the result to
+    cache_systems() after the caller commits.
+    Returns ({MAC: CachedSystem}, number of system rows written).
+    """
+    now = datetime.utcnow()
+    
+    known = {}
+    missing = []
+    for mac in sightings:
+        entry = system_cache.get(mac)
+        if entry is None or _may_be_reaped(entry, now):
+            missing.append(mac)
+        else:
+            known[mac] = entry
+    cached = set(known)
+    
+    columns = [getattr(System, name) for name in CachedSystem.__slots__]
+    for start in range(0, len(missing), chunk_size):
+        chunk = missing[start:start + chunk_size]
+        for row in db.session.execute(db.select(*columns).where(System.mac_address.in_(chunk))):
+            known[row.mac_address] = CachedSystem(**row._asdict())
+    
+    resolved = {}
+    created = []
+    updates = []
+    reported = []
+    for mac, sighting in sightings.items():
+        entry = known.get(mac)
+        
+        if entry is None:
+            # Generate PC ID from MAC
+            pc_id = generate_pc_id(mac, sighting['organization'], sighting['department'], sighting['lab'])
+            system = System(
+                pc_id=pc_id,
+                mac_address=mac,
+                hostname=sighting.get('hostname') or pc_id,
+                os=sighting.get('os'),
+                department=sighting['department'],
+                lab=sighting['lab'],
+                status=sighting.get('status') or 'active',
+                first_seen=now,
+                last_seen=now
+            )
+            db.session.add(system)
+            created.append(system)
+            note_status_change(system, None, system.status)
+            continue
+        
+        changes = _system_changes(entry, sighting, now)
+        if mac in cached and sighting.get('status') and 'status' not in changes:
+            reported.append((entry, sighting['status']))
+        if changes:
+            updates.append({'id': entry.id, **changes})
+            if 'status' in changes:
+                note_status_change(entry, entry.status, changes['status'])
+            entry = entry.updated(changes)
+        resolved[mac] = entry
+    
+    if created:
+        db.session.flush()
+        for system in created:
+            resolved[system.mac_address] = CachedSystem(
+                **{name: getattr(system, name) for name in CachedSystem.__slots__}
+            )
+            app.logger.info(f"New system registered: {system.pc_id} (MAC: {system.mac_address})")
+    
+    if updates:
+        db.session.execute(db.update(System), updates)
+    
+    return resolved, len(created) + len(updates) + _reconcile_statuses(reported, chunk_size)
+
+def cache_systems(resolved):
+    """Publish committed system snapshots to the system cache and fleet index"""
+    for mac, entry in resolved.items():
+        system_cache.set(mac, entry)
+        fleet.merge(mac, entry.status, entry.last_seen, entry.department, entry.lab)
+
+def get_or_create_system(mac_address, hostname=None, os_name=None, organization='ORG',
+                         department='DEPT', lab='LAB', status='active'):
     """Get existing system by MAC or create new one"""
     # Normalize MAC address format
-    mac_normalized = mac_address.upper().replace('-', ':')
+    mac_normalized = normalize_mac(mac_address)
+    
+    resolved, _ = resolve_systems({
+        mac_normalized: {
+            'hostname': hostname,
+            'os': os_name,
+            'organization': organization,
+            'department': department,
+            'lab': lab,
+            'status': status
+        }
+    })
+    db.session.commit()
+    cache_systems(resolved)
+    response_cache.bump('data', min_interval=Config.RESPONSE_CACHE_VERSION_INTERVAL)
     
-    system = System.query.filter_by(mac_address=mac_normalized).first()
+    return resolved[mac_normalized]
+
+def parse_agent_timestamp(value):
+    """ISO 8601 agent timestamp as naive UTC, or None if not given"""
+    if not value:
+        return None
+    
+    try:
+        timestamp = datetime.fromisoformat(str(value))
+    except ValueError:
+        raise ValueError('Invalid timestamp')
     
-    if not system:
-        # Generate PC ID from MAC
-        pc_id = generate_pc_id(mac_normalized, organization, department, lab)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+def report_timestamp(sent_at, received_at):
+    """Time a report is bucketed under: when the agent took it, if plausible.
+    
+    Late deliveries keep their own hour. Timestamps too far ahead of the
+    server clock or older than HEARTBEAT_MAX_DELAY fall back to arrival time.
+    """
+    if sent_at is None or \
+       sent_at > received_at + timedelta(seconds=Config.HEARTBEAT_MAX_CLOCK_SKEW) or \
+       sent_at < received_at - timedelta(seconds=Config.HEARTBEAT_MAX_DELAY):
+        return received_at
+    return sent_at
+
+def heartbeat_dedupe_key(mac_address, sent_at, seq=None):
+    """Idempotency key of a report: MAC, agent timestamp and optional sequence.
+    
+    Pass sent_at=None for reports stored under their arrival time (no
+    timestamp, or an implausible one): that time differs between retries,
+    so the unique index could not catch them and they get no key.
+    """
+    if sent_at is None:
+        return None
+    
+    key = f'{mac_address}@{sent_at.isoformat()}'
+    if seq is not None:
+        key += f'#{seq}'
+    return key
+
+# Free-text heartbeat fields and the widths of the columns they end up in
+HEARTBEAT_TEXT_FIELDS = {
+    'action': AgentLog.__table__.c.action.type.length,
+    'hostname': System.__table__.c.hostname.type.length,
+    'os': System.__table__.c.os.type.length,
+    'department': System.__table__.c.department.type.length,
+    'lab': System.__table__.c.lab.type.length,
+    'organization': System.__table__.c.pc_id.type.length,
+}
+
+def _heartbeat_text(data, name, default=None):
+    value = data.get(name, default)
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f'Invalid {name}')
+    if len(value) > HEARTBEAT_TEXT_FIELDS[name]:
+        raise ValueError(f'{name} is longer than {HEARTBEAT_TEXT_FIELDS[name]} characters')
+    return value
+
+def parse_heartbeat(data):
+    """Validate a heartbeat payload and return a normalized report dict.
+    
+    Text fields are checked against their column widths here, so a report
+    the database would refuse is rejected before it is queued.
+    Raises ValueError with a client-facing message if the payload is invalid.
+    """
+    if not isinstance(data, dict) or not data.get('mac_address'):
+        raise ValueError('Missing mac_address')
+    
+    mac_address = normalize_mac(str(data['mac_address']))
+    if len(mac_address) > System.__table__.c.mac_address.type.length:
+        raise ValueError('Invalid mac_address')
+    
+    try:
+        idle_minutes = float(data.get('idle_minutes', 0) or 0)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid idle_minutes')
+    
+    if idle_minutes < 0:
+        raise ValueError('Invalid idle_minutes')
+    
+    seq = data.get('seq')
+    if seq is not None:
+        if isinstance(seq, bool) or not isinstance(seq, int) or seq < 0:
+            raise ValueError('Invalid seq')
+    
+    threshold = data.get('threshold', 15)
+    if isinstance(threshold, bool) or not isinstance(threshold, (int, float)):
+        raise ValueError('Invalid threshold')
+    
+    action = _heartbeat_text(data, 'action') or 'NONE'
+    organization = _heartbeat_text(data, 'organization', 'ORG')
+    department = _heartbeat_text(data, 'department', 'DEPT')
+    lab = _heartbeat_text(data, 'lab', 'LAB')
+    if len(generate_pc_id(mac_address, organization, department, lab)) > System.__table__.c.pc_id.type.length:
+        raise ValueError('organization, department and lab are too long together')
+    
+    sent_at = parse_agent_timestamp(data.get('timestamp'))
+    received_at = datetime.utcnow()
+    timestamp = report_timestamp(sent_at, received_at)
+    if timestamp != sent_at:
+        if sent_at is not None:
+            app.logger.warning(f"Heartbeat from {mac_address} timestamped {sent_at.isoformat()}, off by "
+                               f"{(sent_at - received_at).total_seconds():.0f}s; stored under its arrival time")
+        sent_at = None
+    
+    return {
+        'mac_address': mac_address,
+        'idle_minutes': idle_minutes,
+        'action': action,
+        'threshold': threshold,
+        'hostname': _heartbeat_text(data, 'hostname'),
+        'os': _heartbeat_text(data, 'os'),
+        'organization': organization,
+        'department': department,
+        'lab': lab,
+        'received_at': received_at,
+        'timestamp': timestamp,
+        'dedupe_key': heartbeat_dedupe_key(mac_address, sent_at, seq)
+    }
+
+def heartbeat_status(idle_minutes, action):
+    """Derive system status from a heartbeat"""
+    if idle_minutes > 30:
+        return 'idle'
+    elif action in ['SLEEP', 'HIBERNATE']:
+        return 'sleeping'
+    return 'active'
+
+def heartbeat_reason(action, threshold=15):
+    """Human-readable reason stored with an agent log entry"""
+    if action == 'SLEEP':
+        return f'Idle exceeded {threshold} minute threshold'
+    elif action == 'NONE':
+        return 'Within allowed activity window'
+    return None
+
+def insert_agent_logs(rows):
+    """Bulk insert agent log rows, skipping dedupe keys already stored.
+    
+    Returns the rows that were inserted. Duplicates are dropped by the
+    database with ON CONFLICT DO NOTHING on (dedupe_key, timestamp) and
+    told apart by the keys RETURNING hands back, so a retry costs no extra
+    round trip.
+    """
+    if not any(row['dedupe_key'] for row in rows):
+        db.session.execute(db.insert(AgentLog), rows)
+        return rows
+    
+    table = AgentLog.__table__
+    dialect = db.engine.dialect.name
+    
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(table).on_conflict_do_nothing().returning(table.c.dedupe_key)
+        inserted = set(db.session.execute(stmt, rows).scalars())
+    else:
+        # Portable fallback: look up the same (dedupe_key, timestamp) pairs the index holds
+        keys = [row['dedupe_key'] for row in rows if row['dedupe_key']]
+        stored = set(db.session.execute(
+            db.select(table.c.dedupe_key, table.c.timestamp).where(table.c.dedupe_key.in_(keys))
+        ).tuples())
+        rows = [row for row in rows if (row['dedupe_key'], row['timestamp']) not in stored]
+        if rows:
+            db.session.execute(table.insert(), rows)
+        inserted = {row['dedupe_key'] for row in rows}
+    
+    return [row for row in rows if row['dedupe_key'] is None or row['dedupe_key'] in inserted]
+
+def ingest_heartbeats(reports):
+    """Persist a batch of parsed heartbeat reports in a single transaction.
+    
+    Systems are resolved once for the whole batch, system rows are only
+    written on a status/host change or once per SYSTEM_TOUCH_INTERVAL, and
+    the agent log rows go out as one bulk INSERT before a single commit.
+    Reports whose dedupe key is already stored (agent retries) are not
+    logged or counted again. Metrics are based on the idle minutes each
+    report adds to its system's idle session, not on the cumulative
+    idle_minutes it carries.
+    Returns a (CachedSystem, metrics, duplicate) triple per report.
+    """
+    # Latest report per MAC decides hostname, os and status
+    sightings = {}
+    for report in reports:
+        sightings[report['mac_address']] = {
+            **report,
+            'status': heartbeat_status(report['idle_minutes'], report['action'])
+        }
+    
+    systems, system_rows = resolve_systems(sightings)
+    
+    # Advance idle sessions in time order (store-and-forward batches may not be)
+    increments = {}  # report index -> idle minutes it adds; absent for in-batch copies
+    seen = set()
+    sessions = {}  # MAC -> last idle session after this batch
+    closed = []
+    for index in sorted(range(len(reports)), key=lambda i: reports[i]['timestamp']):
+        report = reports[index]
+        if report['dedupe_key']:
+            if report['dedupe_key'] in seen:
+                continue
+            seen.add(report['dedupe_key'])
         
-        system = System(
-            pc_id=pc_id,
-            mac_address=mac_normalized,
-            hostname=hostname or pc_id,
-            os=os_name,
-            department=department,
-            lab=lab,
-            status='active',
-            first_seen=datetime.utcnow(),
-            last_seen=datetime.utcnow()
+        mac = report['mac_address']
+        session, ended, increments[index] = session_tracker.observe(
+            sessions.get(mac, session_tracker.get(mac)), systems[mac].id,
+            report['timestamp'], report['idle_minutes'], report['action']
+        )
+        sessions[mac] = session
+        if ended:
+            closed.append(ended)
+    
+    results = []
+    rows = []
+    for index, report in enumerate(reports):
+        system = systems[report['mac_address']]
+        idle_minutes = report['idle_minutes']
+        action = report['action']
+        increment = increments.get(index, 0.0)
+        metrics = calculate_metrics(increment, system.power_watts, report['timestamp'])
+        
+        results.append((system, metrics, report['dedupe_key']))
+        if index not in increments:
+            continue  # the same report twice in one batch
+        rows.append({
+            'system_id': system.id,
+            'pc_id': system.pc_id,
+            'idle_minutes': idle_minutes,
+            'idle_increment': round(increment, 3),
+            'action': action,
+            'reason': heartbeat_reason(action, report['threshold']),
+            'energy_kwh': metrics['energy_kwh'],
+            'co2_kg': metrics['co2_kg'],
+            'cost_saved': metrics['cost_saved'] if action != 'NONE' else 0,
+            'timestamp': report['timestamp'],
+            'dedupe_key': report['dedupe_key']
+        })
+    
+    rows = insert_agent_logs(rows)
+    daily = update_rollups(rows, {system.id: system for system in systems.values()})
+    sessions = save_sessions(sessions, closed, systems)
+    db.session.commit()
+    cache_systems(systems)
+    session_tracker.apply(sessions)
+    response_cache.bump('data', min_interval=Config.RESPONSE_CACHE_VERSION_INTERVAL)
+    
+    for delta in daily:
+        carbon_budget.add(delta['bucket'], delta['department'],
+                          delta['co2_kg'], delta['energy_kwh'], delta['cost_saved'])
+    publish_budget_metrics()
+    
+    telemetry.record_ingest(len(reports), system_rows, len(rows), duplicates=len(reports) - len(rows))
+    departments = {system.id: system.department for system in systems.values()}
+    for row in rows:
+        telemetry.record_usage(departments.get(row['system_id']), row['action'],
+                               row['energy_kwh'], row['co2_kg'], row['cost_saved'])
+    
+    # A keyed report is new only for the first of its copies that was inserted
+    fresh = {row['dedupe_key'] for row in rows}
+    marked = []
+    for system, metrics, key in results:
+        duplicate = key is not None and key not in fresh
+        fresh.discard(key)
+        marked.append((system, metrics, duplicate))
+    return marked
+
+def _flush_heartbeats(reports):
+    """Write-behind flush callback (runs on the buffer's background thread)"""
+    with app.app_context():
+        try:
+            ingest_heartbeats(reports)
+        except Exception:
+            db.session.rollback()
+            raise
+
+def _dead_letter_heartbeat(report, error):
+    """Append a report the buffer gave up on to INGEST_DEAD_LETTER_PATH"""
+    app.logger.error(f"Heartbeat from {report['mac_address']} at {report['timestamp']} dropped: {error}")
+    if not Config.INGEST_DEAD_LETTER_PATH:
+        return
+    with open(Config.INGEST_DEAD_LETTER_PATH, 'a') as f:
+        f.write(json.dumps({'error': str(error), 'report': report}, default=str) + '\n')
+
+ingest_buffer = WriteBehindBuffer(
+    _flush_heartbeats,
+    max_size=Config.INGEST_QUEUE_SIZE,
+    flush_size=Config.INGEST_FLUSH_SIZE,
+    flush_interval=Config.INGEST_FLUSH_INTERVAL_MS / 1000,
+    max_retries=Config.INGEST_FLUSH_RETRIES,
+    on_failure=_dead_letter_heartbeat
+)
+
+# Columns of System.to_dict(), selectable with fields=
+SYSTEM_FIELDS = ('id', 'pc_id', 'mac_address', 'hostname', 'os', 'department', 'lab', 'department_id',
+                 'power_watts', 'status', 'first_seen', 'last_seen', 'registered_at')
+SYSTEM_SORTS = ('last_seen', 'id')
+
+def _encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def _decode_cursor(cursor, sort):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if sort == 'last_seen':
+            return datetime.fromisoformat(values[0]), int(values[1])
+        return (int(values[0]),)
+    except (ValueError, TypeError, IndexError, KeyError):
+        raise ValueError('Invalid cursor')
+
+def parse_system_listing(args):
+    """Validate listing query parameters into keyword arguments for list_systems().
+    
+    Raises ValueError with a client-facing message on bad input.
+    """
+    sort = args.get('sort', 'last_seen')
+    if sort not in SYSTEM_SORTS:
+        raise ValueError(f"sort must be one of: {', '.join(SYSTEM_SORTS)}")
+    
+    try:
+        limit = int(args.get('limit', Config.SYSTEM_PAGE_SIZE))
+    except ValueError:
+        raise ValueError('Invalid limit')
+    if not 1 <= limit <= Config.SYSTEM_PAGE_MAX:
+        raise ValueError(f"limit must be between 1 and {Config.SYSTEM_PAGE_MAX}")
+    
+    fields = SYSTEM_FIELDS
+    if args.get('fields'):
+        fields = tuple(field.strip() for field in args['fields'].split(',') if field.strip())
+        unknown = [field for field in fields if field not in SYSTEM_FIELDS]
+        if unknown or not fields:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    
+    cursor = args.get('cursor')
+    return {
+        'status': args.get('status'),
+        'department': args.get('department'),
+        'lab': args.get('lab'),
+        'sort': sort,
+        'limit': limit,
+        'cursor': _decode_cursor(cursor, sort) if cursor else None,
+        'fields': fields
+    }
+
+def system_filters(status=None, department=None, lab=None):
+    """WHERE clauses for active systems with the listing filters"""
+    filters = [System.is_active == True]
+    if status:
+        filters.append(System.status == status)
+    if department:
+        filters.append(System.department == department)
+    if lab:
+        filters.append(System.lab == lab)
+    return filters
+
+def system_listing_query(status=None, department=None, lab=None, sort='last_seen', cursor=None,
+                         fields=SYSTEM_FIELDS):
+    """SELECT for the listing endpoints, positioned after a decoded cursor"""
+    sort_columns = ('last_seen', 'id') if sort == 'last_seen' else ('id',)
+    names = list(dict.fromkeys(fields + sort_columns))
+    query = db.select(*[getattr(System, name) for name in names]).where(*system_filters(status, department, lab))
+    
+    if sort == 'last_seen':
+        if cursor:
+            query = query.where(db.tuple_(System.last_seen, System.id) < cursor)
+        return query.order_by(System.last_seen.desc(), System.id.desc())
+    
+    if cursor:
+        query = query.where(System.id > cursor[0])
+    return query.order_by(System.id)
+
+def list_systems(status=None, department=None, lab=None, sort='last_seen', limit=500,
+                 cursor=None, fields=SYSTEM_FIELDS):
+    """One page of active systems as dicts, plus the cursor for the next page.
+    
+    `cursor` is a decoded cursor from parse_system_listing(). Pages are
+    keyset-paginated, newest last_seen first (ties broken by id) or by
+    ascending id, so deep pages cost the same as the first. Only the
+    requested columns are selected.
+    """
+    query = system_listing_query(status, department, lab, sort, cursor, fields)
+    rows = db.session.execute(query.limit(limit + 1)).all()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        if sort == 'last_seen':
+            next_cursor = _encode_cursor([last.last_seen.isoformat(), last.id])
+        else:
+            next_cursor = _encode_cursor([last.id])
+    
+    items = []
+    for row in rows:
+        item = {}
+        for name in fields:
+            value = getattr(row, name)
+            item[name] = value.isoformat() if isinstance(value, datetime) else value
+        items.append(item)
+    
+    return items, next_cursor
+
+# ----------------------
+# ROLLUPS
+# ----------------------
+ROLLUP_SUMS = ('energy_kwh', 'co2_kg', 'cost_saved', 'idle_minutes', 'actions', 'samples')
+
+def hour_bucket(timestamp):
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+def day_bucket(timestamp):
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _rollup_deltas(rows, systems, bucket_fn):
+    """Sum agent log rows into {(bucket, system_id): totals}"""
+    deltas = {}
+    for row in rows:
+        key = (bucket_fn(row['timestamp']), row['system_id'])
+        delta = deltas.get(key)
+        if delta is None:
+            system = systems.get(row['system_id'])
+            delta = deltas[key] = {
+                'bucket': key[0],
+                'system_id': key[1],
+                'department': system.department if system else None,
+                'lab': system.lab if system else None,
+                **{column: 0 for column in ROLLUP_SUMS}
+            }
+        delta['energy_kwh'] += row['energy_kwh'] or 0
+        delta['co2_kg'] += row['co2_kg'] or 0
+        delta['cost_saved'] += row['cost_saved'] or 0
+        delta['idle_minutes'] += row['idle_increment'] or 0
+        delta['actions'] += 1 if row['action'] != 'NONE' else 0
+        delta['samples'] += 1
+    
+    # Stable lock order for concurrent upserts
+    return [deltas[key] for key in sorted(deltas)]
+
+def _upsert_rollups(model, deltas):
+    """Add deltas onto existing rollup rows, inserting missing buckets"""
+    if not deltas:
+        return
+    
+    table = model.__table__
+    dialect = db.engine.dialect.name
+    
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['bucket', 'system_id'],
+            set_={
+                'department': stmt.excluded.department,
+                'lab': stmt.excluded.lab,
+                **{column: table.c[column] + stmt.excluded[column] for column in ROLLUP_SUMS}
+            }
         )
-        db.session.add(system)
+        db.session.execute(stmt, deltas)
+        return
+    
+    # Portable fallback: increment in place, insert buckets that are new
+    for delta in deltas:
+        result = db.session.execute(
+            table.update()
+            .where(table.c.bucket == delta['bucket'], table.c.system_id == delta['system_id'])
+            .values(**{column: table.c[column] + delta[column] for column in ROLLUP_SUMS})
+        )
+        if result.rowcount == 0:
+            db.session.execute(table.insert().values(**delta))
+
+def update_rollups(rows, systems):
+    """Fold freshly inserted agent log rows into the hourly and daily rollups.
+    
+    `systems` maps system id to an object with department and lab. Runs in
+    the caller's transaction. Returns the daily deltas that were applied.
+    """
+    daily = _rollup_deltas(rows, systems, day_bucket)
+    _upsert_rollups(HourlyRollup, _rollup_deltas(rows, systems, hour_bucket))
+    _upsert_rollups(DailyRollup, daily)
+    return daily
+
+def rebuild_rollups(start, end, progress=None):
+    """Recompute hourly and daily rollups for whole days in [start, end).
+    
+    Works one hour at a time with a GROUP BY over agent_logs, so memory
+    stays bounded whatever the window. Commits once per day.
+    """
+    day = day_bucket(start)
+    end = day_bucket(end) + (timedelta(days=1) if end != day_bucket(end) else timedelta())
+    
+    while day < end:
+        next_day = day + timedelta(days=1)
+        
+        for model in (HourlyRollup, DailyRollup):
+            model.query.filter(model.bucket >= day, model.bucket < next_day).delete(synchronize_session=False)
+        
+        hour = day
+        while hour < next_day:
+            next_hour = hour + timedelta(hours=1)
+            totals = db.session.query(
+                AgentLog.system_id,
+                System.department,
+                System.lab,
+                db.func.coalesce(db.func.sum(AgentLog.energy_kwh), 0),
+                db.func.coalesce(db.func.sum(AgentLog.co2_kg), 0),
+                db.func.coalesce(db.func.sum(AgentLog.cost_saved), 0),
+                # Rows from before idle sessions only have the cumulative value
+                db.func.coalesce(db.func.sum(db.func.coalesce(AgentLog.idle_increment, AgentLog.idle_minutes)), 0),
+                db.func.sum(db.case((AgentLog.action != 'NONE', 1), else_=0)),
+                db.func.count(AgentLog.id)
+            ).outerjoin(System, System.id == AgentLog.system_id)\
+             .filter(AgentLog.timestamp >= hour, AgentLog.timestamp < next_hour, AgentLog.system_id.isnot(None))\
+             .group_by(AgentLog.system_id, System.department, System.lab).all()
+            
+            hourly = [
+                dict(zip(('system_id', 'department', 'lab') + ROLLUP_SUMS, row), bucket=hour)
+                for row in totals
+            ]
+            if hourly:
+                db.session.execute(db.insert(HourlyRollup), hourly)
+            hour = next_hour
+        
+        daily = db.session.query(
+            HourlyRollup.system_id,
+            db.func.max(HourlyRollup.department),
+            db.func.max(HourlyRollup.lab),
+            *[db.func.sum(getattr(HourlyRollup, column)) for column in ROLLUP_SUMS]
+        ).filter(HourlyRollup.bucket >= day, HourlyRollup.bucket < next_day)\
+         .group_by(HourlyRollup.system_id).all()
+        
+        if daily:
+            db.session.execute(db.insert(DailyRollup), [
+                dict(zip(('system_id', 'department', 'lab') + ROLLUP_SUMS, row), bucket=day)
+                for row in daily
+            ])
+        
         db.session.commit()
-        app.logger.info(f"New system registered: {pc_id} (MAC: {mac_normalized})")
+        if progress:
+            progress(day, len(daily))
+        day = next_day
+
+ROLLUP_GRANULARITIES = ('hour', 'day', 'week', 'month')
+
+def rollup_model(granularity):
+    """Finest rollup table that can serve a granularity"""
+    return HourlyRollup if granularity == 'hour' else DailyRollup
+
+def bucket_label(column, granularity):
+    """SQL expression labelling a timestamp with its bucket.
+    
+    Labels are ISO strings ('2026-01-05T13:00:00' for hours, '2026-01-05'
+    otherwise, weeks starting on Monday) and come out identical on
+    PostgreSQL and SQLite. Returns None for other dialects, where callers
+    bucket in Python via bucket_label_for().
+    """
+    dialect = db.engine.dialect.name
+    
+    if dialect == 'postgresql':
+        if granularity == 'hour':
+            return db.func.to_char(db.func.date_trunc('hour', column), 'YYYY-MM-DD"T"HH24:00:00')
+        return db.func.to_char(db.func.date_trunc(granularity, column), 'YYYY-MM-DD')
+    
+    if dialect == 'sqlite':
+        if granularity == 'hour':
+            return db.func.strftime('%Y-%m-%dT%H:00:00', column)
+        if granularity == 'week':
+            return db.func.strftime('%Y-%m-%d', column, 'weekday 0', '-6 days')
+        if granularity == 'month':
+            return db.func.strftime('%Y-%m-01', column)
+        return db.func.strftime('%Y-%m-%d', column)
+    
+    return None
+
+def bucket_label_for(timestamp, granularity):
+    """Python equivalent of bucket_label()"""
+    if granularity == 'hour':
+        return timestamp.strftime('%Y-%m-%dT%H:00:00')
+    if granularity == 'week':
+        return (timestamp - timedelta(days=timestamp.weekday())).strftime('%Y-%m-%d')
+    if granularity == 'month':
+        return timestamp.strftime('%Y-%m-01')
+    return timestamp.strftime('%Y-%m-%d')
+
+def _filter_rollups(query, model, since, until=None, department=None, lab=None):
+    query = query.filter(model.bucket >= since)
+    if until is not None:
+        query = query.filter(model.bucket < until)
+    if department:
+        query = query.filter(model.department == department)
+    if lab:
+        query = query.filter(model.lab == lab)
+    return query
+
+def rollup_totals(model, since, until=None, department=None, lab=None):
+    """Summed rollup columns for buckets in [since, until)"""
+    query = db.session.query(
+        *[db.func.coalesce(db.func.sum(getattr(model, column)), 0) for column in ROLLUP_SUMS]
+    )
+    query = _filter_rollups(query, model, since, until, department, lab)
+    
+    return dict(zip(ROLLUP_SUMS, query.one()))
+
+def rollup_series(granularity, since, until=None, department=None, lab=None):
+    """Rollup totals per time bucket, aggregated in the database.
+    
+    Returns a list of dicts ordered by bucket, each with a 'bucket' label
+    (see bucket_label) and the summed ROLLUP_SUMS columns.
+    """
+    model = rollup_model(granularity)
+    sums = [db.func.sum(getattr(model, column)) for column in ROLLUP_SUMS]
+    label = bucket_label(model.bucket, granularity)
+    
+    if label is None:
+        # No portable bucketing on this dialect: group by the stored bucket
+        # in SQL, then merge into coarser buckets here
+        query = _filter_rollups(db.session.query(model.bucket, *sums), model, since, until, department, lab)
+        series = {}
+        for bucket, *values in query.group_by(model.bucket):
+            key = bucket_label_for(bucket, granularity)
+            totals = series.setdefault(key, {column: 0 for column in ROLLUP_SUMS})
+            for column, value in zip(ROLLUP_SUMS, values):
+                totals[column] += value or 0
+        return [{'bucket': key, **series[key]} for key in sorted(series)]
+    
+    label = label.label('bucket_label')
+    query = _filter_rollups(db.session.query(label, *sums), model, since, until, department, lab)
+    
+    return [
+        {'bucket': bucket, **{column: value or 0 for column, value in zip(ROLLUP_SUMS, values)}}
+        for bucket, *values in query.group_by(label).order_by(label)
+    ]
+
+# ----------------------
+# IDLE SESSIONS
+# ----------------------
+# Open session per MAC, as of the last committed heartbeat. Like the fleet
+# index this lives in the process, so with several workers each agent's
+# reports should reach the same one (e.g. by hashing on the client address).
+session_tracker = SessionTracker(Config.SESSION_MIN_IDLE_MINUTES, Config.SESSION_TOLERANCE_SECONDS)
+
+def save_sessions(sessions, closed, systems):
+    """Write closed sessions and open ones due for a checkpoint.
+    
+    `sessions` maps MAC to its latest state and `closed` lists sessions
+    that ended; `systems` maps MAC to CachedSystem. An open session is
+    written when it starts and then at most once per
+    SESSION_CHECKPOINT_INTERVAL, so a restart can lose at most that much of
+    its progress. Runs in the caller's transaction and returns `sessions`
+    with the written states marked.
+    """
+    checkpoint = timedelta(seconds=Config.SESSION_CHECKPOINT_INTERVAL)
+    due = list(closed)
+    for mac, session in sessions.items():
+        if session is not None and session.is_open and \
+           (session.written_at is None or session.ended_at - session.written_at >= checkpoint):
+            due.append(session)
+            sessions[mac] = session.updated(written_at=session.ended_at)
+    
+    if not due:
+        return sessions
+    
+    power = {system.id: system.power_watts for system in systems.values()}
+    rows = []
+    for session in due:
+        metrics = calculate_metrics(session.idle_minutes, power.get(session.system_id), session_midpoint(session))
+        rows.append({
+            'system_id': session.system_id,
+            'kind': session.kind,
+            'started_at': session.started_at,
+            'ended_at': session.ended_at,
+            'idle_minutes': round(session.idle_minutes, 3),
+            'samples': session.samples,
+            'energy_kwh': metrics['energy_kwh'],
+            'co2_kg': metrics['co2_kg'],
+            'cost_saved': metrics['cost_saved'] if session.kind == 'sleep' else 0,
+            'is_open': session.is_open
+        })
+    
+    table = IdleSession.__table__
+    dialect = db.engine.dialect.name
+    
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['system_id', 'started_at'],
+            set_={column: stmt.excluded[column] for column in rows[0] if column not in ('system_id', 'started_at')}
+        )
+        db.session.execute(stmt, rows)
+        return sessions
+    
+    # Portable fallback: update in place, insert sessions that are new
+    for row in rows:
+        result = db.session.execute(
+            table.update()
+            .where(table.c.system_id == row['system_id'], table.c.started_at == row['started_at'])
+            .values(**row)
+        )
+        if result.rowcount == 0:
+            db.session.execute(table.insert().values(**row))
+    return sessions
+
+def session_midpoint(session):
+    """Instant a session's totals are priced at"""
+    return session.started_at + (session.ended_at - session.started_at) / 2
+
+def load_sessions():
+    """Resume the open sessions stored before the last shutdown"""
+    rows = db.session.execute(
+        db.select(System.mac_address, IdleSession.system_id, IdleSession.kind, IdleSession.started_at,
+                  IdleSession.ended_at, IdleSession.idle_minutes, IdleSession.samples)
+        .join(System, System.id == IdleSession.system_id)
+        .where(IdleSession.is_open == True)
+    )
+    session_tracker.load({
+        row.mac_address: SessionState(row.system_id, row.kind, row.started_at, row.ended_at,
+                                      row.idle_minutes or 0.0, row.samples or 0, written_at=row.ended_at)
+        for row in rows
+    })
+
+# ----------------------
+# CARBON INTENSITY
+# ----------------------
+# Grid intensity and tariff over time, from the carbon_intensity table.
+# With no points loaded every lookup returns CO2_FACTOR / COST_PER_KWH.
+carbon_intensity = CarbonIntensity(Config.CO2_FACTOR, Config.COST_PER_KWH)
+
+INTENSITY_COLUMNS = (IntensityPoint.starts_at, IntensityPoint.co2_factor, IntensityPoint.cost_per_kwh)
+
+def load_carbon_intensity(force=True):
+    """Reload the intensity series; unless forced, only if the table changed"""
+    fingerprint = tuple(db.session.execute(
+        db.select(db.func.count(IntensityPoint.id), db.func.max(IntensityPoint.updated_at))
+    ).one())
+    if not force and fingerprint == carbon_intensity.fingerprint:
+        return False
+    
+    carbon_intensity.reset(db.session.execute(db.select(*INTENSITY_COLUMNS)).all(), fingerprint)
+    return True
+
+def import_carbon_intensity(points, source=None):
+    """Upsert (starts_at, co2_factor, cost_per_kwh) points and reload the series.
+    
+    A point that already exists is overwritten, except that a value left
+    empty keeps the stored one, so intensity and tariff files can be
+    imported separately. Returns the number of points written.
+    """
+    if not points:
+        return 0
+    
+    now = datetime.utcnow()
+    rows = [
+        {'starts_at': starts_at, 'co2_factor': co2_factor, 'cost_per_kwh': cost_per_kwh,
+         'source': source, 'updated_at': now}
+        for starts_at, co2_factor, cost_per_kwh in points
+    ]
+    table = IntensityPoint.__table__
+    dialect = db.engine.dialect.name
+    
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['starts_at'],
+            set_={
+                'co2_factor': db.func.coalesce(stmt.excluded.co2_factor, table.c.co2_factor),
+                'cost_per_kwh': db.func.coalesce(stmt.excluded.cost_per_kwh, table.c.cost_per_kwh),
+                'source': db.func.coalesce(stmt.excluded.source, table.c.source),
+                'updated_at': stmt.excluded.updated_at
+            }
+        )
+        db.session.execute(stmt, rows)
+    else:
+        # Portable fallback: update in place, insert points that are new
+        for row in rows:
+            values = {key: value for key, value in row.items() if value is not None and key != 'starts_at'}
+            result = db.session.execute(table.update().where(table.c.starts_at == row['starts_at']).values(**values))
+            if result.rowcount == 0:
+                db.session.execute(table.insert().values(**row))
+    
+    db.session.commit()
+    load_carbon_intensity()
+    return len(rows)
+
+def reprice_history(start, end, batch_size=5000, progress=None):
+    """Recompute co2_kg/cost_saved of agent logs and idle sessions in whole
+    days of [start, end) from the current intensity series, then rebuild
+    the rollups of those days and reload the carbon budget.
+    
+    Logs are read and updated in id-ordered batches and priced with one
+    vectorized lookup per batch. Commits once per day.
+    """
+    logs = AgentLog.__table__
+    sessions = IdleSession.__table__
+    update_log = logs.update().where(
+        logs.c.id == db.bindparam('_id'), logs.c.timestamp == db.bindparam('_timestamp')
+    ).values(co2_kg=db.bindparam('_co2_kg'), cost_saved=db.bindparam('_cost_saved'))
+    update_session = sessions.update().where(sessions.c.id == db.bindparam('_id'))\
+        .values(co2_kg=db.bindparam('_co2_kg'), cost_saved=db.bindparam('_cost_saved'))
+    
+    day = day_bucket(start)
+    end = day_bucket(end) + (timedelta(days=1) if end != day_bucket(end) else timedelta())
+    repriced = 0
+    
+    while day < end:
+        next_day = day + timedelta(days=1)
+        last_id = 0
+        rows = 0
+        
+        while True:
+            batch = db.session.execute(
+                db.select(logs.c.id, logs.c.timestamp, logs.c.energy_kwh, logs.c.action)
+                .where(logs.c.timestamp >= day, logs.c.timestamp < next_day, logs.c.id > last_id)
+                .order_by(logs.c.id).limit(batch_size)
+            ).all()
+            if not batch:
+                break
+            
+            ids, timestamps, energy, actions = zip(*batch)
+            co2_kg, cost = carbon_intensity.price(timestamps, [kwh or 0 for kwh in energy])
+            db.session.execute(update_log, [
+                {'_id': log_id, '_timestamp': timestamp, '_co2_kg': round(float(co2), 3),
+                 '_cost_saved': round(float(saved), 2) if action != 'NONE' else 0}
+                for log_id, timestamp, action, co2, saved in zip(ids, timestamps, actions, co2_kg, cost)
+            ])
+            rows += len(batch)
+            last_id = ids[-1]
+        
+        day_sessions = db.session.execute(
+            db.select(sessions.c.id, sessions.c.kind, sessions.c.started_at, sessions.c.ended_at, sessions.c.energy_kwh)
+            .where(sessions.c.started_at >= day, sessions.c.started_at < next_day)
+        ).all()
+        if day_sessions:
+            co2_kg, cost = carbon_intensity.price(
+                [session_midpoint(session) for session in day_sessions],
+                [session.energy_kwh or 0 for session in day_sessions]
+            )
+            db.session.execute(update_session, [
+                {'_id': session.id, '_co2_kg': round(float(co2), 3),
+                 '_cost_saved': round(float(saved), 2) if session.kind == 'sleep' else 0}
+                for session, co2, saved in zip(day_sessions, co2_kg, cost)
+            ])
+        
+        # Commits the day, log and session updates included
+        rebuild_rollups(day, next_day)
+        repriced += rows
+        if progress:
+            progress(day, rows, len(day_sessions))
+        day = next_day
+    
+    sync_carbon_budget()
+    response_cache.bump('data')
+    return repriced
+
+def _run_intensity_sync():
+    with app.app_context():
+        load_carbon_intensity(force=False)
+
+# Picks up points imported through other processes (e.g. the CLI)
+intensity_sync = PeriodicJob(_run_intensity_sync, Config.CARBON_INTENSITY_SYNC_INTERVAL,
+                             name='greenops-carbon-intensity')
+
+# ----------------------
+# CARBON BUDGET
+# ----------------------
+carbon_budget = CarbonBudget(Config.CARBON_BUDGET_MONTHLY)
+
+def sync_carbon_budget(now=None):
+    """Reload month-to-date totals from the daily rollups (one GROUP BY)"""
+    now = now or datetime.utcnow()
+    month = month_start(now)
+    
+    rows = db.session.query(
+        DailyRollup.department,
+        db.func.sum(DailyRollup.co2_kg),
+        db.func.sum(DailyRollup.energy_kwh),
+        db.func.sum(DailyRollup.cost_saved)
+    ).filter(DailyRollup.bucket >= month).group_by(DailyRollup.department).all()
+    
+    departments = {
+        department: {'co2_kg': co2_kg or 0, 'energy_kwh': energy_kwh or 0, 'cost_saved': cost_saved or 0}
+        for department, co2_kg, energy_kwh, cost_saved in rows
+    }
+    totals = {
+        field: sum(values[field] for values in departments.values())
+        for field in ('co2_kg', 'energy_kwh', 'cost_saved')
+    }
+    budgets = dict(db.session.query(Department.name, Department.carbon_budget).all())
+    
+    carbon_budget.reset(month, totals, departments, budgets, now)
+    publish_budget_metrics(now)
+
+def publish_budget_metrics(now=None):
+    """Push the engine's fleet and department positions to Prometheus gauges"""
+    if carbon_budget.month is None:
+        return
+    
+    now = now or datetime.utcnow()
+    telemetry.record_budget(None, carbon_budget.status(now))
+    for department, status in carbon_budget.department_statuses(now).items():
+        telemetry.record_budget(department, status)
+
+def _refresh_carbon_budget(now):
+    # Other workers ingest too, so re-read the rollups now and then
+    if carbon_budget.needs_reset(now) or \
+       (now - carbon_budget.synced_at).total_seconds() >= Config.BUDGET_RESYNC_INTERVAL:
+        sync_carbon_budget(now)
+
+def carbon_budget_status(department=None):
+    """Month-to-date budget position with month-end projection"""
+    now = datetime.utcnow()
+    _refresh_carbon_budget(now)
+    return carbon_budget.status(now, department)
+
+def carbon_budget_departments():
+    """Month-to-date budget position for every department"""
+    now = datetime.utcnow()
+    _refresh_carbon_budget(now)
+    return carbon_budget.department_statuses(now)
+
+# ----------------------
+# OFFLINE REAPER
+# ----------------------
+def offline_conditions(cutoff):
+    """WHERE clauses for active systems silent since cutoff and not yet offline"""
+    return (System.is_active == True, System.last_seen < cutoff, System.status != 'offline')
+
+def reap_offline_systems(now=None, chunk_size=500):
+    """Mark systems silent for longer than OFFLINE_GRACE_SECONDS offline.
+    
+    Candidates come from one column-only SELECT and are flipped with a bulk
+    UPDATE per chunk that re-checks the cutoff, so a system whose heartbeat
+    lands in between (or that another worker already reaped) is left alone.
+    Returns the number of systems marked offline.
+    """
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(seconds=Config.OFFLINE_GRACE_SECONDS)
+    stale = offline_conditions(cutoff)
+    
+    candidates = db.session.execute(
+        db.select(System.id, System.mac_address, System.department, System.lab, System.status).where(*stale)
+    ).all()
+    
+    reaped = []
+    for start in range(0, len(candidates), chunk_size):
+        chunk = {row.id: row for row in candidates[start:start + chunk_size]}
+        stmt = db.update(System).where(System.id.in_(chunk), *stale).values(status='offline')\
+            .execution_options(synchronize_session=False)
+        
+        if db.engine.dialect.update_returning:
+            reaped.extend(chunk[system_id] for system_id in db.session.execute(stmt.returning(System.id)).scalars())
+        else:
+            db.session.execute(stmt)
+            reaped.extend(chunk.values())
+    
+    for row in reaped:
+        note_status_change(row, row.status, 'offline')
+    db.session.commit()
+    
+    if reaped:
+        # Bulk UPDATEs bypass the ORM listeners, so drop the snapshots here
+        for row in reaped:
+            invalidate_system_cache(row.mac_address)
+        response_cache.bump('data')
+        app.logger.info(f"Marked {len(reaped)} systems offline")
+    
+    return len(reaped)
+
+def _run_offline_reaper():
+    with app.app_context():
+        return reap_offline_systems()
+
+offline_reaper = PeriodicJob(_run_offline_reaper, Config.OFFLINE_REAPER_INTERVAL, name='greenops-offline-reaper')
+
+# ----------------------
+# FLEET INDEX
+# ----------------------
+# Status, last_seen, department and lab of every active system, kept
+# current by this process's ingest and status signals
+fleet = FleetIndex(Config.OFFLINE_GRACE_SECONDS)
+
+FLEET_COLUMNS = (System.mac_address, System.status, System.last_seen, System.department, System.lab)
+
+def load_fleet(now=None):
+    """Rebuild the fleet index from the systems table"""
+    now = now or datetime.utcnow()
+    fleet.load(db.session.execute(db.select(*FLEET_COLUMNS).where(System.is_active == True)), now)
+
+def sync_fleet(now=None):
+    """Merge systems written by other workers since the last sync.
+    
+    last_seen is written at least once per SYSTEM_TOUCH_INTERVAL and with
+    every status change, so re-reading rows touched since the previous
+    sync (plus that interval) catches up on the rest of the cluster.
+    """
+    now = now or datetime.utcnow()
+    if fleet.synced_at is None:
+        return load_fleet(now)
+    
+    since = fleet.synced_at - timedelta(seconds=Config.SYSTEM_TOUCH_INTERVAL)
+    for row in db.session.execute(db.select(*FLEET_COLUMNS).where(System.is_active == True, System.last_seen >= since)):
+        fleet.merge(*row)
+    fleet.synced_at = now
+
+def _run_fleet_sync():
+    with app.app_context():
+        sync_fleet()
+
+fleet_sync = PeriodicJob(_run_fleet_sync, Config.FLEET_SYNC_INTERVAL, name='greenops-fleet-sync')
+
+# ----------------------
+# PARTITIONING
+# ----------------------
+# On PostgreSQL a fresh agent_logs is created PARTITION BY RANGE (timestamp)
+# with one partition per month, so time-window queries prune to the months
+# they touch and retention drops whole partitions. Other databases, and
+# PostgreSQL databases whose agent_logs predates this, keep a plain table.
+LOG_PARTITION_NAME = re.compile(r'^agent_logs_p(\d{4})(\d{2})$')
+
+_agent_logs_partitioned = None
+
+def add_months(month, months):
+    """First day of the month `months` after the month starting at `month`"""
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1, day=1)
+
+def create_partitioned_agent_logs():
+    """Create agent_logs as a partitioned table if it does not exist yet.
+    
+    Partitioned tables need the partition key in their primary key, so the
+    table is built from a copy of the model with PRIMARY KEY (id, timestamp)
+    and a 64-bit id. The ORM keeps mapping id alone, which the sequence
+    still makes unique.
+    """
+    if inspect(db.engine).has_table(AgentLog.__tablename__):
+        return False
+    
+    metadata = db.MetaData()
+    for table in db.metadata.sorted_tables:
+        if table is not AgentLog.__table__:
+            table.to_metadata(metadata)
+    logs = AgentLog.__table__.to_metadata(metadata)
+    logs.append_constraint(db.PrimaryKeyConstraint(logs.c.id, logs.c.timestamp))
+    logs.c.id.type = db.BigInteger()
+    logs.c.id.autoincrement = True
+    logs.dialect_kwargs['postgresql_partition_by'] = 'RANGE (timestamp)'
+    
+    metadata.create_all(db.engine)
+    app.logger.info('Created agent_logs partitioned by month')
+    return True
+
+def agent_logs_partitioned():
+    global _agent_logs_partitioned
+    
+    if _agent_logs_partitioned is None:
+        _agent_logs_partitioned = db.engine.dialect.name == 'postgresql' and bool(db.session.execute(db.text(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('agent_logs')"
+        )).scalar())
+    return _agent_logs_partitioned
+
+def log_partitions():
+    """[(partition name, first day of its month)] for agent_logs, oldest first"""
+    if not agent_logs_partitioned():
+        return []
+    
+    names = db.session.execute(db.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass('agent_logs')"
+    )).scalars()
+    partitions = []
+    for name in names:
+        match = LOG_PARTITION_NAME.match(name)
+        if match:
+            partitions.append((name, datetime(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+def ensure_log_partitions(now=None):
+    """Create month partitions from last month to AGENT_LOG_PARTITIONS_AHEAD months ahead.
+    
+    A DEFAULT partition catches anything outside them, so inserts never fail
+    for want of a partition.
+    """
+    if not agent_logs_partitioned():
+        return 0
+    
+    current = month_start(now or datetime.utcnow())
+    existing = {name for name, _ in log_partitions()}
+    created = 0
+    with db.engine.begin() as connection:
+        for offset in range(-1, Config.AGENT_LOG_PARTITIONS_AHEAD + 1):
+            month = add_months(current, offset)
+            name = f"agent_logs_p{month:%Y%m}"
+            if name in existing:
+                continue
+            connection.execute(db.text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF agent_logs "
+                f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+            ))
+            created += 1
+        connection.execute(db.text("CREATE TABLE IF NOT EXISTS agent_logs_default PARTITION OF agent_logs DEFAULT"))
+    
+    if created:
+        app.logger.info(f"Created {created} agent_logs partitions")
+    return created
+
+def drop_log_partition(name, attempts=5):
+    """Detach and drop one month partition; False if its lock was never granted.
+    
+    DETACH ... CONCURRENTLY is refused while agent_logs has a DEFAULT
+    partition, so this is a plain DETACH, which takes a brief exclusive
+    lock on agent_logs. It waits at most PARTITION_LOCK_TIMEOUT_MS for it,
+    so a long-running reader makes it give up (and retry) instead of
+    queueing every writer behind it.
+    """
+    if not LOG_PARTITION_NAME.match(name):
+        raise ValueError(f"Not an agent_logs partition: {name}")
+    
+    for attempt in range(attempts):
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(db.text(f"SET LOCAL lock_timeout = {int(Config.PARTITION_LOCK_TIMEOUT_MS)}"))
+                connection.execute(db.text(f"ALTER TABLE agent_logs DETACH PARTITION {name}"))
+                connection.execute(db.text(f"DROP TABLE {name}"))
+        except OperationalError as e:
+            app.logger.warning(f"Dropping agent_logs partition {name} failed (attempt {attempt + 1}): {e}")
+            time.sleep(min(2 ** attempt, 30))
+            continue
+        
+        app.logger.info(f"Dropped agent_logs partition {name}")
+        return True
+    return False
+
+def _run_partition_maintenance():
+    with app.app_context():
+        return ensure_log_partitions()
+
+partition_job = PeriodicJob(_run_partition_maintenance, 6 * 3600, name='greenops-partitions')
+
+# ----------------------
+# FORECASTING
+# ----------------------
+# Idle probability models trained from the hourly rollups (fed by every
+# agent log at ingest), shared between workers through FORECAST_MODEL_PATH
+forecast_store = ForecastStore(Config.FORECAST_MODEL_PATH)
+
+def load_idle_history(start, end):
+    """Hourly idle fractions in [start, end) as (system_ids, groups, systems x hours array).
+    
+    Hours a system did not report are NaN; groups are each system's latest
+    (department, lab).
+    """
+    hours = int((end - start).total_seconds() // 3600)
+    rows = db.session.execute(
+        db.select(HourlyRollup.system_id, HourlyRollup.department, HourlyRollup.lab,
+                  HourlyRollup.bucket, HourlyRollup.idle_minutes)
+        .where(HourlyRollup.bucket >= start, HourlyRollup.bucket < end, HourlyRollup.samples > 0)
+        .order_by(HourlyRollup.system_id, HourlyRollup.bucket)
+    ).all()
+    if not rows:
+        return [], [], np.empty((0, hours))
+    
+    system_ids, departments, labs, buckets, idle_minutes = zip(*rows)
+    systems, row_systems = np.unique(system_ids, return_inverse=True)
+    columns = ((epoch_seconds(buckets) - epoch_seconds([start])[0]) // 3600).astype(np.int64)
+    
+    idle = np.full((len(systems), hours), np.nan)
+    idle[row_systems, columns] = np.clip(np.array([minutes or 0 for minutes in idle_minutes]) / 60, 0, 1)
+    
+    latest = np.r_[np.flatnonzero(np.diff(row_systems)), len(rows) - 1]
+    return systems.tolist(), [(departments[i], labs[i]) for i in latest], idle
+
+def train_forecast(full=False, now=None, progress=None):
+    """Bring the forecast model up to the last complete hour and publish it.
+    
+    Continues from the saved model one day of history at a time; with
+    `full`, or if the model is further behind than FORECAST_HISTORY_DAYS,
+    only that much history is replayed. Trains a private copy, so
+    predictions keep being served from the old model meanwhile. Returns
+    the number of system-hours trained on.
+    """
+    now = now or datetime.utcnow()
+    end = hour_bucket(now)
+    earliest = end - timedelta(days=Config.FORECAST_HISTORY_DAYS)
+    
+    if full or not os.path.exists(Config.FORECAST_MODEL_PATH):
+        model = IdleForecaster(Config.FORECAST_HALF_LIFE_DAYS)
     else:
-        # Update last seen and status
-        system.last_seen = datetime.utcnow()
-        system.status = 'active'
-        if hostname:
-            system.hostname = hostname
-        if os_name:
-            system.os = os_name
+        model = IdleForecaster.load(Config.FORECAST_MODEL_PATH)
+    
+    start = max(model.trained_through or earliest, earliest)
+    trained = 0
+    while start < end:
+        block_end = min(start + timedelta(days=1), end)
+        lead_in = start - timedelta(hours=HISTORY_HOURS)
+        system_ids, groups, idle = load_idle_history(lead_in, block_end)
+        hours = model.update(system_ids, groups, lead_in, idle)
+        trained += hours
+        if progress:
+            progress(start, len(system_ids), hours)
+        start = block_end
+    
+    forecast_store.save(model)
+    return trained
+
+def _run_forecast_training():
+    with app.app_context():
+        return train_forecast()
+
+# With several workers set FORECAST_TRAIN_INTERVAL=0 on all but one; the
+# others pick the model file up when it changes
+forecast_job = PeriodicJob(_run_forecast_training,
+                           Config.FORECAST_TRAIN_INTERVAL if Config.ENABLE_ML_PREDICTIONS else 0,
+                           name='greenops-forecast')
+
+# ----------------------
+# RETENTION
+# ----------------------
+def _delete_in_batches(model, conditions, batch_size, pause):
+    """Delete matching rows by primary key, one short transaction per batch"""
+    deleted = 0
+    while True:
+        ids = db.session.execute(db.select(model.id).where(*conditions).limit(batch_size)).scalars().all()
+        if not ids:
+            return deleted
+        
+        db.session.execute(db.delete(model).where(model.id.in_(ids)).execution_options(synchronize_session=False))
         db.session.commit()
+        deleted += len(ids)
+        if pause:
+            time.sleep(pause)
+
+def purge_agent_logs(retention_days=None, hourly_retention_days=None, now=None, dry_run=False, progress=None):
+    """Downsample and delete raw agent logs older than the retention window.
+    
+    Works a day at a time, oldest first. A day whose raw rows are not all
+    covered by the daily rollups (e.g. logs from before rollups existed) is
+    rolled up again before it is deleted; a partially purged day is never
+    re-rolled. Rows go in RETENTION_BATCH_SIZE batches by id so writers are
+    not locked out. Hourly rollups past their own window are trimmed the
+    same way. progress(day, rows, rolled_up) is called per day.
+    
+    With a partitioned agent_logs, month partitions that lie entirely
+    before the cutoff are rolled up the same way and then dropped whole.
+    """
+    retention_days = Config.LOG_RETENTION_DAYS if retention_days is None else retention_days
+    hourly_retention_days = Config.ROLLUP_HOURLY_RETENTION_DAYS if hourly_retention_days is None else hourly_retention_days
+    today = day_bucket(now or datetime.utcnow())
+    pause = Config.RETENTION_BATCH_PAUSE_MS / 1000
+    summary = {'dry_run': dry_run, 'days': 0, 'days_rolled_up': 0, 'log_rows': 0,
+               'hourly_rollup_rows': 0, 'partitions_dropped': 0}
+    
+    if retention_days:
+        cutoff = today - timedelta(days=retention_days)
+        expired = {month: name for name, month in log_partitions() if add_months(month, 1) <= cutoff}
+        oldest = db.session.query(db.func.min(AgentLog.timestamp)).filter(AgentLog.timestamp < cutoff).scalar()
+        day = day_bucket(oldest) if oldest else cutoff
+        
+        while day < cutoff:
+            next_day = day + timedelta(days=1)
+            in_day = (AgentLog.timestamp >= day, AgentLog.timestamp < next_day)
+            
+            rows = db.session.query(db.func.count(AgentLog.id)).filter(*in_day).scalar()
+            if rows:
+                covered = db.session.query(db.func.coalesce(db.func.sum(DailyRollup.samples), 0))\
+                    .filter(DailyRollup.bucket == day).scalar()
+                rolled_up = db.session.query(db.func.count(AgentLog.id))\
+                    .filter(*in_day, AgentLog.system_id.isnot(None)).scalar() > covered
+                
+                if not dry_run:
+                    if rolled_up:
+                        rebuild_rollups(day, next_day)
+                    if month_start(day) not in expired:
+                        rows = _delete_in_batches(AgentLog, in_day, Config.RETENTION_BATCH_SIZE, pause)
+                
+                summary['days'] += 1
+                summary['days_rolled_up'] += rolled_up
+                summary['log_rows'] += rows
+                if progress:
+                    progress(day, rows, rolled_up)
+            day = next_day
+        
+        if dry_run:
+            summary['partitions_dropped'] = len(expired)
+        else:
+            # End this session's transaction first: its reads hold locks the DETACH waits for.
+            # A partition whose lock could not be had is dropped on the next run.
+            db.session.commit()
+            summary['partitions_dropped'] = sum(drop_log_partition(name) for name in expired.values())
+    
+    if hourly_retention_days:
+        stale = (HourlyRollup.bucket < today - timedelta(days=hourly_retention_days),)
+        if dry_run:
+            summary['hourly_rollup_rows'] = db.session.query(db.func.count(HourlyRollup.id)).filter(*stale).scalar()
+        else:
+            summary['hourly_rollup_rows'] = _delete_in_batches(HourlyRollup, stale, Config.RETENTION_BATCH_SIZE, pause)
     
-    return system
+    if not dry_run and (summary['log_rows'] or summary['hourly_rollup_rows'] or summary['partitions_dropped']):
+        response_cache.bump('data')
+        app.logger.info(f"Retention purged {summary['log_rows']} agent logs over {summary['days']} days "
+                        f"({summary['partitions_dropped']} partitions dropped) "
+                        f"and {summary['hourly_rollup_rows']} hourly rollups")
+    
+    return summary
+
+def _run_retention():
+    with app.app_context():
+        return purge_agent_logs()
+
+# Only one process needs this; enable it on a single worker or use the CLI from cron
+retention_job = PeriodicJob(_run_retention, Config.RETENTION_INTERVAL, name='greenops-retention')
+
+@app.before_request
+def start_background_jobs():
+    # Started per process on first request, so forked workers get their own
+    offline_reaper.ensure_started()
+    fleet_sync.ensure_started()
+    intensity_sync.ensure_started()
+    forecast_job.ensure_started()
+    policy_watch.ensure_started()
+    retention_job.ensure_started()
+    if agent_logs_partitioned():
+        partition_job.ensure_started()
 
 # ----------------------
 # AUTHENTICATION ROUTES
@@ -483,69 +2266,36 @@ def agent_heartbeat():
     """Agent heartbeat endpoint"""
     data = request.get_json()
     
-    if not data or not data.get('mac_address'):
-        return jsonify({'error': 'Missing mac_address'}), 400
-    
-    mac_address = data['mac_address']
-    idle_minutes = data.get('idle_minutes', 0)
-    action = data.get('action', 'NONE')
+    try:
+        report = parse_heartbeat(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if Config.INGEST_WRITE_BEHIND:
+        # Queue and return; the buffer writes the log rows in bulk
+        if not ingest_buffer.put(report):
+            return jsonify({'error': 'Ingest queue full, retry later'}), 503, {'Retry-After': '5'}
+        
+        return jsonify({'status': 'queued'}), 202
     
     try:
-        # Get or create system by MAC
-        system = get_or_create_system(
-            mac_address=mac_address,
-            hostname=data.get('hostname'),
-            os_name=data.get('os'),
-            organization=data.get('organization', 'ORG'),
-            department=data.get('department', 'DEPT'),
-            lab=data.get('lab', 'LAB')
-        )
+        # Resolve system, update status and log the heartbeat in one transaction
+        [(system, metrics, duplicate)] = ingest_heartbeats([report])
         
-        # Update system status
-        if idle_minutes > 30:
-            system.status = 'idle'
-        elif action in ['SLEEP', 'HIBERNATE']:
-            system.status = 'sleeping'
+        if duplicate:
+            app.logger.info(f"Duplicate heartbeat from {system.pc_id} ignored")
         else:
-            system.status = 'active'
-        
-        db.session.commit()
-        
-        # Calculate metrics
-        metrics = calculate_metrics(idle_minutes, system.power_watts)
-        
-        # Determine reason
-        reason = None
-        if action == 'SLEEP':
-            reason = f'Idle exceeded {data.get("threshold", 15)} minute threshold'
-        elif action == 'NONE':
-            reason = 'Within allowed activity window'
-        
-        # Create log entry
-        log_entry = AgentLog(
-            system_id=system.id,
-            pc_id=system.pc_id,
-            idle_minutes=idle_minutes,
-            action=action,
-            reason=reason,
-            energy_kwh=metrics['energy_kwh'],
-            co2_kg=metrics['co2_kg'],
-            cost_saved=metrics['cost_saved'] if action != 'NONE' else 0
-        )
-        
-        db.session.add(log_entry)
-        db.session.commit()
-        
-        app.logger.info(f"Heartbeat from {system.pc_id}: idle={idle_minutes}min, action={action}")
+            app.logger.info(f"Heartbeat from {system.pc_id}: idle={report['idle_minutes']}min, action={report['action']}")
         
         return jsonify({
-            'status': 'ok',
+            'status': 'duplicate' if duplicate else 'ok',
             'system_id': system.id,
             'pc_id': system.pc_id,
             'metrics': metrics
         }), 200
         
     except Exception as e:
+        db.session.rollback()
         app.logger.error(f"Heartbeat error: {e}")
         return jsonify({'error': 'Heartbeat failed'}), 500
 
@@ -555,21 +2305,171 @@ def agent_report():
     """Legacy agent report endpoint - redirects to heartbeat"""
     return agent_heartbeat()
 
+@app.route('/api/v1/agent/report/batch', methods=['POST'])
+@limiter.limit("60 per minute")
+def agent_report_batch():
+    """Batched heartbeat endpoint for gateways and store-and-forward agents"""
+    data = request.get_json(silent=True)
+    reports = data.get('reports') if isinstance(data, dict) else data
+    
+    if not isinstance(reports, list) or not reports:
+        return jsonify({'error': 'Missing reports'}), 400
+    
+    if len(reports) > Config.HEARTBEAT_BATCH_MAX:
+        return jsonify({'error': f'Batch exceeds {Config.HEARTBEAT_BATCH_MAX} reports'}), 413
+    
+    accepted = []
+    rejected = []
+    for index, item in enumerate(reports):
+        try:
+            accepted.append(parse_heartbeat(item))
+        except ValueError as e:
+            rejected.append({'index': index, 'error': str(e)})
+    
+    try:
+        results = ingest_heartbeats(accepted) if accepted else []
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Batch heartbeat error: {e}")
+        return jsonify({'error': 'Batch heartbeat failed'}), 500
+    
+    duplicates = sum(duplicate for _, _, duplicate in results)
+    app.logger.info(f"Batch heartbeat: {len(results)} reports ({duplicates} duplicates) "
+                    f"from {len({r['mac_address'] for r in accepted})} systems")
+    
+    return jsonify({
+        'status': 'ok',
+        'accepted': len(results),
+        'duplicates': duplicates,
+        'rejected': rejected
+    }), 200
+
+def load_agent_policies():
+    """Active policies, oldest first"""
+    return [policy.to_dict() for policy in Policy.query.filter_by(is_active=True).order_by(Policy.id)]
+
+# Serialized agent policies and their resolution index, re-read from the
+# database at most every POLICY_CACHE_TTL seconds; the defaults apply
+# where no organization policy is active
+policy_cache = PolicyCache(load_agent_policies, dict(POLICY_DEFAULTS), Config.POLICY_CACHE_TTL)
+
+def agent_placement(mac_address):
+    """(department, lab, MAC) an agent's policy resolves against.
+    
+    Department and lab come from the fleet index rather than the request,
+    so a system reassigned to another lab follows that lab's policy as
+    soon as this worker sees the move. Systems this worker's index does not
+    know yet (registered through another worker since the last fleet sync)
+    are looked up in the database. May query, so never call it from a
+    PolicyCache.wait() resolver.
+    """
+    if not mac_address:
+        return None, None, None
+    mac = normalize_mac(mac_address)
+    department, lab = fleet.placement(mac)
+    if department is None and lab is None:
+        row = db.session.execute(
+            db.select(System.department, System.lab).where(System.mac_address == mac)
+        ).first()
+        if row is not None:
+            department, lab = row
+    return department, lab, mac
+
+def _run_policy_watch():
+    # Only worth a query while agents are waiting for a change made through another worker
+    if policy_cache.waiting:
+        with app.app_context():
+            policy_cache.refresh()
+
+policy_watch = PeriodicJob(_run_policy_watch, Config.POLICY_WATCH_INTERVAL if Config.POLICY_PUSH_MAX_CLIENTS else 0,
+                           name='greenops-policy-watch')
+
+def push_unavailable():
+    """503 telling an agent to fall back to polling, or None if it may wait"""
+    if policy_cache.waiting < Config.POLICY_PUSH_MAX_CLIENTS:
+        return None
+    response = jsonify({'error': 'Policy push is at capacity; poll instead'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(Config.POLICY_CACHE_TTL)
+    return response
+
 @app.route('/api/v1/agent/policy', methods=['GET'])
 def agent_policy():
-    """Get active policy for agent"""
-    active_policy = Policy.query.filter_by(is_active=True).first()
+    """Get active policy for agent.
     
-    if not active_policy:
-        return jsonify({
-            'idle_threshold': 15,
-            'sleep_threshold': 30,
-            'action_type': 'sleep',
-            'warning_enabled': True,
-            'warning_duration': 300
-        }), 200
+    The response carries the policy version as its ETag; a request whose
+    If-None-Match already has it gets an empty 304. With ?wait=N such a
+    request is held for up to N seconds and answered as soon as the
+    policy changes (long-poll). ?mac_address= selects the policy that
+    applies to that system; without it the organization policy is served.
+    """
+    placement = agent_placement(request.args.get('mac_address'))
+    
+    def resolve(index):
+        return index.resolve(*placement)
     
-    return jsonify(active_policy.to_dict()), 200
+    document = resolve(policy_cache.get())
+    
+    try:
+        wait = min(max(float(request.args.get('wait', 0)), 0), Config.POLICY_LONG_POLL_MAX)
+    except ValueError:
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+    
+    # With push off nothing may hold a worker, so ?wait= is answered at once
+    if wait and Config.POLICY_PUSH_MAX_CLIENTS and request.if_none_match.contains_weak(document.version):
+        unavailable = push_unavailable()
+        if unavailable:
+            return unavailable
+        db.session.close()  # hand the connection back to the pool while waiting
+        document = policy_cache.wait(resolve, document.version, wait)
+    
+    if request.if_none_match.contains_weak(document.version):
+        response = Response(status=304)
+    else:
+        response = Response(document.body, mimetype='application/json')
+    response.set_etag(document.version)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/v1/agent/policy/stream', methods=['GET'])
+def agent_policy_stream():
+    """Push policy changes to an agent as Server-Sent Events.
+    
+    Sends the current policy unless Last-Event-ID already names its
+    version, then one `policy` event per change, with a comment line every
+    POLICY_KEEPALIVE_SECONDS. The stream ends after
+    POLICY_STREAM_MAX_SECONDS and the agent reconnects. ?mac_address=
+    selects the system's policy, re-resolved on every keep-alive so that
+    moving the system to another lab or department is pushed as well.
+    """
+    if not Config.POLICY_PUSH_MAX_CLIENTS:
+        return jsonify({'error': 'Policy push is disabled; poll instead'}), 404
+    unavailable = push_unavailable()
+    if unavailable:
+        return unavailable
+    
+    policy_cache.get()
+    db.session.close()  # the stream holds no database connection
+    version = request.headers.get('Last-Event-ID') or request.args.get('version')
+    mac_address = request.args.get('mac_address')
+    
+    def events():
+        current = version
+        deadline = time.monotonic() + Config.POLICY_STREAM_MAX_SECONDS
+        while time.monotonic() < deadline:
+            # Placement is read outside wait(), which resolves under the policy lock
+            placement = agent_placement(mac_address)
+            db.session.close()
+            document = policy_cache.wait(lambda index: index.resolve(*placement), current,
+                                         min(Config.POLICY_KEEPALIVE_SECONDS, deadline - time.monotonic()))
+            if document.version != current:
+                current = document.version
+                yield f"id: {current}\nevent: policy\ndata: {document.body.decode('utf-8')}\n\n"
+            else:
+                yield ': keep-alive\n\n'
+    
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 # ----------------------
 # ADMIN API
@@ -585,26 +2485,29 @@ def get_machines():
         return jsonify({'error': 'Unauthorized'}), 401
     
     # Get query parameters
-    status = request.args.get('status')
-    department = request.args.get('department')
-    lab = request.args.get('lab')
-    
-    # Build query
-    query = System.query.filter_by(is_active=True)
-    
-    if status:
-        query = query.filter_by(status=status)
-    if department:
-        query = query.filter_by(department=department)
-    if lab:
-        query = query.filter_by(lab=lab)
-    
-    systems = query.all()
-    
-    return jsonify({
-        'machines': [s.to_dict() for s in systems],
-        'total': len(systems)
-    }), 200
+    try:
+        listing = parse_system_listing(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    def machines_payload():
+        machines, next_cursor = list_systems(**listing)
+        total = db.session.query(db.func.count(System.id)).filter(
+            *system_filters(listing['status'], listing['department'], listing['lab'])
+        ).scalar()
+        
+        response = jsonify({
+            'machines': machines,
+            'total': total,
+            'next_cursor': next_cursor
+        })
+        return CachedResponse(response.get_data(), 200, response.mimetype)
+    
+    # Auth is checked above, so cached payloads are shared between users
+    key = 'machines|' + repr(sorted(request.args.items(multi=True)))
+    cached = response_cache.get_or_set(key, machines_payload)
+    
+    return Response(cached.body, status=cached.status, mimetype=cached.mimetype)
 
 @app.route('/api/admin/machine/<int:machine_id>', methods=['GET'])
 @jwt_required()
@@ -623,52 +2526,49 @@ def get_machine(machine_id):
         .order_by(AgentLog.timestamp.desc())\
         .limit(20).all()
     
+    recent_sessions = IdleSession.query.filter_by(system_id=machine_id)\
+        .order_by(IdleSession.started_at.desc())\
+        .limit(20).all()
+    
     return jsonify({
         'machine': system.to_dict(),
-        'recent_logs': [log.to_dict() for log in recent_logs]
+        'recent_logs': [log.to_dict() for log in recent_logs],
+        'recent_sessions': [session.to_dict() for session in recent_sessions]
     }), 200
 
 # ----------------------
 # DASHBOARD ROUTES
 # ----------------------
 @app.route('/')
+@cached_view()
 def dashboard():
     """Main dashboard view"""
     logs_query = AgentLog.query.order_by(AgentLog.timestamp.desc()).limit(20).all()
     logs_data = [log.to_dict() for log in logs_query]
     
-    # Calculate totals
-    total_idle = sum(log.get('idle_minutes', 0) for log in logs_data)
-    total_energy = sum(log.get('energy_kwh', 0) for log in logs_data)
-    total_co2 = sum(log.get('co2_kg', 0) for log in logs_data)
-    total_cost_saved = sum(log.get('cost_saved', 0) for log in logs_data)
-    
-    if total_energy == 0 and total_idle > 0:
-        metrics = calculate_metrics(total_idle)
-        total_energy = metrics['energy_kwh']
-        total_co2 = metrics['co2_kg']
-        total_cost_saved = metrics['cost_saved']
+    # Month-to-date totals from the budget engine
+    budget = carbon_budget_status()
+    total_energy = budget['energy_kwh']
+    total_co2 = budget['used_kg']
+    total_cost_saved = budget['cost_saved']
     
     optimized = len([l for l in logs_data if l['action'] in ['SLEEP', 'HIBERNATE']])
     active = len([l for l in logs_data if l['action'] == 'NONE'])
     
     # System counts
-    total_systems = System.query.filter_by(is_active=True).count()
-    online_systems = System.query.filter(
-        System.is_active == True,
-        System.last_seen >= datetime.utcnow() - timedelta(minutes=5)
-    ).count()
-    
-    remaining_budget = Config.CARBON_BUDGET_MONTHLY - total_co2
-    budget_percentage = (total_co2 / Config.CARBON_BUDGET_MONTHLY) * 100 if Config.CARBON_BUDGET_MONTHLY > 0 else 0
+    total_systems = len(fleet)
+    online_systems = fleet.online_count(datetime.utcnow())
     
     return render_template(
         'dashboard.html',
         energy=round(total_energy, 2),
         co2=round(total_co2, 2),
-        remaining=round(remaining_budget, 2),
+        remaining=round(budget['remaining_kg'], 2),
         used=round(total_co2, 2),
-        budget_percentage=round(budget_percentage, 1),
+        budget=Config.CARBON_BUDGET_MONTHLY,
+        budget_percentage=budget['used_percentage'] or 0,
+        projected=round(budget['projected_month_end_kg'], 2),
+        on_track=budget['on_track'],
         optimized=optimized,
         active=active,
         money_saved=round(total_cost_saved, 2),
@@ -679,30 +2579,20 @@ def dashboard():
     )
 
 @app.route('/admin')
+@cached_view()
 def admin_dashboard():
     """Admin dashboard with machine listing"""
-    # Update system statuses (mark as offline if not seen in 5 minutes)
-    cutoff_time = datetime.utcnow() - timedelta(minutes=5)
-    offline_systems = System.query.filter(
-        System.last_seen < cutoff_time,
-        System.status != 'offline'
-    ).all()
-    
-    for system in offline_systems:
-        system.status = 'offline'
-    
-    if offline_systems:
-        db.session.commit()
-    
+    # Offline statuses are maintained by the background reaper
     # Get all systems
     systems = System.query.filter_by(is_active=True).order_by(System.last_seen.desc()).all()
     
     # Count by status
-    total_pcs = len(systems)
-    active_pcs = len([s for s in systems if s.status == 'active'])
-    idle_pcs = len([s for s in systems if s.status == 'idle'])
-    sleeping_pcs = len([s for s in systems if s.status == 'sleeping'])
-    offline_pcs = len([s for s in systems if s.status == 'offline'])
+    counts = fleet.status_counts(datetime.utcnow())
+    total_pcs = len(fleet)
+    active_pcs = counts.get('active', 0)
+    idle_pcs = counts.get('idle', 0)
+    sleeping_pcs = counts.get('sleeping', 0)
+    offline_pcs = counts.get('offline', 0)
     
     return render_template(
         'admin.html',
@@ -725,9 +2615,16 @@ def login_page():
 @app.route('/api/v1/systems', methods=['GET'])
 @jwt_required()
 def get_systems():
-    """Get all systems"""
-    systems = System.query.filter_by(is_active=True).all()
-    return jsonify([s.to_dict() for s in systems]), 200
+    """Get active systems, one page at a time"""
+    try:
+        systems, next_cursor = list_systems(**parse_system_listing(request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    response = jsonify(systems)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response, 200
 
 @app.route('/api/v1/systems/<int:system_id>', methods=['GET'])
 @jwt_required()
@@ -739,9 +2636,14 @@ def get_system(system_id):
         .order_by(AgentLog.timestamp.desc())\
         .limit(10).all()
     
+    recent_sessions = IdleSession.query.filter_by(system_id=system_id)\
+        .order_by(IdleSession.started_at.desc())\
+        .limit(10).all()
+    
     return jsonify({
         'system': system.to_dict(),
-        'recent_logs': [log.to_dict() for log in recent_logs]
+        'recent_logs': [log.to_dict() for log in recent_logs],
+        'recent_sessions': [session.to_dict() for session in recent_sessions]
     }), 200
 
 # ----------------------
@@ -749,6 +2651,7 @@ def get_system(system_id):
 # ----------------------
 @app.route('/api/v1/metrics/summary', methods=['GET'])
 @jwt_required()
+@cached_view()
 def metrics_summary():
     """Get summary metrics"""
     period = request.args.get('period', '7d')
@@ -762,62 +2665,181 @@ def metrics_summary():
     else:
         since = datetime.utcnow() - timedelta(days=7)
     
-    logs = AgentLog.query.filter(AgentLog.timestamp >= since).all()
+    department = request.args.get('department')
+    lab = request.args.get('lab')
+    
+    totals = rollup_totals(HourlyRollup, hour_bucket(since), department=department, lab=lab)
+    total_energy = totals['energy_kwh']
+    total_co2 = totals['co2_kg']
+    total_cost_saved = totals['cost_saved']
+    total_actions = totals['actions']
     
-    total_energy = sum(log.energy_kwh or 0 for log in logs)
-    total_co2 = sum(log.co2_kg or 0 for log in logs)
-    total_cost_saved = sum(log.cost_saved or 0 for log in logs)
-    total_actions = len([l for l in logs if l.action != 'NONE'])
+    # Budget figures are month-to-date, whatever the period
+    budget = carbon_budget_status(department)
     
     return jsonify({
         'period': period,
+        'department': department,
+        'lab': lab,
         'total_energy_kwh': round(total_energy, 2),
         'total_co2_kg': round(total_co2, 2),
         'total_cost_saved': round(total_cost_saved, 2),
         'total_actions': total_actions,
-        'carbon_budget': Config.CARBON_BUDGET_MONTHLY,
-        'budget_remaining': round(Config.CARBON_BUDGET_MONTHLY - total_co2, 2),
-        'budget_used_percentage': round((total_co2 / Config.CARBON_BUDGET_MONTHLY) * 100, 1)
+        'carbon_budget': budget['budget_kg'],
+        'budget_remaining': budget['remaining_kg'],
+        'budget_used_percentage': budget['used_percentage'],
+        'budget': budget
     }), 200
 
 @app.route('/api/v1/metrics/trends', methods=['GET'])
 @jwt_required()
+@cached_view()
 def metrics_trends():
     """Get time-series metrics"""
     days = int(request.args.get('days', 7))
+    granularity = request.args.get('granularity', 'day')
+    
+    if granularity not in ROLLUP_GRANULARITIES:
+        return jsonify({'error': f"granularity must be one of: {', '.join(ROLLUP_GRANULARITIES)}"}), 400
+    
     since = datetime.utcnow() - timedelta(days=days)
+    since = hour_bucket(since) if granularity == 'hour' else day_bucket(since)
     
-    logs = AgentLog.query.filter(AgentLog.timestamp >= since).all()
-    
-    daily_metrics = {}
-    for log in logs:
-        date_key = log.timestamp.strftime('%Y-%m-%d')
-        if date_key not in daily_metrics:
-            daily_metrics[date_key] = {
-                'date': date_key,
-                'energy_kwh': 0,
-                'co2_kg': 0,
-                'cost_saved': 0,
-                'actions': 0
-            }
-        daily_metrics[date_key]['energy_kwh'] += log.energy_kwh or 0
-        daily_metrics[date_key]['co2_kg'] += log.co2_kg or 0
-        daily_metrics[date_key]['cost_saved'] += log.cost_saved or 0
-        if log.action != 'NONE':
-            daily_metrics[date_key]['actions'] += 1
+    series = rollup_series(
+        granularity,
+        since,
+        department=request.args.get('department'),
+        lab=request.args.get('lab')
+    )
     
     return jsonify({
-        'trends': list(daily_metrics.values())
+        'granularity': granularity,
+        'trends': [
+            {
+                'date': point['bucket'],
+                'energy_kwh': point['energy_kwh'],
+                'co2_kg': point['co2_kg'],
+                'cost_saved': point['cost_saved'],
+                'actions': point['actions'],
+                'idle_minutes': point['idle_minutes']
+            }
+            for point in series
+        ]
+    }), 200
+
+@app.route('/api/v1/metrics/budget', methods=['GET'])
+@jwt_required()
+def metrics_budget():
+    """Month-to-date carbon budget, fleet-wide and per department"""
+    return jsonify({
+        'fleet': carbon_budget_status(),
+        'departments': carbon_budget_departments()
     }), 200
 
 # ----------------------
-# EXPORT ROUTES
+# PREDICTIONS API
 # ----------------------
-@app.route('/api/v1/export/csv', methods=['GET'])
+def idle_windows(probabilities, start, threshold):
+    """Runs of consecutive hours whose idle probability reaches threshold"""
+    windows = []
+    for hour, probability in enumerate(probabilities):
+        if probability < threshold:
+            continue
+        if windows and windows[-1]['end'] == hour:
+            windows[-1]['end'] = hour + 1
+            windows[-1]['values'].append(probability)
+        else:
+            windows.append({'start': hour, 'end': hour + 1, 'values': [probability]})
+    
+    return [
+        {
+            'from': (start + timedelta(hours=window['start'])).isoformat(),
+            'until': (start + timedelta(hours=window['end'])).isoformat(),
+            'idle_probability': round(float(np.mean(window['values'])), 3)
+        }
+        for window in windows
+    ]
+
+@app.route('/api/v1/predictions', methods=['GET'])
 @jwt_required()
-def export_csv():
-    """Export logs as CSV"""
-    period = request.args.get('period', '30d')
+@cached_view()
+def idle_predictions():
+    """Forecast idle probability per system and lab for the coming hours"""
+    if not Config.ENABLE_ML_PREDICTIONS:
+        return jsonify({'error': 'Predictions are disabled'}), 404
+    
+    try:
+        hours = int(request.args.get('hours', 8))
+    except ValueError:
+        return jsonify({'error': 'hours must be an integer'}), 400
+    if not 0 < hours <= Config.FORECAST_HORIZON_MAX:
+        return jsonify({'error': f'hours must be between 1 and {Config.FORECAST_HORIZON_MAX}'}), 400
+    
+    model = forecast_store.get()
+    if model is None or model.trained_through is None:
+        return jsonify({'error': 'No forecast model has been trained yet'}), 503
+    
+    department = request.args.get('department')
+    lab = request.args.get('lab')
+    include_systems = request.args.get('systems', 'true').lower() != 'false'
+    threshold = Config.FORECAST_SLEEP_THRESHOLD
+    
+    systems = db.session.execute(
+        db.select(System.id, System.pc_id, System.department, System.lab)
+        .where(*system_filters(department=department, lab=lab)).order_by(System.id)
+    ).all()
+    start = hour_bucket(datetime.utcnow())
+    probabilities = model.predict([row.id for row in systems], [(row.department, row.lab) for row in systems],
+                                  start, hours) if systems else np.empty((0, hours))
+    
+    # Per lab: mean probability per hour and the windows worth a stricter policy
+    groups = {}
+    for row, values in zip(systems, probabilities):
+        groups.setdefault((row.department, row.lab), []).append(values)
+    labs = []
+    for group_department, group_lab in sorted(groups, key=lambda group: (group[0] or '', group[1] or '')):
+        rows = groups[(group_department, group_lab)]
+        mean = np.mean(rows, axis=0)
+        labs.append({
+            'department': group_department,
+            'lab': group_lab,
+            'systems': len(rows),
+            'idle_probability': [round(float(value), 3) for value in mean],
+            'idle_windows': idle_windows(mean, start, threshold)
+        })
+    
+    result = {
+        'start': start.isoformat(),
+        'hours': hours,
+        'trained_through': model.trained_through.isoformat(),
+        'threshold': threshold,
+        'labs': labs,
+        # Systems likely to stay idle through the coming hour: candidates for an early sleep
+        'sleep_candidates': int((probabilities[:, 0] >= threshold).sum()) if len(systems) else 0
+    }
+    if include_systems:
+        result['systems'] = [
+            {
+                'system_id': row.id,
+                'pc_id': row.pc_id,
+                'department': row.department,
+                'lab': row.lab,
+                'idle_probability': [round(float(value), 3) for value in values],
+                'sleep_early': bool(values[0] >= threshold)
+            }
+            for row, values in zip(systems, probabilities)
+        ]
+    return jsonify(result), 200
+
+# ----------------------
+# EXPORT ROUTES
+# ----------------------
+def export_window(args):
+    """(since, until) for an export from period= or explicit since=/until=.
+    
+    Raises ValueError with a client-facing message on bad dates.
+    """
+    period = args.get('period', '30d')
     
     if period == '7d':
         since = datetime.utcnow() - timedelta(days=7)
@@ -828,41 +2850,166 @@ def export_csv():
     else:
         since = datetime.utcnow() - timedelta(days=30)
     
-    logs = AgentLog.query.filter(AgentLog.timestamp >= since)\
-        .order_by(AgentLog.timestamp.desc()).all()
-    
-    output = StringIO()
-    writer = csv.writer(output)
+    until = None
+    try:
+        if args.get('since'):
+            since = datetime.fromisoformat(args['since'])
+        if args.get('until'):
+            until = datetime.fromisoformat(args['until'])
+    except ValueError:
+        raise ValueError('since/until must be ISO dates (YYYY-MM-DD[THH:MM:SS])')
+    
+    return since, until
+
+def _rollup_export_columns(model):
+    return [
+        (model.bucket, 'datetime'), (model.system_id, 'int'), (model.department, 'str'), (model.lab, 'str'),
+        (model.energy_kwh, 'float'), (model.co2_kg, 'float'), (model.cost_saved, 'float'),
+        (model.idle_minutes, 'float'), (model.actions, 'int'), (model.samples, 'int')
+    ]
+
+# Tables available as columnar exports: name -> [(column, kind)]
+COLUMNAR_TABLES = {
+    'agent_logs': [
+        (AgentLog.id, 'int'), (AgentLog.system_id, 'int'), (AgentLog.pc_id, 'str'),
+        (System.department, 'str'), (System.lab, 'str'), (AgentLog.idle_minutes, 'float'),
+        (AgentLog.idle_increment, 'float'), (AgentLog.action, 'str'), (AgentLog.reason, 'str'),
+        (AgentLog.energy_kwh, 'float'), (AgentLog.co2_kg, 'float'), (AgentLog.cost_saved, 'float'),
+        (AgentLog.timestamp, 'datetime')
+    ],
+    'rollup_hourly': _rollup_export_columns(HourlyRollup),
+    'rollup_daily': _rollup_export_columns(DailyRollup)
+}
+
+def export_query(table, since=None, until=None, department=None, lab=None):
+    """SELECT for a columnar export in time order.
+    
+    Returns (statement, [(name, kind)], name of the time column).
+    """
+    columns = COLUMNAR_TABLES[table]
+    if table == 'agent_logs':
+        time_column, department_column, lab_column = AgentLog.timestamp, System.department, System.lab
+        query = db.select(*[column for column, _ in columns])\
+            .select_from(AgentLog).outerjoin(System, System.id == AgentLog.system_id)
+        order = (AgentLog.timestamp, AgentLog.id)
+    else:
+        model = HourlyRollup if table == 'rollup_hourly' else DailyRollup
+        time_column, department_column, lab_column = model.bucket, model.department, model.lab
+        query = db.select(*[column for column, _ in columns])
+        order = (model.bucket, model.system_id)
+    
+    if since:
+        query = query.where(time_column >= since)
+    if until:
+        query = query.where(time_column < until)
+    if department:
+        query = query.where(department_column == department)
+    if lab:
+        query = query.where(lab_column == lab)
     
-    writer.writerow([
-        'Timestamp', 'System ID', 'Idle Minutes', 'Action',
-        'Energy (kWh)', 'CO2 (kg)', 'Cost Saved (₹)', 'Reason'
-    ])
+    return query.order_by(*order), [(column.key, kind) for column, kind in columns], time_column.key
+
+@app.route('/api/v1/export/csv', methods=['GET'])
+@jwt_required()
+def export_csv():
+    """Export logs as CSV, streamed in chunks straight from the database"""
+    try:
+        since, until = export_window(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    for log in logs:
-        writer.writerow([
+    department = request.args.get('department')
+    lab = request.args.get('lab')
+    compress = request.args.get('gzip', 'false').lower() == 'true'
+    
+    query = db.select(
+        AgentLog.timestamp, AgentLog.pc_id, AgentLog.idle_minutes, AgentLog.idle_increment, AgentLog.action,
+        AgentLog.energy_kwh, AgentLog.co2_kg, AgentLog.cost_saved, AgentLog.reason
+    ).where(AgentLog.timestamp >= since)
+    
+    if until:
+        query = query.where(AgentLog.timestamp < until)
+    if department or lab:
+        query = query.join(System, System.id == AgentLog.system_id)
+        if department:
+            query = query.where(System.department == department)
+        if lab:
+            query = query.where(System.lab == lab)
+    
+    query = query.order_by(AgentLog.timestamp.desc())
+    
+    log_audit('export_csv', 'logs', None,
+              f'Exported logs since {since:%Y-%m-%d}' + (f' until {until:%Y-%m-%d}' if until else '') +
+              (f' department={department}' if department else '') + (f' lab={lab}' if lab else ''))
+    
+    def format_row(log):
+        return [
             log.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
             log.pc_id,
             log.idle_minutes,
+            log.idle_increment,  # empty for logs stored before sessions were tracked
             log.action,
             log.energy_kwh or 0,
             log.co2_kg or 0,
             log.cost_saved or 0,
             log.reason or ''
-        ])
+        ]
     
-    output.seek(0)
+    def generate():
+        # yield_per streams from a server-side cursor where the driver has one
+        result = db.session.execute(query.execution_options(yield_per=Config.EXPORT_BATCH_SIZE))
+        yield from iter_csv([
+            'Timestamp', 'System ID', 'Idle Minutes', 'Idle Increment', 'Action',
+            'Energy (kWh)', 'CO2 (kg)', 'Cost Saved (₹)', 'Reason'
+        ], result.partitions(), format_row, compress=compress)
     
-    log_audit('export_csv', 'logs', None, f'Exported {len(logs)} records')
+    filename = f'greenops_export_{datetime.now().strftime("%Y%m%d")}.csv' + ('.gz' if compress else '')
     
     return Response(
-        output.getvalue(),
-        mimetype='text/csv',
+        stream_with_context(generate()),
+        mimetype='application/gzip' if compress else 'text/csv',
         headers={
-            'Content-Disposition': f'attachment; filename=greenops_export_{datetime.now().strftime("%Y%m%d")}.csv'
+            'Content-Disposition': f'attachment; filename={filename}'
         }
     )
 
+@app.route('/api/v1/export/columnar', methods=['GET'])
+@jwt_required()
+def export_columnar():
+    """Export agent logs or rollups as a Parquet or Arrow IPC file"""
+    table = request.args.get('table', 'agent_logs')
+    fmt = request.args.get('format', 'parquet')
+    
+    if table not in COLUMNAR_TABLES:
+        return jsonify({'error': f"table must be one of: {', '.join(COLUMNAR_TABLES)}"}), 400
+    if fmt not in COLUMNAR_FORMATS:
+        return jsonify({'error': f"format must be one of: {', '.join(COLUMNAR_FORMATS)}"}), 400
+    if not columnar_available():
+        return jsonify({'error': 'Columnar export requires pyarrow on the server'}), 501
+    
+    try:
+        since, until = export_window(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    query, columns, _ = export_query(table, since, until, request.args.get('department'), request.args.get('lab'))
+    result = db.session.execute(query.execution_options(yield_per=Config.EXPORT_ROW_GROUP_SIZE))
+    
+    # Parquet writes its footer last, so the file is built on disk (one
+    # row group in memory at a time) and sent once complete
+    output = tempfile.TemporaryFile()
+    rows = write_columnar(output, columns, result.partitions(), fmt)
+    output.seek(0)
+    
+    log_audit('export_columnar', table, None, f'Exported {rows} {table} records as {fmt}')
+    
+    return send_file(
+        output,
+        mimetype='application/vnd.apache.parquet' if fmt == 'parquet' else 'application/vnd.apache.arrow.file',
+        as_attachment=True,
+        download_name=f'greenops_{table}_{datetime.now().strftime("%Y%m%d")}{COLUMNAR_FORMATS[fmt]}'
+    )
+
 # ----------------------
 # POLICIES API
 # ----------------------
@@ -873,12 +3020,75 @@ def get_policies():
     policies = Policy.query.all()
     return jsonify([p.to_dict() for p in policies]), 200
 
+# Targeting fields, validated together by parse_policy_target
+POLICY_TARGET_FIELDS = ('scope', 'department', 'lab', 'mac_address', 'priority')
+
+# Target fields each scope keeps; the others are cleared
+SCOPE_TARGETS = {
+    'organization': (),
+    'department': ('department',),
+    'lab': ('department', 'lab'),
+    'system': ('mac_address',)
+}
+
+def parse_policy_target(data, policy=None):
+    """Scope, target and priority from a request body, over the policy's
+    current values; raises ValueError if the target is incomplete"""
+    current = policy.to_dict() if policy else {}
+    target = {field: data.get(field, current.get(field)) for field in POLICY_TARGET_FIELDS}
+    
+    scope = target['scope'] or 'organization'
+    if scope not in POLICY_SCOPES:
+        raise ValueError(f"scope must be one of: {', '.join(POLICY_SCOPES)}")
+    for field in ('department', 'lab', 'mac_address'):
+        if field not in SCOPE_TARGETS[scope]:
+            target[field] = None
+        elif target[field] is not None and not isinstance(target[field], str):
+            raise ValueError(f"Invalid {field}")
+    
+    required = {'department': 'department', 'lab': 'lab', 'system': 'mac_address'}.get(scope)
+    if required and not target[required]:
+        raise ValueError(f"A {scope} policy needs {required}")
+    if target['mac_address']:
+        target['mac_address'] = normalize_mac(target['mac_address'])
+    
+    priority = target['priority'] or 0
+    if isinstance(priority, bool) or not isinstance(priority, int):
+        raise ValueError('priority must be an integer')
+    
+    target.update(scope=scope, priority=priority)
+    return target
+
+@app.route('/api/v1/policies/effective', methods=['GET'])
+@jwt_required()
+def effective_policy():
+    """The policy a system, lab or department resolves to"""
+    mac_address = request.args.get('mac_address')
+    if mac_address:
+        department, lab, mac = agent_placement(mac_address)
+    else:
+        department, lab, mac = request.args.get('department'), request.args.get('lab'), None
+    
+    document = policy_cache.get().resolve(department, lab, mac)
+    return jsonify({
+        'policy': document.policy,
+        'version': document.version,
+        'department': department,
+        'lab': lab,
+        'mac_address': mac
+    }), 200
+
 @app.route('/api/v1/policies', methods=['POST'])
 @admin_required
 def create_policy():
     """Create new policy"""
     data = request.get_json()
     
+    try:
+        target = parse_policy_target(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     policy = Policy(
         name=data['name'],
         description=data.get('description'),
@@ -887,16 +3097,173 @@ def create_policy():
         action_type=data.get('action_type', 'sleep'),
         warning_enabled=data.get('warning_enabled', True),
         warning_duration=data.get('warning_duration', 300),
-        schedule=data.get('schedule')
+        schedule=data.get('schedule'),
+        **target
     )
     
     db.session.add(policy)
     db.session.commit()
+    policy_cache.refresh()
     
     log_audit('create_policy', 'policy', policy.id, data['name'])
     
     return jsonify(policy.to_dict()), 201
 
+# Fields an update may change
+POLICY_FIELDS = ('name', 'description', 'idle_threshold', 'sleep_threshold', 'action_type', 'warning_enabled',
+                 'warning_duration', 'schedule', 'is_active')
+
+@app.route('/api/v1/policies/<int:policy_id>', methods=['PUT'])
+@admin_required
+def update_policy(policy_id):
+    """Update a policy; connected agents get the change pushed right away"""
+    policy = Policy.query.get(policy_id)
+    if not policy:
+        return jsonify({'error': 'Policy not found'}), 404
+    
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Invalid request body'}), 400
+    
+    changes = {field: data[field] for field in POLICY_FIELDS if field in data}
+    if any(field in data for field in POLICY_TARGET_FIELDS):
+        try:
+            changes.update(parse_policy_target(data, policy))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    for field, value in changes.items():
+        setattr(policy, field, value)
+    db.session.commit()
+    policy_cache.refresh()
+    
+    log_audit('update_policy', 'policy', policy.id, json.dumps(changes, default=str))
+    
+    return jsonify(policy.to_dict()), 200
+
+def load_idle_traces(since, until=None, department=None, lab=None, min_idle_minutes=0):
+    """Idle stretches in agent_logs since `since` for the policy simulator.
+    
+    Reports are streamed in EXPORT_BATCH_SIZE chunks straight into NumPy
+    arrays. Only reports idle for at least `min_idle_minutes` are read: a
+    stretch's longest report decides its length, and shorter stretches
+    cannot trigger any candidate. For reports that put the system to
+    sleep, the system's next report stands in for the time it woke.
+    """
+    later = db.aliased(AgentLog)
+    next_report = db.select(db.func.min(later.timestamp))\
+        .where(later.system_id == AgentLog.system_id, later.timestamp > AgentLog.timestamp)\
+        .scalar_subquery()
+    
+    stmt = db.select(
+        AgentLog.system_id,
+        AgentLog.timestamp,
+        AgentLog.idle_minutes,
+        db.case((AgentLog.action.in_(SLEEP_ACTIONS), next_report))
+    ).where(
+        AgentLog.timestamp >= since,
+        AgentLog.system_id.isnot(None),
+        AgentLog.idle_minutes >= min_idle_minutes
+    )
+    if until:
+        stmt = stmt.where(AgentLog.timestamp < until)
+    if department or lab:
+        stmt = stmt.join(System, System.id == AgentLog.system_id).where(*system_filters(department=department, lab=lab))
+    stmt = stmt.order_by(AgentLog.system_id, AgentLog.timestamp)
+    
+    columns = ([], [], [], [])
+    result = db.session.execute(stmt.execution_options(yield_per=Config.EXPORT_BATCH_SIZE))
+    for batch in result.partitions():
+        system_ids, timestamps, idle_minutes, next_reports = zip(*batch)
+        columns[0].append(np.array(system_ids, dtype=np.int64))
+        columns[1].append(epoch_seconds(timestamps))
+        columns[2].append(np.array(idle_minutes, dtype=np.float64))
+        columns[3].append(epoch_seconds(next_reports))
+    
+    if not columns[0]:
+        return IdleTraces([], [], [], [])
+    
+    system_ids, timestamps, idle_minutes, next_reports = (np.concatenate(column) for column in columns)
+    return IdleTraces.from_reports(system_ids, timestamps, idle_minutes, ~np.isnan(next_reports), next_reports,
+                                   tolerance=Config.SESSION_TOLERANCE_SECONDS)
+
+def parse_simulation(data):
+    """Validate a simulation request; raises ValueError with a client-facing message"""
+    if not isinstance(data, dict):
+        raise ValueError('Invalid request body')
+    
+    candidates = data.get('candidates') or []
+    if not isinstance(candidates, list) or not all(isinstance(candidate, dict) for candidate in candidates):
+        raise ValueError('candidates must be a list of policy objects')
+    
+    grid = data.get('grid') or {}
+    if not isinstance(grid, dict):
+        raise ValueError('grid must map policy parameters to lists of values')
+    
+    if grid:
+        candidates = candidates + expand_grid(grid)
+    candidates = [normalize_candidate(candidate) for candidate in candidates]
+    if not candidates:
+        raise ValueError('Missing candidates or grid')
+    if len(candidates) > Config.SIMULATION_MAX_CANDIDATES:
+        raise ValueError(f'At most {Config.SIMULATION_MAX_CANDIDATES} candidates per simulation')
+    
+    try:
+        days = int(data.get('days', 30))
+        interruption_window = float(data.get('interruption_window', 10))
+    except (TypeError, ValueError):
+        raise ValueError('days and interruption_window must be numbers')
+    if not 0 < days <= Config.SIMULATION_MAX_DAYS:
+        raise ValueError(f'days must be between 1 and {Config.SIMULATION_MAX_DAYS}')
+    
+    return {
+        'candidates': candidates,
+        'days': days,
+        'interruption_window': max(interruption_window, 0),
+        'department': data.get('department'),
+        'lab': data.get('lab'),
+        'per_system': bool(data.get('per_system'))
+    }
+
+@app.route('/api/v1/policies/simulate', methods=['POST'])
+@limiter.limit("10 per minute")
+@admin_required
+def simulate_policies():
+    """Replay historical idle data against candidate policies"""
+    try:
+        params = parse_simulation(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # The policy the simulated department or lab follows is the baseline
+    active = policy_cache.get().resolve(params['department'], params['lab']).policy
+    baseline = {name: active.get(name, default) for name, default in POLICY_DEFAULTS.items()}
+    candidates = [normalize_candidate(baseline)] + params['candidates']
+    
+    until = datetime.utcnow()
+    since = until - timedelta(days=params['days'])
+    min_idle = min(min(candidate['idle_threshold'], action_minutes(candidate)) for candidate in candidates)
+    traces = load_idle_traces(since, until, params['department'], params['lab'], min_idle_minutes=min_idle)
+    
+    power = {
+        system_id: watts or Config.DEFAULT_POWER_WATTS
+        for system_id, watts in db.session.execute(
+            db.select(System.id, System.power_watts).where(*system_filters(department=params['department'], lab=params['lab']))
+        )
+    }
+    # Savings are what the candidates would save from now on, at today's intensity and tariff
+    co2_factor, cost_per_kwh = carbon_intensity.lookup(until)
+    results = simulate(traces, candidates, power, co2_factor, cost_per_kwh,
+                       interruption_window=params['interruption_window'], per_system=params['per_system'])
+    
+    return jsonify({
+        'since': since.isoformat(),
+        'until': until.isoformat(),
+        'systems': len(np.unique(traces.system_ids)),
+        'stretches': len(traces),
+        'baseline': results[0],
+        'results': results[1:]
+    }), 200
+
 # ----------------------
 # HEALTH CHECK
 # ----------------------
@@ -909,57 +3276,52 @@ def health():
     except Exception as e:
         db_status = f'error: {str(e)}'
     
-    return jsonify({
+    health_data = {
         'status': 'ok',
         'version': '2.0.0',
         'database': db_status,
         'demo_mode': Config.DEMO_MODE
-    }), 200
+    }
+    
+    health_data['response_cache'] = {'backend': Config.RESPONSE_CACHE_BACKEND, **response_cache.stats()}
+    
+    if Config.INGEST_WRITE_BEHIND:
+        health_data['ingest_queue'] = {'depth': len(ingest_buffer), **ingest_buffer.stats}
+    
+    health_data['offline_reaper'] = {'interval': Config.OFFLINE_REAPER_INTERVAL, **offline_reaper.stats}
+    health_data['fleet'] = {'systems': len(fleet), 'interval': Config.FLEET_SYNC_INTERVAL, **fleet_sync.stats}
+    if Config.ENABLE_ML_PREDICTIONS:
+        model = forecast_store.model
+        health_data['forecast'] = {
+            'trained_through': model.trained_through.isoformat() if model and model.trained_through else None,
+            'interval': Config.FORECAST_TRAIN_INTERVAL,
+            **forecast_job.stats
+        }
+    policy_index = policy_cache.get()
+    health_data['policy'] = {'version': policy_index.resolve().version, 'active': len(policy_index),
+                             'subscribers': policy_cache.waiting, **policy_cache.stats}
+    health_data['carbon_intensity'] = {'points': len(carbon_intensity), 'interval': Config.CARBON_INTENSITY_SYNC_INTERVAL,
+                                       **intensity_sync.stats}
+    
+    return jsonify(health_data), 200
 
 # ----------------------
 # PROMETHEUS METRICS
 # ----------------------
+def _refresh_legacy_metrics(now):
+    # The deprecated 24h gauges need a rollup query: at most one per BUDGET_RESYNC_INTERVAL, not one per scrape
+    if telemetry.legacy_synced_at is None or \
+       (now - telemetry.legacy_synced_at).total_seconds() >= Config.BUDGET_RESYNC_INTERVAL:
+        totals = rollup_totals(HourlyRollup, hour_bucket(now - timedelta(hours=24)))
+        telemetry.record_legacy_totals(totals['co2_kg'], totals['energy_kwh'], now)
+
 @app.route('/metrics', methods=['GET'])
+@limiter.exempt
 def prometheus_metrics():
     """Prometheus metrics endpoint"""
-    logs = AgentLog.query.filter(
-        AgentLog.timestamp >= datetime.utcnow() - timedelta(hours=24)
-    ).all()
-    
-    total_co2 = sum(log.co2_kg or 0 for log in logs)
-    total_energy = sum(log.energy_kwh or 0 for log in logs)
-    total_actions = len([l for l in logs if l.action != 'NONE'])
-    
-    systems_active = System.query.filter_by(status='active', is_active=True).count()
-    systems_idle = System.query.filter_by(status='idle', is_active=True).count()
-    systems_sleeping = System.query.filter_by(status='sleeping', is_active=True).count()
-    
-    metrics = f"""# HELP greenops_carbon_emissions_kg Total carbon emissions in kg
-# TYPE greenops_carbon_emissions_kg gauge
-greenops_carbon_emissions_kg {total_co2}
-
-# HELP greenops_energy_kwh Total energy consumption in kWh
-# TYPE greenops_energy_kwh gauge
-greenops_energy_kwh {total_energy}
-
-# HELP greenops_actions_total Total power management actions
-# TYPE greenops_actions_total counter
-greenops_actions_total {total_actions}
-
-# HELP greenops_systems_active Number of active systems
-# TYPE greenops_systems_active gauge
-greenops_systems_active {systems_active}
-
-# HELP greenops_systems_idle Number of idle systems
-# TYPE greenops_systems_idle gauge
-greenops_systems_idle {systems_idle}
-
-# HELP greenops_systems_sleeping Number of sleeping systems
-# TYPE greenops_systems_sleeping gauge
-greenops_systems_sleeping {systems_sleeping}
-"""
-    
-    return Response(metrics, mimetype='text/plain')
+    _refresh_legacy_metrics(datetime.utcnow())
+    body, content_type = telemetry.render()
+    return Response(body, content_type=content_type)
 
 # ----------------------
 # ERROR HANDLERS
@@ -974,11 +3336,168 @@ def internal_error(error):
     app.logger.error(f'Server Error: {error}')
     return jsonify({'error': 'Internal server error'}), 500
 
+# ----------------------
+# CLI COMMANDS
+# ----------------------
+def _parse_date_option(value):
+    return datetime.strptime(value, '%Y-%m-%d') if value else None
+
+def _clamp_to_retention(start):
+    # Older raw logs have been purged; rebuilding from them would wipe the rollups
+    if Config.LOG_RETENTION_DAYS:
+        cutoff = day_bucket(datetime.utcnow()) - timedelta(days=Config.LOG_RETENTION_DAYS)
+        if start < cutoff:
+            click.echo(f"Starting at the retention cutoff {cutoff:%Y-%m-%d}; older logs have been purged")
+            return cutoff
+    return start
+
+@app.cli.command('backfill-rollups')
+@click.option('--since', help='First day to rebuild (YYYY-MM-DD). Defaults to the oldest agent log.')
+@click.option('--until', help='Day after the last one to rebuild (YYYY-MM-DD). Defaults to tomorrow.')
+def backfill_rollups_command(since, until):
+    """Rebuild hourly/daily rollups from agent_logs"""
+    start = _parse_date_option(since) or db.session.query(db.func.min(AgentLog.timestamp)).scalar()
+    end = _parse_date_option(until) or day_bucket(datetime.utcnow()) + timedelta(days=1)
+    
+    if start is None:
+        click.echo('No agent logs to roll up')
+        return
+    
+    start = _clamp_to_retention(start)
+    click.echo(f"Rebuilding rollups from {start:%Y-%m-%d} to {end:%Y-%m-%d}")
+    rebuild_rollups(start, end, progress=lambda day, systems: click.echo(f"  {day:%Y-%m-%d}: {systems} systems"))
+    click.echo('Done')
+
+@app.cli.command('purge-logs')
+@click.option('--days', type=int, help='Keep this many days of raw logs. Defaults to LOG_RETENTION_DAYS.')
+@click.option('--hourly-days', type=int, help='Keep this many days of hourly rollups. Defaults to ROLLUP_HOURLY_RETENTION_DAYS.')
+@click.option('--dry-run', is_flag=True, help='Report what would be purged without changing anything')
+def purge_logs_command(days, hourly_days, dry_run):
+    """Downsample and delete raw agent logs past the retention window"""
+    if not (days or Config.LOG_RETENTION_DAYS or hourly_days or Config.ROLLUP_HOURLY_RETENTION_DAYS):
+        raise click.ClickException('No retention window: pass --days or set LOG_RETENTION_DAYS')
+    
+    def progress(day, rows, rolled_up):
+        verb = 'would delete' if dry_run else 'deleted'
+        click.echo(f"  {day:%Y-%m-%d}: {verb} {rows} rows" + (' (rolled up first)' if rolled_up else ''))
+    
+    summary = purge_agent_logs(days, hourly_days, dry_run=dry_run, progress=progress)
+    click.echo(f"{'Would purge' if dry_run else 'Purged'} {summary['log_rows']} agent logs over {summary['days']} days "
+               f"({summary['days_rolled_up']} rolled up, {summary['partitions_dropped']} partitions dropped) "
+               f"and {summary['hourly_rollup_rows']} hourly rollups")
+
+@app.cli.command('import-intensity')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def import_intensity_command(path):
+    """Load carbon intensity / tariff points from a CSV file"""
+    with open(path, newline='', encoding='utf-8') as f:
+        try:
+            points = read_intensity_csv(f)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    
+    written = import_carbon_intensity(points, source=os.path.basename(path))
+    click.echo(f"Imported {written} points; {len(carbon_intensity)} in the series")
+    if points:
+        click.echo(f"Run flask reprice --since {min(point[0] for point in points):%Y-%m-%d} "
+                   f"to apply them to stored data")
+
+@app.cli.command('reprice')
+@click.option('--since', help='First day to reprice (YYYY-MM-DD). Defaults to the oldest agent log.')
+@click.option('--until', help='Day after the last one to reprice (YYYY-MM-DD). Defaults to tomorrow.')
+def reprice_command(since, until):
+    """Recompute CO2 and cost of stored logs, sessions and rollups from the intensity series"""
+    start = _parse_date_option(since) or db.session.query(db.func.min(AgentLog.timestamp)).scalar()
+    end = _parse_date_option(until) or day_bucket(datetime.utcnow()) + timedelta(days=1)
+    
+    if start is None:
+        click.echo('No agent logs to reprice')
+        return
+    
+    start = _clamp_to_retention(start)
+    click.echo(f"Repricing from {start:%Y-%m-%d} to {end:%Y-%m-%d}")
+    rows = reprice_history(start, end, progress=lambda day, logs, sessions: click.echo(
+        f"  {day:%Y-%m-%d}: {logs} logs, {sessions} sessions"))
+    click.echo(f"Repriced {rows} agent logs")
+
+@app.cli.command('train-forecast')
+@click.option('--full', is_flag=True, help='Discard the saved model and retrain on FORECAST_HISTORY_DAYS of history')
+def train_forecast_command(full):
+    """Train the idle forecast model up to the last complete hour"""
+    trained = train_forecast(full=full, progress=lambda day, systems, hours: click.echo(
+        f"  {day:%Y-%m-%d %H:00}: {systems} systems, {hours} system-hours"))
+    click.echo(f"Trained on {trained} system-hours; model saved to {Config.FORECAST_MODEL_PATH}")
+
+@app.cli.command('reap-offline')
+def reap_offline_command():
+    """Mark systems offline that have not reported within OFFLINE_GRACE_SECONDS"""
+    click.echo(f"Marked {reap_offline_systems()} systems offline")
+
+@app.cli.command('export-columnar')
+@click.option('--table', type=click.Choice(list(COLUMNAR_TABLES)), default='agent_logs', show_default=True)
+@click.option('--format', 'fmt', type=click.Choice(list(COLUMNAR_FORMATS)), default='parquet', show_default=True)
+@click.option('--since', help='First day to export (YYYY-MM-DD). Defaults to everything.')
+@click.option('--until', help='Day after the last one to export (YYYY-MM-DD).')
+@click.option('--out', 'directory', default='exports', show_default=True, help='Output directory')
+def export_columnar_command(table, fmt, since, until, directory):
+    """Export a table as month-partitioned Parquet/Arrow files"""
+    if not columnar_available():
+        raise click.ClickException('Columnar export requires pyarrow (pip install pyarrow)')
+    
+    query, columns, time_column = export_query(table, _parse_date_option(since), _parse_date_option(until))
+    result = db.session.execute(query.execution_options(yield_per=Config.EXPORT_ROW_GROUP_SIZE))
+    
+    written = write_monthly_partitions(os.path.join(directory, table), table, columns,
+                                       result.partitions(), time_column, fmt)
+    for path, rows in written:
+        click.echo(f"  {path}: {rows} rows")
+    click.echo(f"Exported {sum(rows for _, rows in written)} rows to {len(written)} files")
+
 # ----------------------
 # INITIALIZE DATABASE
 # ----------------------
+def ensure_columns():
+    """Add nullable model columns missing from tables that predate them"""
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable or column.server_default is not None:
+                continue
+            
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}')
+            app.logger.info(f'Added column {table.name}.{column.name}')
+
+def ensure_indexes():
+    """Create model indexes missing from tables that predate them"""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
 with app.app_context():
+    if Config.AGENT_LOG_PARTITIONING and db.engine.dialect.name == 'postgresql':
+        create_partitioned_agent_logs()
     db.create_all()
+    ensure_columns()
+    ensure_indexes()
+    ensure_log_partitions()
+    
+    # Baseline for the in-memory fleet index, session tracker and the incremental gauges
+    load_fleet()
+    load_sessions()
+    load_carbon_intensity()
+    sync_carbon_budget()
+    telemetry.seed_systems({
+        (status, department): count
+        for status, department, count in db.session.query(
+            System.status, System.department, db.func.count(System.id)
+        ).group_by(System.status, System.department)
+    })
     
     # Create default admin user if not exists
     if not User.query.filter_by(username='admin').first():
@@ -0,0 +1,245 @@
+"""
+GreenOps background workers
+In-process helpers that move work off the request path
+"""
+
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger('greenops.background')
+
+
+class WriteBehindBuffer:
+    """Bounded in-process queue drained to storage by a background thread.
+
+    Items are handed to ``flush_fn`` in batches of at most ``flush_size``,
+    either when that many are waiting or every ``flush_interval`` seconds.
+    When the queue is full, ``put()`` waits up to ``put_timeout`` seconds and
+    then reports failure so the caller can push back on the client.
+
+    A batch that fails is retried first, up to ``max_retries`` times with
+    the delay doubling from ``retry_delay`` seconds, which rides out a
+    short storage outage. After that it is written in halves, down to
+    single items, so one bad item cannot hold up the queue: items that
+    still fail on their own are passed to ``on_failure(item, error)`` (a
+    dead-letter hook) and dropped.
+    """
+
+    def __init__(self, flush_fn, max_size=10000, flush_size=500, flush_interval=0.5, put_timeout=0.05,
+                 max_retries=5, retry_delay=1.0, on_failure=None):
+        self.flush_fn = flush_fn
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.on_failure = on_failure
+
+        self._queue = queue.Queue(maxsize=max_size)
+        self._pending = None  # batch that failed to flush, retried first
+        self._attempts = 0  # failed flushes of the pending batch
+        self._retry_at = 0.0
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+        self.stats = {'queued': 0, 'flushed': 0, 'rejected': 0, 'failed_flushes': 0, 'dropped': 0}
+
+        atexit.register(self.close)
+
+    def __len__(self):
+        return self._queue.qsize() + (len(self._pending) if self._pending else 0)
+
+    def put(self, item):
+        """Queue an item. Returns False if the buffer is full."""
+        self._ensure_started()
+
+        try:
+            self._queue.put(item, timeout=self.put_timeout)
+        except queue.Full:
+            self.stats['rejected'] += 1
+            return False
+
+        self.stats['queued'] += 1
+        if self._queue.qsize() >= self.flush_size:
+            self._wakeup.set()
+        return True
+
+    def flush(self, force=False):
+        """Write out everything currently queued. Returns the number of items flushed.
+
+        A failed batch waiting out its retry delay stops the flush unless
+        ``force`` is set.
+        """
+        flushed = 0
+        with self._flush_lock:
+            while True:
+                if self._pending and not force and time.monotonic() < self._retry_at:
+                    break
+
+                batch = self._pending or self._take(self.flush_size)
+                if not batch:
+                    break
+
+                try:
+                    self.flush_fn(batch)
+                    written = len(batch)
+                except Exception as e:
+                    self.stats['failed_flushes'] += 1
+                    self._attempts += 1
+                    if self._attempts <= self.max_retries:
+                        # Keep the batch and retry it after a delay; new items
+                        # back up in the queue meanwhile
+                        self._pending = batch
+                        self._retry_at = time.monotonic() + self.retry_delay * 2 ** (self._attempts - 1)
+                        logger.error(f"Write-behind flush of {len(batch)} items failed "
+                                     f"(attempt {self._attempts}): {e}")
+                        break
+
+                    logger.error(f"Write-behind flush of {len(batch)} items failed {self._attempts} times, "
+                                 f"writing it in parts: {e}")
+                    written = self._flush_parts(batch, e)
+
+                self._pending = None
+                self._attempts = 0
+                self.stats['flushed'] += written
+                flushed += written
+
+        return flushed
+
+    def _flush_parts(self, batch, error):
+        """Write a failing batch in halves; returns the number of items written"""
+        if len(batch) == 1:
+            self._drop(batch[0], error)
+            return 0
+
+        written = 0
+        middle = len(batch) // 2
+        for part in (batch[:middle], batch[middle:]):
+            try:
+                self.flush_fn(part)
+                written += len(part)
+            except Exception as e:
+                self.stats['failed_flushes'] += 1
+                written += self._flush_parts(part, e)
+        return written
+
+    def _drop(self, item, error):
+        self.stats['dropped'] += 1
+        logger.error(f"Write-behind item dropped after repeated failures: {error}")
+        if self.on_failure is None:
+            return
+        try:
+            self.on_failure(item, error)
+        except Exception as e:
+            logger.error(f"Write-behind failure hook failed: {e}")
+
+    def close(self):
+        """Stop the flusher thread and drain whatever is left"""
+        self._stopping.set()
+        self._wakeup.set()
+
+        if self._thread and self._pid == os.getpid():
+            self._thread.join(timeout=10)
+
+        self.flush(force=True)
+
+        if len(self):
+            logger.error(f"Write-behind buffer closed with {len(self)} unflushed items")
+
+    def _take(self, limit):
+        items = []
+        while len(items) < limit:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _ensure_started(self):
+        # Threads do not survive fork(), so pre-forking servers get a
+        # fresh flusher per worker process
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='greenops-write-behind', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+class PeriodicJob:
+    """Runs ``fn`` every ``interval`` seconds on a daemon thread.
+
+    The thread is started lazily by ``ensure_started()`` and restarted in
+    each forked worker process. A failing run is logged and the job keeps
+    its schedule.
+    """
+
+    def __init__(self, fn, interval, name='greenops-job'):
+        self.fn = fn
+        self.interval = interval
+        self.name = name
+
+        self._stopping = threading.Event()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+        self.stats = {'runs': 0, 'failures': 0, 'last_run': None}
+
+        atexit.register(self.stop)
+
+    def run_once(self):
+        try:
+            result = self.fn()
+        except Exception as e:
+            self.stats['failures'] += 1
+            logger.error(f"{self.name} failed: {e}")
+            return None
+        finally:
+            self.stats['runs'] += 1
+            self.stats['last_run'] = time.time()
+        return result
+
+    def ensure_started(self):
+        if not self.interval or self._running():
+            return
+
+        with self._start_lock:
+            if self._running():
+                return
+
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread and self._pid == os.getpid():
+            self._thread.join(timeout=10)
+
+    def _running(self):
+        return self._pid == os.getpid() and self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            self.run_once()
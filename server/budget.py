@@ -0,0 +1,105 @@
+"""
+GreenOps carbon budget engine
+Running month-to-date carbon totals with burn-rate projection
+"""
+
+import calendar
+import threading
+from datetime import datetime
+
+TOTAL_FIELDS = ('co2_kg', 'energy_kwh', 'cost_saved')
+
+
+def month_start(timestamp):
+    """First instant of the month containing timestamp"""
+    return timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _empty_totals():
+    return {field: 0.0 for field in TOTAL_FIELDS}
+
+
+class CarbonBudget:
+    """Month-to-date carbon totals, fleet-wide and per department.
+
+    The engine is loaded from the daily rollups with reset(), kept current
+    at ingest with add(), and answers budget questions in constant time.
+    When the month rolls over, needs_reset() turns true and the owner
+    reloads it for the new month.
+    """
+
+    def __init__(self, monthly_budget):
+        self.monthly_budget = monthly_budget
+        self.month = None
+        self.synced_at = None
+        self.totals = _empty_totals()
+        self.departments = {}
+        self.department_budgets = {}
+        self._lock = threading.Lock()
+
+    def reset(self, month, totals, departments, department_budgets, now=None):
+        """Replace state with freshly loaded month-to-date totals.
+
+        `totals` and each value of `departments` are dicts with TOTAL_FIELDS;
+        `department_budgets` maps department name to its monthly budget.
+        """
+        with self._lock:
+            self.month = month
+            self.totals = {**_empty_totals(), **totals}
+            self.departments = {name: {**_empty_totals(), **values} for name, values in departments.items()}
+            self.department_budgets = dict(department_budgets)
+            self.synced_at = now or datetime.utcnow()
+
+    def needs_reset(self, now):
+        return self.month is None or month_start(now) != self.month
+
+    def add(self, timestamp, department, co2_kg=0, energy_kwh=0, cost_saved=0):
+        """Add ingested usage; anything outside the current month is ignored"""
+        if self.month is None or month_start(timestamp) != self.month:
+            return
+
+        values = {'co2_kg': co2_kg or 0, 'energy_kwh': energy_kwh or 0, 'cost_saved': cost_saved or 0}
+        with self._lock:
+            department_totals = self.departments.setdefault(department, _empty_totals())
+            for field, value in values.items():
+                self.totals[field] += value
+                department_totals[field] += value
+
+    def status(self, now, department=None):
+        """Budget position for the fleet, or for one department.
+
+        The projection extrapolates the month-to-date burn rate linearly to
+        the end of the month.
+        """
+        if department is None:
+            totals = self.totals
+            budget = self.monthly_budget
+        else:
+            totals = self.departments.get(department, _empty_totals())
+            budget = self.department_budgets.get(department)
+
+        month = self.month or month_start(now)
+        days_in_month = calendar.monthrange(month.year, month.month)[1]
+        elapsed_days = max((now - month).total_seconds() / 86400, 1 / 24)
+
+        used = totals['co2_kg']
+        burn_rate = used / elapsed_days
+        projected = burn_rate * days_in_month
+
+        return {
+            'month': month.strftime('%Y-%m'),
+            'budget_kg': budget,
+            'used_kg': round(used, 3),
+            'energy_kwh': round(totals['energy_kwh'], 3),
+            'cost_saved': round(totals['cost_saved'], 2),
+            'remaining_kg': round(budget - used, 3) if budget is not None else None,
+            'used_percentage': round(used / budget * 100, 1) if budget else None,
+            'burn_rate_kg_per_day': round(burn_rate, 3),
+            'projected_month_end_kg': round(projected, 3),
+            'projected_percentage': round(projected / budget * 100, 1) if budget else None,
+            'on_track': projected <= budget if budget is not None else None
+        }
+
+    def department_statuses(self, now):
+        names = set(self.departments) | set(self.department_budgets)
+        return {name: self.status(now, name) for name in sorted(name for name in names if name)}
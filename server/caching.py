@@ -0,0 +1,216 @@
+"""
+GreenOps caching helpers
+In-process and shared caches for the server's hot paths
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# What the response cache stores: a rendered response body with its status and mimetype
+CachedResponse = namedtuple('CachedResponse', ['body', 'status', 'mimetype'])
+
+
+class LRUCache:
+    """Thread-safe LRU cache with an optional time-to-live per entry.
+
+    Entries are evicted least-recently-used first once ``maxsize`` is
+    reached, and treated as missing once older than ``ttl`` seconds.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+
+            value, expires = item
+            if expires is not None and expires <= self._clock():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = self._clock() + ttl if ttl else None
+
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class LocalCacheBackend:
+    """Response cache storage for a single process"""
+
+    def __init__(self, maxsize=1024):
+        self._entries = LRUCache(maxsize=maxsize)
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def set(self, key, value, ttl):
+        self._entries.set(key, value, ttl=ttl)
+
+    def get_version(self, namespace):
+        return self._versions.get(namespace, 0)
+
+    def bump_version(self, namespace):
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+            return self._versions[namespace]
+
+
+class RedisCacheBackend:
+    """Response cache storage shared by all workers through Redis.
+
+    Values are CachedResponse tuples, stored as a one-line JSON header
+    (status and mimetype) followed by the raw body, so nothing read back
+    from Redis is ever unpickled.
+    """
+
+    def __init__(self, url, prefix='greenops:cache:'):
+        import redis  # optional dependency, only needed for this backend
+
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def get(self, key):
+        value = self._client.get(self._prefix + key)
+        return self.decode(value) if value is not None else None
+
+    def set(self, key, value, ttl):
+        self._client.set(self._prefix + key, self.encode(value), ex=max(int(ttl), 1))
+
+    @staticmethod
+    def encode(response):
+        header = json.dumps({'status': response.status, 'mimetype': response.mimetype})
+        return header.encode('utf-8') + b'\n' + response.body
+
+    @staticmethod
+    def decode(value):
+        header, _, body = value.partition(b'\n')
+        header = json.loads(header)
+        return CachedResponse(body, header['status'], header['mimetype'])
+
+    def get_version(self, namespace):
+        return int(self._client.get(f"{self._prefix}version:{namespace}") or 0)
+
+    def bump_version(self, namespace):
+        return self._client.incr(f"{self._prefix}version:{namespace}")
+
+
+class ResponseCache:
+    """TTL cache for computed responses, invalidated by data version bumps.
+
+    Every key is stored under the current version of its namespace, so
+    bump() makes all earlier entries unreachable at once. Bumps can be
+    throttled with ``min_interval`` so a steady stream of writes does not
+    defeat the cache. A throttled bump is dropped, not deferred, so entries
+    may then stay stale until the next bump or their TTL: the TTL is the
+    bound on staleness.
+    """
+
+    def __init__(self, backend, default_ttl=10, clock=time.monotonic, on_lookup=None):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self._clock = clock
+        self._on_lookup = on_lookup
+        self._last_bump = {}
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def bump(self, namespace='data', min_interval=0):
+        """Invalidate a namespace; skipped if bumped less than min_interval seconds ago"""
+        now = self._clock()
+        if min_interval and now - self._last_bump.get(namespace, float('-inf')) < min_interval:
+            return
+        self._last_bump[namespace] = now
+
+        try:
+            self.backend.bump_version(namespace)
+        except Exception:
+            self._count('error')
+
+    def version(self, namespace='data'):
+        return self.backend.get_version(namespace)
+
+    def get_or_set(self, key, compute, ttl=None, namespace='data', cacheable=None):
+        """Return the cached value for key, computing and storing it on a miss.
+
+        Values are CachedResponse tuples. Computed values that ``cacheable``
+        rejects are returned without being stored. Backend failures degrade
+        to computing the value every time.
+        """
+        ttl = self.default_ttl if ttl is None else ttl
+        if not ttl:
+            return compute()
+
+        try:
+            full_key = f"{namespace}:{self.backend.get_version(namespace)}:{key}"
+            value = self.backend.get(full_key)
+        except Exception:
+            self._count('error')
+            return compute()
+
+        if value is not None:
+            self._count('hit')
+            return value
+
+        self._count('miss')
+        value = compute()
+        if cacheable is not None and not cacheable(value):
+            return value
+        try:
+            self.backend.set(full_key, value, ttl)
+        except Exception:
+            self._count('error')
+        return value
+
+    def _count(self, result):
+        if result == 'hit':
+            self.hits += 1
+        elif result == 'miss':
+            self.misses += 1
+        else:
+            self.errors += 1
+
+        if self._on_lookup:
+            self._on_lookup(result)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'errors': self.errors}
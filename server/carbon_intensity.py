@@ -0,0 +1,126 @@
+"""
+GreenOps carbon intensity
+Time-varying grid carbon intensity and tariff, looked up by timestamp
+"""
+
+import bisect
+import csv
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from timeutils import epoch_seconds
+
+CSV_COLUMNS = ('starts_at', 'co2_factor', 'cost_per_kwh')
+
+
+class CarbonIntensity:
+    """Step function of kg CO2 and cost per kWh over time.
+
+    A point applies from its ``starts_at`` until the next point. A point
+    may leave co2_factor or cost_per_kwh as None, in which case the value
+    in force carries over, so intensity and tariff series from different
+    sources can share the table. Before the first point, and for values
+    never set, the defaults apply.
+
+    reset() swaps in a new series atomically; lookups never block.
+    """
+
+    def __init__(self, default_co2_factor, default_cost_per_kwh):
+        self.default_co2_factor = default_co2_factor
+        self.default_cost_per_kwh = default_cost_per_kwh
+        self.synced_at = None
+        self.fingerprint = None
+        self._lock = threading.Lock()
+        self._series = self._build([])
+
+    def __len__(self):
+        return len(self._series[0])
+
+    def _build(self, points):
+        points = sorted(points, key=lambda point: point[0])
+        starts = [point[0] for point in points]
+
+        co2 = np.array([np.nan if point[1] is None else point[1] for point in points], dtype=np.float64)
+        cost = np.array([np.nan if point[2] is None else point[2] for point in points], dtype=np.float64)
+        # Defaults in front: index 0 serves timestamps before the first point
+        co2 = _fill_forward(np.r_[self.default_co2_factor, co2])
+        cost = _fill_forward(np.r_[self.default_cost_per_kwh, cost])
+
+        return starts, epoch_seconds(starts) if starts else np.empty(0), co2, cost
+
+    def reset(self, points, fingerprint=None, now=None):
+        """Replace the series with (starts_at, co2_factor, cost_per_kwh) points"""
+        series = self._build(points)
+        with self._lock:
+            self._series = series
+            self.fingerprint = fingerprint
+            self.synced_at = now or datetime.utcnow()
+
+    def lookup(self, at):
+        """(co2_factor, cost_per_kwh) in force at a datetime, in O(log n)"""
+        starts, _, co2, cost = self._series
+        index = bisect.bisect_right(starts, at)
+        return float(co2[index]), float(cost[index])
+
+    def price(self, timestamps, energy_kwh):
+        """Vectorized pricing: (co2_kg, cost) arrays for parallel arrays of
+        timestamps (datetimes or datetime64) and kWh"""
+        _, seconds, co2, cost = self._series
+        energy_kwh = np.asarray(energy_kwh, dtype=np.float64)
+        if not len(energy_kwh):
+            return np.empty(0), np.empty(0)
+
+        index = np.searchsorted(seconds, epoch_seconds(timestamps), side='right')
+        return energy_kwh * co2[index], energy_kwh * cost[index]
+
+
+def _fill_forward(values):
+    """Replace NaNs with the last value before them (values[0] must be set)"""
+    positions = np.where(np.isnan(values), 0, np.arange(len(values)))
+    return values[np.maximum.accumulate(positions)]
+
+
+def _optional_float(value, column, line):
+    value = (value or '').strip()
+    if not value:
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        raise ValueError(f"Line {line}: invalid {column} {value!r}")
+    if number < 0:
+        raise ValueError(f"Line {line}: {column} must not be negative")
+    return number
+
+
+def read_csv(lines):
+    """Parse intensity points from CSV with a header row.
+
+    Columns are starts_at (ISO 8601, UTC) and at least one of co2_factor
+    (kg CO2 per kWh) and cost_per_kwh; empty cells carry the previous value
+    over. Returns a list of (starts_at, co2_factor, cost_per_kwh); raises
+    ValueError naming the offending line.
+    """
+    reader = csv.DictReader(lines)
+    fields = set(reader.fieldnames or ())
+    if 'starts_at' not in fields or not fields & {'co2_factor', 'cost_per_kwh'}:
+        raise ValueError('CSV needs a starts_at column and a co2_factor and/or cost_per_kwh column')
+
+    points = []
+    for row in reader:
+        line = reader.line_num
+        try:
+            starts_at = datetime.fromisoformat(row['starts_at'].strip().replace('Z', '+00:00'))
+        except (AttributeError, ValueError):
+            raise ValueError(f"Line {line}: invalid starts_at {row['starts_at']!r}")
+        if starts_at.tzinfo is not None:
+            starts_at = datetime.utcfromtimestamp(starts_at.timestamp())
+
+        co2_factor = _optional_float(row.get('co2_factor'), 'co2_factor', line)
+        cost_per_kwh = _optional_float(row.get('cost_per_kwh'), 'cost_per_kwh', line)
+        if co2_factor is None and cost_per_kwh is None:
+            continue
+        points.append((starts_at, co2_factor, cost_per_kwh))
+    return points
@@ -0,0 +1,146 @@
+"""
+GreenOps exporters
+Streaming writers for bulk data exports
+"""
+
+import csv
+import importlib.util
+import io
+import itertools
+import os
+import zlib
+
+
+def iter_csv(header, batches, format_row, compress=False):
+    """Yield a CSV document chunk by chunk.
+
+    ``batches`` is an iterable of row lists (e.g. ``Result.partitions()``);
+    each batch is formatted with ``format_row`` and emitted as one chunk,
+    so memory use is bounded by the batch size. With ``compress`` the
+    output is a gzip stream.
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None  # 31: gzip container
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def drain():
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(data) if compressor else data
+
+    writer.writerow(header)
+    yield drain()
+
+    for batch in batches:
+        writer.writerows(format_row(row) for row in batch)
+        chunk = drain()
+        if chunk:
+            yield chunk
+
+    if compressor:
+        yield compressor.flush()
+
+
+# ----------------------
+# COLUMNAR (PARQUET / ARROW)
+# ----------------------
+COLUMNAR_FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+
+def columnar_available():
+    """True if pyarrow (optional dependency) is installed"""
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def _arrow_schema(columns):
+    import pyarrow as pa
+
+    types = {'int': pa.int64(), 'float': pa.float64(), 'str': pa.string(), 'datetime': pa.timestamp('us')}
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+
+class ColumnarWriter:
+    """Writes row batches to one Parquet or Arrow IPC file.
+
+    ``columns`` is a list of (name, kind) pairs, kind being one of int,
+    float, str or datetime. Every write() becomes one Parquet row group
+    (or Arrow record batch), so memory is bounded by the batch size.
+    """
+
+    def __init__(self, sink, columns, fmt='parquet', compression='zstd'):
+        import pyarrow as pa
+
+        self.schema = _arrow_schema(columns)
+        self.rows = 0
+        if fmt == 'parquet':
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(sink, self.schema, compression=compression)
+        elif fmt == 'arrow':
+            options = pa.ipc.IpcWriteOptions(compression=compression)
+            self._writer = pa.ipc.new_file(sink, self.schema, options=options)
+        else:
+            raise ValueError(f"Unknown columnar format: {fmt}")
+        self._format = fmt
+
+    def write(self, rows):
+        import pyarrow as pa
+
+        if not rows:
+            return
+        values = list(zip(*rows))
+        batch = pa.RecordBatch.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(values, self.schema)],
+            schema=self.schema
+        )
+        if self._format == 'parquet':
+            self._writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            self._writer.write_batch(batch)
+        self.rows += len(rows)
+
+    def close(self):
+        self._writer.close()
+
+
+def write_columnar(sink, columns, batches, fmt='parquet'):
+    """Write all batches to a single file; returns the number of rows"""
+    writer = ColumnarWriter(sink, columns, fmt)
+    try:
+        for batch in batches:
+            writer.write(batch)
+    finally:
+        writer.close()
+    return writer.rows
+
+
+def write_monthly_partitions(directory, name, columns, batches, time_column, fmt='parquet'):
+    """Write batches sorted by ``time_column`` into one file per month.
+
+    Files are laid out Hive-style as ``directory/month=YYYY-MM/name.ext``,
+    which pandas, pyarrow.dataset, DuckDB and Spark read as a partitioned
+    dataset. Returns [(path, rows)] for the files written.
+    """
+    index = [column for column, _ in columns].index(time_column)
+    written = []
+    writer = None
+    month = None
+
+    try:
+        for batch in batches:
+            for key, rows in itertools.groupby(batch, key=lambda row: row[index].strftime('%Y-%m')):
+                if key != month:
+                    if writer:
+                        writer.close()
+                        written.append((path, writer.rows))
+                    month = key
+                    path = os.path.join(directory, f"month={month}", name + COLUMNAR_FORMATS[fmt])
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    writer = ColumnarWriter(path, columns, fmt)
+                writer.write(list(rows))
+    finally:
+        if writer:
+            writer.close()
+            written.append((path, writer.rows))
+
+    return written
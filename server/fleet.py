@@ -0,0 +1,123 @@
+"""
+GreenOps fleet index
+In-memory system status table with live counters
+"""
+
+import heapq
+import threading
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+
+class FleetIndex:
+    """MAC -> status, last_seen, department and lab, with running counts.
+
+    Counts per status, per (department, status) and per (lab, status) are
+    adjusted on every change, so reads never scan the fleet. Systems not
+    seen for ``online_window`` seconds drop out of the online set and are
+    counted as offline, the same rule the offline reaper applies to the
+    database. Each online system has exactly one entry in the expiry heap;
+    entries whose system was seen again are re-pushed instead of expired.
+    """
+
+    def __init__(self, online_window):
+        self.online_window = online_window
+        self.synced_at = None
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._systems = {}  # MAC -> [status, last_seen, department, lab]
+        self._expiry = []  # heap of (last_seen, MAC) for online systems
+        self._online = set()
+        self._statuses = Counter()
+        self._departments = defaultdict(Counter)  # department -> status counts
+        self._labs = defaultdict(Counter)  # lab -> status counts
+
+    def __len__(self):
+        return len(self._systems)
+
+    def load(self, rows, now):
+        """Replace the index with (mac, status, last_seen, department, lab) rows"""
+        with self._lock:
+            self._reset()
+            for mac, status, last_seen, department, lab in rows:
+                self._set(mac, status, last_seen, department, lab)
+            self._expire(now)
+            self.synced_at = now
+
+    def merge(self, mac, status, last_seen, department=None, lab=None):
+        """Apply a sighting unless the index already holds a newer one"""
+        with self._lock:
+            record = self._systems.get(mac)
+            if record is not None and last_seen is not None and record[1] is not None and last_seen < record[1]:
+                return
+            self._set(mac, status, last_seen or (record and record[1]), department, lab)
+
+    def set_status(self, mac, status):
+        with self._lock:
+            record = self._systems.get(mac)
+            if record is not None and record[0] != status:
+                self._set(mac, status, record[1], record[2], record[3])
+
+    def placement(self, mac):
+        """(department, lab) of a system, or (None, None) if unknown"""
+        with self._lock:
+            record = self._systems.get(mac)
+            return (record[2], record[3]) if record is not None else (None, None)
+
+    def status_counts(self, now, department=None, lab=None):
+        """{status: count}, optionally for one department or lab"""
+        with self._lock:
+            self._expire(now)
+            if department is not None:
+                counts = self._departments.get(department, {})
+            elif lab is not None:
+                counts = self._labs.get(lab, {})
+            else:
+                counts = self._statuses
+            return {status: count for status, count in counts.items() if count}
+
+    def online_count(self, now):
+        """Systems seen within the last online_window seconds"""
+        with self._lock:
+            self._expire(now)
+            return len(self._online)
+
+    def _set(self, mac, status, last_seen, department, lab):
+        old = self._systems.get(mac)
+        if old is not None:
+            self._count(old, -1)
+
+        record = [status, last_seen, department, lab]
+        self._systems[mac] = record
+        self._count(record, +1)
+
+        if last_seen is not None and mac not in self._online:
+            self._online.add(mac)
+            heapq.heappush(self._expiry, (last_seen, mac))
+
+    def _count(self, record, delta):
+        status, _, department, lab = record
+        self._statuses[status] += delta
+        self._departments[department][status] += delta
+        self._labs[lab][status] += delta
+
+    def _expire(self, now):
+        if not self.online_window:
+            return
+
+        cutoff = now - timedelta(seconds=self.online_window)
+        while self._expiry and self._expiry[0][0] < cutoff:
+            _, mac = heapq.heappop(self._expiry)
+            record = self._systems[mac]
+            if record[1] >= cutoff:
+                # Seen again since this entry was pushed
+                heapq.heappush(self._expiry, (record[1], mac))
+                continue
+
+            self._online.discard(mac)
+            if record[0] != 'offline':
+                self._count(record, -1)
+                record[0] = 'offline'
+                self._count(record, +1)
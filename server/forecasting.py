@@ -0,0 +1,377 @@
+"""
+GreenOps idle forecasting
+Per-lab / per-system idle probability by hour, trained incrementally
+from hourly idle history with NumPy
+"""
+
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+HOURS_PER_WEEK = 168
+HISTORY_HOURS = 24  # lead-in needed for the recent history features
+FEATURES = ('bias', 'lab_hour_logit', 'system_tendency', 'recent_idle', 'last_hour_idle',
+            'recent_missing', 'last_hour_missing')
+MODEL_VERSION = 1
+
+
+def hour_of_week(timestamp):
+    return timestamp.weekday() * 24 + timestamp.hour
+
+
+def _logit(p):
+    p = np.clip(p, 1e-4, 1 - 1e-4)
+    return np.log(p / (1 - p))
+
+
+def _sigmoid(z):
+    return 1 / (1 + np.exp(-np.clip(z, -30, 30)))
+
+
+class IdleForecaster:
+    """Probability that a system is idle during a given hour.
+
+    Three layers, all updated from each new day of history:
+
+    - decayed idle/observed hour counts per hour of week, fleet-wide and
+      per (department, lab) group, the group's rates shrunk towards the
+      fleet's by ``smoothing`` pseudo-observations;
+    - decayed idle/observed hour counts per system, giving its tendency to
+      be idler than its group;
+    - a logistic blend of those with the system's idle fraction over the
+      last 24 hours and the last hour, fitted by a Laplace-approximated
+      Bayesian update so each day refines the previous weights instead of
+      replacing them.
+
+    Counts and the weight precision decay with ``half_life_days``, so the
+    model follows changing timetables. Features for a day are computed
+    before the day is added to the counts, as they would be at prediction
+    time.
+    """
+
+    def __init__(self, half_life_days=14, smoothing=5.0):
+        self.half_life_days = half_life_days
+        self.smoothing = smoothing
+        self.trained_through = None  # end of the last hour trained on
+
+        self.groups = []
+        self._group_index = {}
+        self.group_idle = np.zeros((0, HOURS_PER_WEEK))
+        self.group_seen = np.zeros((0, HOURS_PER_WEEK))
+        self.fleet_idle = np.zeros(HOURS_PER_WEEK)
+        self.fleet_seen = np.zeros(HOURS_PER_WEEK)
+
+        self.system_ids = np.zeros(0, dtype=np.int64)
+        self._system_index = {}
+        self.system_idle = np.zeros(0)
+        self.system_seen = np.zeros(0)
+        # History as of trained_through: idle fraction over the last 24 hours and the last hour (NaN if unseen)
+        self.recent = np.zeros(0)
+        self.last_hour = np.zeros(0)
+
+        # Untrained, the blend is just the group's hour-of-week rate adjusted by the system tendency
+        self.weights = np.array([0.0, 1.0, 1.0, 0.0, 0.0, 0.0, 0.0])
+        self.precision = np.eye(len(FEATURES))
+
+    @property
+    def observations(self):
+        return float(self.fleet_seen.sum())
+
+    # Index maintenance
+    def _groups_for(self, groups):
+        indices = np.empty(len(groups), dtype=np.int64)
+        for position, group in enumerate(groups):
+            index = self._group_index.get(group)
+            if index is None:
+                index = self._group_index[group] = len(self.groups)
+                self.groups.append(group)
+            indices[position] = index
+
+        grow = len(self.groups) - len(self.group_idle)
+        if grow:
+            self.group_idle = np.vstack([self.group_idle, np.zeros((grow, HOURS_PER_WEEK))])
+            self.group_seen = np.vstack([self.group_seen, np.zeros((grow, HOURS_PER_WEEK))])
+        return indices
+
+    def _systems_for(self, system_ids):
+        indices = np.empty(len(system_ids), dtype=np.int64)
+        new = []
+        for position, system_id in enumerate(system_ids):
+            index = self._system_index.get(system_id)
+            if index is None:
+                index = self._system_index[system_id] = len(self.system_ids) + len(new)
+                new.append(system_id)
+            indices[position] = index
+
+        if new:
+            grow = len(new)
+            self.system_ids = np.r_[self.system_ids, np.asarray(new, dtype=np.int64)]
+            self.system_idle = np.r_[self.system_idle, np.zeros(grow)]
+            self.system_seen = np.r_[self.system_seen, np.zeros(grow)]
+            self.recent = np.r_[self.recent, np.full(grow, np.nan)]
+            self.last_hour = np.r_[self.last_hour, np.full(grow, np.nan)]
+        return indices
+
+    def _lookup_systems(self, system_ids):
+        """Model index per system id, -1 for systems never trained on"""
+        return np.array([self._system_index.get(system_id, -1) for system_id in system_ids], dtype=np.int64)
+
+    def _lookup_groups(self, groups):
+        return np.array([self._group_index.get(group, -1) for group in groups], dtype=np.int64)
+
+    # Features
+    def _group_rates(self, groups, hours):
+        """Shrunk idle rate of each (group, hour of week): groups x hours, -1 groups get the fleet's"""
+        k = self.smoothing
+        fleet = (self.fleet_idle + 0.5 * k) / (self.fleet_seen + k)
+        known = groups >= 0
+        rows = np.where(known, groups, 0)
+
+        idle = np.where(known[:, None], self.group_idle[rows][:, hours] if len(self.groups) else 0, 0)
+        seen = np.where(known[:, None], self.group_seen[rows][:, hours] if len(self.groups) else 0, 0)
+        return (idle + k * fleet[hours]) / (seen + k)
+
+    def _tendency(self, systems, groups):
+        """Log-odds by which each system is idler than its group overall (0 if unknown)"""
+        k = self.smoothing
+        fleet_rate = (self.fleet_idle.sum() + 0.5 * k) / (self.fleet_seen.sum() + k)
+        known_group = groups >= 0
+        rows = np.where(known_group, groups, 0)
+        if len(self.groups):
+            group_rate = (np.where(known_group, self.group_idle[rows].sum(axis=1), 0) + k * fleet_rate) / \
+                         (np.where(known_group, self.group_seen[rows].sum(axis=1), 0) + k)
+        else:
+            group_rate = np.full(len(groups), fleet_rate)
+
+        known = systems >= 0
+        index = np.where(known, systems, 0)
+        idle = np.where(known, self.system_idle[index] if len(self.system_ids) else 0, 0)
+        seen = np.where(known, self.system_seen[index] if len(self.system_ids) else 0, 0)
+        system_rate = (idle + k * group_rate) / (seen + k)
+        return _logit(system_rate) - _logit(group_rate)
+
+    @staticmethod
+    def _features(rates, tendency, recent, last_hour):
+        """Design tensor (..., FEATURES) from broadcastable parts"""
+        shape = np.broadcast(rates, tendency, recent, last_hour).shape
+        recent_missing = np.isnan(recent)
+        last_missing = np.isnan(last_hour)
+        return np.stack([
+            np.ones(shape),
+            np.broadcast_to(_logit(rates), shape),
+            np.broadcast_to(tendency, shape),
+            np.broadcast_to(np.where(recent_missing, 0, recent - 0.5), shape),
+            np.broadcast_to(np.where(last_missing, 0, last_hour - 0.5), shape),
+            np.broadcast_to(recent_missing.astype(float), shape),
+            np.broadcast_to(last_missing.astype(float), shape),
+        ], axis=-1)
+
+    # Training
+    def update(self, system_ids, groups, start, idle):
+        """Train on a block of hourly history.
+
+        ``idle`` is a systems x hours array of idle fractions (NaN where a
+        system did not report) whose first HISTORY_HOURS columns are
+        lead-in: they feed the history features but are not trained on.
+        Column 0 is the hour starting at ``start``; ``system_ids`` and
+        ``groups`` ((department, lab) pairs) describe the rows. Returns the
+        number of system-hours trained on.
+        """
+        idle = np.asarray(idle, dtype=np.float64)
+        count, hours = idle.shape
+        if hours <= HISTORY_HOURS:
+            return 0
+
+        systems = self._systems_for(list(system_ids))
+        group_rows = self._groups_for(list(groups))
+
+        seen = ~np.isnan(idle)
+        filled = np.where(seen, idle, 0)
+        # Windowed sums over the 24 hours before each trained hour
+        sums = np.concatenate([np.zeros((count, 1)), np.cumsum(filled, axis=1)], axis=1)
+        counts = np.concatenate([np.zeros((count, 1)), np.cumsum(seen, axis=1)], axis=1)
+        window_sums = sums[:, HISTORY_HOURS:hours] - sums[:, :hours - HISTORY_HOURS]
+        window_counts = counts[:, HISTORY_HOURS:hours] - counts[:, :hours - HISTORY_HOURS]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            recent = np.where(window_counts > 0, window_sums / window_counts, np.nan)
+        last_hour = idle[:, HISTORY_HOURS - 1:hours - 1]
+
+        target = idle[:, HISTORY_HOURS:]
+        mask = seen[:, HISTORY_HOURS:]
+        week_hours = (hour_of_week(start) + np.arange(HISTORY_HOURS, hours)) % HOURS_PER_WEEK
+
+        decay = 0.5 ** ((hours - HISTORY_HOURS) / 24 / self.half_life_days)
+        trained = int(mask.sum())
+
+        if trained:
+            features = self._features(
+                self._group_rates(group_rows, week_hours),
+                self._tendency(systems, group_rows)[:, None],
+                recent, last_hour
+            )[mask]
+            self._fit(features, target[mask], decay)
+
+        # Fold the block into the counts
+        for table in (self.group_idle, self.group_seen, self.fleet_idle, self.fleet_seen,
+                      self.system_idle, self.system_seen):
+            table *= decay
+
+        cells = (group_rows[:, None] * HOURS_PER_WEEK + week_hours[None, :])[mask]
+        size = len(self.groups) * HOURS_PER_WEEK
+        self.group_idle += np.bincount(cells, weights=target[mask], minlength=size).reshape(-1, HOURS_PER_WEEK)
+        self.group_seen += np.bincount(cells, minlength=size).reshape(-1, HOURS_PER_WEEK)
+        hour_cells = np.broadcast_to(week_hours, mask.shape)[mask]
+        self.fleet_idle += np.bincount(hour_cells, weights=target[mask], minlength=HOURS_PER_WEEK)
+        self.fleet_seen += np.bincount(hour_cells, minlength=HOURS_PER_WEEK)
+        np.add.at(self.system_idle, systems, np.where(mask, target, 0).sum(axis=1))
+        np.add.at(self.system_seen, systems, mask.sum(axis=1))
+
+        # History as of the end of the block; systems absent from it have none
+        end_sums = sums[:, hours] - sums[:, hours - HISTORY_HOURS]
+        end_counts = counts[:, hours] - counts[:, hours - HISTORY_HOURS]
+        self.recent[:] = np.nan
+        self.last_hour[:] = np.nan
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.recent[systems] = np.where(end_counts > 0, end_sums / end_counts, np.nan)
+        self.last_hour[systems] = idle[:, hours - 1]
+
+        self.trained_through = start + timedelta(hours=hours)
+        return trained
+
+    def _fit(self, features, target, decay, iterations=5):
+        """Newton steps on the block's log loss plus a Gaussian prior centred
+        on the current weights, whose precision then absorbs the block"""
+        prior_mean = self.weights
+        prior = self.precision * decay
+        weights = prior_mean.copy()
+
+        for _ in range(iterations):
+            p = _sigmoid(features @ weights)
+            gradient = features.T @ (p - target) + prior @ (weights - prior_mean)
+            curvature = np.maximum(p * (1 - p), 1e-6)
+            hessian = features.T @ (features * curvature[:, None]) + prior
+            weights = weights - np.linalg.solve(hessian, gradient)
+
+        p = _sigmoid(features @ weights)
+        self.weights = weights
+        self.precision = prior + features.T @ (features * np.maximum(p * (1 - p), 1e-6)[:, None])
+
+    # Prediction
+    def predict(self, system_ids, groups, start, hours=1):
+        """Idle probability of each system for ``hours`` hours from ``start``
+        (systems x hours). Hours between the end of training and ``start``
+        are rolled forward on the model's own predictions."""
+        systems = self._lookup_systems(list(system_ids))
+        group_rows = self._lookup_groups(list(groups))
+        known = systems >= 0
+        index = np.where(known, systems, 0)
+
+        recent = np.where(known, self.recent[index] if len(self.system_ids) else np.nan, np.nan)
+        last_hour = np.where(known, self.last_hour[index] if len(self.system_ids) else np.nan, np.nan)
+        tendency = self._tendency(systems, group_rows)
+
+        origin = self.trained_through or start
+        gap = int((start - origin).total_seconds() // 3600)
+        if gap < 0 or gap > HISTORY_HOURS:
+            # History is stale (or from the future): predict from the hour-of-week profile alone
+            gap = 0
+            recent = np.full(len(systems), np.nan)
+            last_hour = np.full(len(systems), np.nan)
+
+        first = start - timedelta(hours=gap)
+        week_hours = (hour_of_week(first) + np.arange(gap + hours)) % HOURS_PER_WEEK
+        rates = self._group_rates(group_rows, week_hours)
+
+        predictions = np.empty((len(systems), gap + hours))
+        for step in range(gap + hours):
+            z = self._features(rates[:, step], tendency, recent, last_hour) @ self.weights
+            predictions[:, step] = p = _sigmoid(z)
+            last_hour = p
+            recent = np.where(np.isnan(recent), p, recent + (p - recent) / HISTORY_HOURS)
+        return predictions[:, gap:]
+
+    # Persistence
+    def save(self, path):
+        """Write the model to ``path`` atomically (NumPy .npz)"""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=directory, suffix='.npz')
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                np.savez_compressed(
+                    f,
+                    version=MODEL_VERSION,
+                    settings=np.array([self.half_life_days, self.smoothing]),
+                    trained_through=np.array(self.trained_through or datetime(1970, 1, 1), dtype='datetime64[us]'),
+                    has_trained=self.trained_through is not None,
+                    group_departments=np.array([group[0] or '' for group in self.groups], dtype=str),
+                    group_labs=np.array([group[1] or '' for group in self.groups], dtype=str),
+                    group_idle=self.group_idle, group_seen=self.group_seen,
+                    fleet_idle=self.fleet_idle, fleet_seen=self.fleet_seen,
+                    system_ids=self.system_ids, system_idle=self.system_idle, system_seen=self.system_seen,
+                    recent=self.recent, last_hour=self.last_hour,
+                    weights=self.weights, precision=self.precision
+                )
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['version']) != MODEL_VERSION:
+                raise ValueError(f"Unsupported forecast model version {int(data['version'])}")
+
+            half_life_days, smoothing = data['settings']
+            model = cls(float(half_life_days), float(smoothing))
+            if bool(data['has_trained']):
+                model.trained_through = data['trained_through'].astype('datetime64[us]').item()
+
+            model.groups = [(department or None, lab or None)
+                            for department, lab in zip(data['group_departments'].tolist(), data['group_labs'].tolist())]
+            model._group_index = {group: index for index, group in enumerate(model.groups)}
+            model.system_ids = data['system_ids']
+            model._system_index = {int(system_id): index for index, system_id in enumerate(model.system_ids)}
+            for name in ('group_idle', 'group_seen', 'fleet_idle', 'fleet_seen', 'system_idle', 'system_seen',
+                         'recent', 'last_hour', 'weights', 'precision'):
+                setattr(model, name, data[name])
+        if not model.groups:
+            model.group_idle = model.group_idle.reshape(0, HOURS_PER_WEEK)
+            model.group_seen = model.group_seen.reshape(0, HOURS_PER_WEEK)
+        return model
+
+
+class ForecastStore:
+    """The current model of a process, backed by a file shared by workers.
+
+    get() re-reads the file when another process (the training job or
+    the CLI) has replaced it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.model = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return self.model
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self.model = IdleForecaster.load(self.path)
+                    self._mtime = mtime
+        return self.model
+
+    def save(self, model):
+        with self._lock:
+            model.save(self.path)
+            self.model = model
+            self._mtime = os.stat(self.path).st_mtime_ns
@@ -1,6 +1,7 @@
 """
 Database migration script for GreenOps v2.0
-Adds MAC address field to systems table
+Adds MAC address field to systems table, the heartbeat dedupe key and idle
+increment columns and the composite query indexes
 """
 
 import sqlite3
@@ -8,6 +9,52 @@ import sys
 import os
 from datetime import datetime
 
+# Composite indexes for the hot listing, history and reaper queries and the
+# heartbeat dedupe key (the server also creates any that are missing at startup)
+INDEXES = [
+    ('ix_agent_logs_system_timestamp', 'agent_logs', 'system_id, timestamp', False),
+    ('ux_agent_logs_dedupe_key', 'agent_logs', 'dedupe_key, timestamp', True),
+    ('ix_systems_active_last_seen', 'systems', 'is_active, last_seen, id', False),
+    ('ix_systems_active_status', 'systems', 'is_active, status', False),
+    ('ix_systems_department_lab', 'systems', 'department, lab', False),
+]
+
+# Columns added to agent_logs since v2.0
+AGENT_LOG_COLUMNS = [
+    ('dedupe_key', 'VARCHAR(80)'),
+    ('idle_increment', 'FLOAT'),
+]
+
+def add_agent_log_columns(conn):
+    """Add any missing agent_logs columns"""
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA table_info(agent_logs)")
+    columns = [row[1] for row in cursor.fetchall()]
+    if not columns:
+        return
+    
+    for name, column_type in AGENT_LOG_COLUMNS:
+        if name not in columns:
+            print(f"Adding {name} column to agent_logs table...")
+            cursor.execute(f"ALTER TABLE agent_logs ADD COLUMN {name} {column_type}")
+            conn.commit()
+
+def create_indexes(conn):
+    """Create any missing composite indexes"""
+    cursor = conn.cursor()
+    for name, table, columns, unique in INDEXES:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+        if not cursor.fetchone():
+            continue
+        
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,))
+        if cursor.fetchone():
+            continue
+        
+        print(f"Creating index {name} on {table}({columns})...")
+        cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX {name} ON {table} ({columns})")
+        conn.commit()
+
 def migrate_database(db_path='greenops.db'):
     """Safely migrate database to new schema"""
     
@@ -104,6 +151,9 @@ def migrate_database(db_path='greenops.db'):
         else:
             print("Database schema is up to date")
         
+        add_agent_log_columns(conn)
+        create_indexes(conn)
+        
         conn.close()
         print("Migration completed successfully")
         return True
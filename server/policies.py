@@ -0,0 +1,154 @@
+"""
+GreenOps policy documents
+The agent-facing policies, serialized once per change, versioned by content
+and resolved per system through a precomputed index
+"""
+
+import hashlib
+import json
+import threading
+import time
+
+
+class PolicyDocument:
+    """A policy as served to agents.
+
+    ``version`` is a hash of the policy's content, so every worker derives
+    the same version (and ETag) for the same policy without coordinating.
+    ``body`` is the JSON response, including the version.
+    """
+
+    __slots__ = ('policy', 'version', 'body')
+
+    def __init__(self, policy):
+        canonical = json.dumps(policy, sort_keys=True, separators=(',', ':'), default=str)
+        self.policy = policy
+        self.version = hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:20]
+        self.body = json.dumps({**policy, 'version': self.version}, sort_keys=True, default=str).encode('utf-8')
+
+
+# Policy scopes, most specific first: a system policy beats its lab's, a
+# lab policy its department's, a department policy the organization's
+POLICY_SCOPES = ('system', 'lab', 'department', 'organization')
+
+
+class PolicyIndex:
+    """Effective policy for any (department, lab, MAC), precomputed.
+
+    Active policies are bucketed by target once, when they change, so
+    resolve() is at most four dict lookups regardless of how many policies
+    or systems exist. Within one target the highest priority wins, then
+    the oldest policy (lowest id). A lab policy with a department only
+    applies to that department's lab; without one, to every lab of that
+    name. With no organization policy, ``default`` applies.
+    """
+
+    def __init__(self, policies, default):
+        self.policies = policies
+        self._systems = {}  # MAC -> document
+        self._labs = {}  # (department or None, lab) -> document
+        self._departments = {}  # department -> document
+        self._organization = PolicyDocument(default)
+
+        # Ascending precedence, so the winner of each target is stored last
+        for policy in sorted(policies, key=lambda policy: (policy.get('priority') or 0, -(policy.get('id') or 0))):
+            document = PolicyDocument(policy)
+            scope = policy.get('scope') or 'organization'
+            if scope == 'system':
+                self._systems[policy['mac_address']] = document
+            elif scope == 'lab':
+                self._labs[(policy.get('department'), policy['lab'])] = document
+            elif scope == 'department':
+                self._departments[policy['department']] = document
+            else:
+                self._organization = document
+
+    def __len__(self):
+        return len(self.policies)
+
+    def resolve(self, department=None, lab=None, mac=None):
+        """The PolicyDocument a system with this placement follows"""
+        document = None
+        if mac is not None:
+            document = self._systems.get(mac)
+        if document is None and lab is not None:
+            document = self._labs.get((department, lab)) or self._labs.get((None, lab))
+        if document is None and department is not None:
+            document = self._departments.get(department)
+        return document or self._organization
+
+
+class PolicyCache:
+    """Current policy index, rebuilt from ``loader`` only when stale.
+
+    The loader (returning the active policy dicts) runs at most once per
+    ``ttl`` seconds, on the next get() after invalidate(), or on
+    refresh(); the index is only rebuilt if the policies actually changed.
+    Other workers' changes therefore show up within ``ttl`` (or whenever
+    the owner calls refresh()), this worker's immediately.
+
+    Subscribers block in wait() until the policy they resolve to has a
+    different version from the one they hold; every change wakes them all.
+    """
+
+    def __init__(self, loader, default, ttl=30, clock=time.monotonic):
+        self.loader = loader
+        self.default = default
+        self.ttl = ttl
+        self._clock = clock
+        self._index = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self.waiting = 0
+        self.stats = {'loads': 0, 'changes': 0}
+
+    def _stale(self):
+        return self._loaded_at is None or self._clock() - self._loaded_at >= self.ttl
+
+    def _load(self):
+        # Caller holds the lock
+        policies = self.loader()
+        self.stats['loads'] += 1
+        if self._index is None or policies != self._index.policies:
+            self._index = PolicyIndex(policies, self.default)
+            self.stats['changes'] += 1
+            self._changed.notify_all()
+        self._loaded_at = self._clock()
+
+    def get(self):
+        if self._stale():
+            with self._lock:
+                if self._stale():
+                    self._load()
+        return self._index
+
+    def refresh(self):
+        """Reload now, waking subscribers if the policies changed"""
+        with self._lock:
+            self._load()
+        return self._index
+
+    def invalidate(self):
+        """Reload on the next get()"""
+        self._loaded_at = None
+
+    def wait(self, resolve, version, timeout):
+        """Block until ``resolve(index)`` gives a document whose version
+        differs from ``version`` or ``timeout`` seconds pass; returns that
+        document. Resolution is repeated on every change, so it should be
+        cheap. Never loads, so it holds no database resources while
+        waiting."""
+        deadline = self._clock() + timeout
+        with self._changed:
+            self.waiting += 1
+            try:
+                while True:
+                    document = resolve(self._index)
+                    remaining = deadline - self._clock()
+                    if document.version != version or remaining <= 0:
+                        break
+                    self._changed.wait(remaining)
+            finally:
+                self.waiting -= 1
+            return document
@@ -0,0 +1,121 @@
+"""
+GreenOps idle sessions
+Turns the cumulative idle_minutes of successive heartbeats into
+non-overlapping idle/sleep intervals per system
+"""
+
+import threading
+from datetime import timedelta
+
+SLEEP_ACTIONS = ('SLEEP', 'HIBERNATE')
+
+
+def _minutes(delta):
+    return max(delta.total_seconds() / 60, 0.0)
+
+
+class SessionState:
+    """One idle interval of a system, open or closed.
+
+    ``idle_minutes`` is the idle time credited to the session so far, at
+    most ended_at - started_at. ``written_at`` is the ended_at last
+    persisted (None if never written).
+    """
+
+    __slots__ = ('system_id', 'kind', 'started_at', 'ended_at', 'idle_minutes', 'samples', 'is_open',
+                 'written_at')
+
+    def __init__(self, system_id, kind, started_at, ended_at, idle_minutes=0.0, samples=1, is_open=True,
+                 written_at=None):
+        self.system_id = system_id
+        self.kind = kind
+        self.started_at = started_at
+        self.ended_at = ended_at
+        self.idle_minutes = idle_minutes
+        self.samples = samples
+        self.is_open = is_open
+        self.written_at = written_at
+
+    def updated(self, **changes):
+        """Copy with some attributes changed (states are never mutated in place)"""
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values.update(changes)
+        return SessionState(**values)
+
+
+class SessionTracker:
+    """Last idle session per MAC, advanced in O(1) per heartbeat.
+
+    Agents report how long the system has been idle, so a report at ``at``
+    with ``idle_minutes`` m says the system was idle over [at - m, at]. A
+    report whose idle stretch began before the end of the open session (give
+    or take ``tolerance`` seconds) extends it, and only the part not yet
+    covered is credited; otherwise there was input in between and the
+    session is closed. Stretches shorter than ``min_idle_minutes`` do not
+    open a session. Reports at or before the end of the last session (late
+    deliveries, retries) credit nothing.
+
+    observe() does not store anything: callers keep the returned states
+    until their transaction commits and then hand them to apply().
+    """
+
+    def __init__(self, min_idle_minutes=5, tolerance=60):
+        self.min_idle_minutes = min_idle_minutes
+        self.tolerance = timedelta(seconds=tolerance)
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, mac):
+        return self._sessions.get(mac)
+
+    def load(self, sessions):
+        """Replace the tracker's state with {MAC: SessionState} (e.g. open sessions from the database)"""
+        with self._lock:
+            self._sessions = dict(sessions)
+
+    def apply(self, sessions):
+        """Store committed {MAC: SessionState}"""
+        with self._lock:
+            self._sessions.update(sessions)
+
+    def observe(self, session, system_id, at, idle_minutes, action='NONE'):
+        """Advance a system's last session by one report.
+
+        Returns (session, closed, increment): the system's new last session,
+        the session this report closed (or None) and the idle minutes the
+        report adds.
+        """
+        if session is not None and at <= session.ended_at:
+            return session, None, 0.0
+
+        idle_start = at - timedelta(minutes=idle_minutes)
+        sleeping = action in SLEEP_ACTIONS
+        closed = None
+
+        if session is not None and session.is_open:
+            if idle_start <= session.ended_at + self.tolerance:
+                increment = _minutes(at - max(session.ended_at, idle_start))
+                return session.updated(
+                    kind='sleep' if sleeping else session.kind,
+                    ended_at=at,
+                    idle_minutes=session.idle_minutes + increment,
+                    samples=session.samples + 1
+                ), None, increment
+
+            # Input since the last report. A sleeping system is taken to have
+            # been asleep until it woke, i.e. until its idle stretch began.
+            closed = session.updated(
+                is_open=False,
+                ended_at=max(session.ended_at, idle_start) if session.kind == 'sleep' else session.ended_at
+            )
+            session = closed
+
+        if idle_minutes < self.min_idle_minutes:
+            return session, closed, 0.0
+
+        started_at = max(idle_start, session.ended_at) if session is not None else idle_start
+        increment = _minutes(at - started_at)
+        return SessionState(system_id, 'sleep' if sleeping else 'idle', started_at, at, increment), closed, increment
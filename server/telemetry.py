@@ -0,0 +1,235 @@
+"""
+GreenOps Prometheus telemetry
+Metrics are updated incrementally on the ingest path, so a scrape only
+serializes current values.
+
+Under gunicorn, set PROMETHEUS_MULTIPROC_DIR to an empty directory shared
+by the workers (wiped on every restart); each process then writes its
+values to mmap files there and /metrics aggregates them.
+"""
+
+import os
+import threading
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR') or os.getenv('prometheus_multiproc_dir')
+
+# ----------------------
+# INGEST
+# ----------------------
+HEARTBEATS = Counter(
+    'greenops_heartbeats', 'Heartbeat reports ingested'
+)
+INGEST_TRANSACTIONS = Counter(
+    'greenops_ingest_transactions', 'Database transactions committed by heartbeat ingest'
+)
+DUPLICATE_HEARTBEATS = Counter(
+    'greenops_heartbeat_duplicates', 'Heartbeat reports dropped as retries of one already stored'
+)
+ROWS_WRITTEN = Counter(
+    'greenops_heartbeat_rows_written', 'Rows inserted or updated by heartbeat ingest', ['table']
+)
+ROWS_PER_HEARTBEAT = Histogram(
+    'greenops_heartbeat_rows_per_heartbeat', 'Rows written per heartbeat, observed once per ingest transaction',
+    buckets=(0.5, 1, 1.25, 1.5, 2, 2.5, 3, 4, 6)
+)
+
+# ----------------------
+# CARBON ACCOUNTING
+# ----------------------
+ACTIONS = Counter(
+    'greenops_actions', 'Power management actions reported by agents', ['action', 'department']
+)
+ENERGY = Counter(
+    'greenops_energy_kwh', 'Energy in kWh reported by agents', ['department']
+)
+CO2 = Counter(
+    'greenops_carbon_emissions_kg', 'Carbon emissions in kg reported by agents', ['department']
+)
+COST_SAVED = Counter(
+    'greenops_cost_saved', 'Cost saved by power management actions', ['department']
+)
+BUDGET = Gauge(
+    'greenops_carbon_budget_kg', 'Monthly carbon budget in kg', ['department'],
+    multiprocess_mode='mostrecent'
+)
+BUDGET_USED = Gauge(
+    'greenops_carbon_budget_used_kg', 'Month-to-date carbon emissions in kg', ['department'],
+    multiprocess_mode='mostrecent'
+)
+BUDGET_PROJECTED = Gauge(
+    'greenops_carbon_budget_projected_kg', 'Projected month-end carbon emissions in kg', ['department'],
+    multiprocess_mode='mostrecent'
+)
+
+# ----------------------
+# FLEET
+# ----------------------
+# Every process adds its own transitions; the baseline loaded from the
+# database is added once per metrics directory (see seed_systems)
+SYSTEMS = Gauge(
+    'greenops_systems', 'Registered systems by status and department', ['status', 'department'],
+    multiprocess_mode='sum'
+)
+
+# ----------------------
+# CACHES
+# ----------------------
+CACHE_REQUESTS = Counter(
+    'greenops_response_cache_requests', 'Response cache lookups by result', ['result']
+)
+
+# ----------------------
+# DEPRECATED SERIES
+# ----------------------
+# Series /metrics served before the collectors above, kept for one release
+# so existing dashboards and alerts keep working. They are derived while
+# rendering rather than stored, so they cannot clash with the new series
+# in the multiprocess files. Remove them in the next release.
+LEGACY_STATUSES = ('active', 'idle', 'sleeping')
+legacy_synced_at = None
+_legacy_totals = {}
+
+_seed_lock = threading.Lock()
+_seeded = False
+
+
+def _label(value):
+    return value or 'none'
+
+
+def record_ingest(heartbeats, system_rows, log_rows, duplicates=0):
+    """Count one committed ingest transaction"""
+    HEARTBEATS.inc(heartbeats)
+    DUPLICATE_HEARTBEATS.inc(duplicates)
+    INGEST_TRANSACTIONS.inc()
+    ROWS_WRITTEN.labels('systems').inc(system_rows)
+    ROWS_WRITTEN.labels('agent_logs').inc(log_rows)
+    if heartbeats:
+        ROWS_PER_HEARTBEAT.observe((system_rows + log_rows) / heartbeats)
+
+
+def record_usage(department, action, energy_kwh, co2_kg, cost_saved):
+    """Count one ingested agent log row"""
+    department = _label(department)
+    if action != 'NONE':
+        ACTIONS.labels(action, department).inc()
+    ENERGY.labels(department).inc(energy_kwh or 0)
+    CO2.labels(department).inc(co2_kg or 0)
+    COST_SAVED.labels(department).inc(cost_saved or 0)
+
+
+def record_status_change(department, old_status, new_status):
+    """Move one system between status gauges (old_status None for new systems)"""
+    department = _label(department)
+    if old_status:
+        SYSTEMS.labels(old_status, department).dec()
+    if new_status:
+        SYSTEMS.labels(new_status, department).inc()
+
+
+def seed_systems(counts):
+    """Add the database's {(status, department): count} baseline to the gauges.
+
+    Only the first process to get here for a metrics directory seeds it, so
+    restarted or extra workers do not count the fleet twice.
+    """
+    global _seeded
+
+    with _seed_lock:
+        if _seeded:
+            return False
+
+        if MULTIPROC_DIR:
+            try:
+                fd = os.open(os.path.join(MULTIPROC_DIR, 'greenops_systems.seeded'), os.O_CREAT | os.O_EXCL)
+                os.close(fd)
+            except FileExistsError:
+                _seeded = True
+                return False
+
+        for (status, department), count in counts.items():
+            SYSTEMS.labels(status, _label(department)).inc(count)
+        _seeded = True
+        return True
+
+
+def record_budget(department, status):
+    """Publish a budget status dict from the carbon budget engine"""
+    department = _label(department) if department is not None else 'all'
+    if status['budget_kg'] is not None:
+        BUDGET.labels(department).set(status['budget_kg'])
+    BUDGET_USED.labels(department).set(status['used_kg'])
+    BUDGET_PROJECTED.labels(department).set(status['projected_month_end_kg'])
+
+
+def record_cache_lookup(result):
+    CACHE_REQUESTS.labels(result).inc()
+
+
+def record_legacy_totals(co2_kg, energy_kwh, now):
+    """Fleet totals over the last 24 hours for the deprecated window gauges"""
+    global legacy_synced_at
+
+    _legacy_totals.update(co2_kg=co2_kg, energy_kwh=energy_kwh)
+    legacy_synced_at = now
+
+
+def _legacy_families(families):
+    """Deprecated gauges derived from the collected families"""
+    statuses = dict.fromkeys(LEGACY_STATUSES, 0.0)
+    for family in families:
+        if family.name == 'greenops_systems':
+            for sample in family.samples:
+                if sample.labels.get('status') in statuses:
+                    statuses[sample.labels['status']] += sample.value
+
+    legacy = [
+        GaugeMetricFamily(f'greenops_systems_{status}',
+                          f'Number of {status} systems (deprecated, use greenops_systems)', value=count)
+        for status, count in statuses.items()
+    ]
+    if _legacy_totals:
+        legacy.append(GaugeMetricFamily(
+            'greenops_carbon_emissions_kg',
+            'Carbon emissions in kg over the last 24 hours (deprecated, use greenops_carbon_emissions_kg_total)',
+            value=_legacy_totals['co2_kg']
+        ))
+        legacy.append(GaugeMetricFamily(
+            'greenops_energy_kwh',
+            'Energy consumption in kWh over the last 24 hours (deprecated, use greenops_energy_kwh_total)',
+            value=_legacy_totals['energy_kwh']
+        ))
+    return legacy
+
+
+class _Collected:
+    """Registry stand-in that serves already collected families"""
+
+    def __init__(self, families):
+        self._families = families
+
+    def collect(self):
+        return iter(self._families)
+
+
+def render():
+    """Serialize all metrics; returns (body, content type)"""
+    registry = REGISTRY
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+
+    families = list(registry.collect())
+    return generate_latest(_Collected(families + _legacy_families(families))), CONTENT_TYPE_LATEST
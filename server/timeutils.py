@@ -0,0 +1,14 @@
+"""
+GreenOps time helpers
+Conversions shared by the NumPy-based modules
+"""
+
+import numpy as np
+
+
+def epoch_seconds(values):
+    """datetime64 array (or list of datetimes/None) as float seconds, NaN for missing"""
+    times = np.asarray(values, dtype='datetime64[us]')
+    seconds = times.astype(np.int64) / 1e6
+    seconds[np.isnat(times)] = np.nan
+    return seconds
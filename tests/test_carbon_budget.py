@@ -0,0 +1,67 @@
+"""Month-to-date carbon budget engine"""
+
+from datetime import datetime
+
+import pytest
+
+from budget import CarbonBudget, month_start
+
+APRIL = datetime(2026, 4, 1)
+
+
+@pytest.fixture
+def budget():
+    engine = CarbonBudget(monthly_budget=300)
+    engine.reset(APRIL, {'co2_kg': 50, 'energy_kwh': 60}, {'CS': {'co2_kg': 50}}, {'CS': 100, 'EE': 40},
+                 now=datetime(2026, 4, 10))
+    return engine
+
+
+def test_projection_extrapolates_the_burn_rate(budget):
+    status = budget.status(datetime(2026, 4, 11))
+
+    assert status['month'] == '2026-04'
+    assert status['used_kg'] == 50
+    assert status['burn_rate_kg_per_day'] == pytest.approx(5)
+    assert status['projected_month_end_kg'] == pytest.approx(150)
+    assert status['remaining_kg'] == 250
+    assert status['on_track'] is True
+
+
+def test_department_budgets(budget):
+    statuses = budget.department_statuses(datetime(2026, 4, 11))
+
+    assert set(statuses) == {'CS', 'EE'}
+    assert statuses['CS']['used_percentage'] == 50.0
+    assert statuses['CS']['on_track'] is False
+    assert statuses['EE']['used_kg'] == 0
+
+
+def test_add_only_counts_the_current_month(budget):
+    budget.add(datetime(2026, 4, 11, 9), 'EE', co2_kg=4, energy_kwh=5)
+    budget.add(datetime(2026, 3, 31, 23), 'EE', co2_kg=100)
+
+    assert budget.totals['co2_kg'] == 54
+    assert budget.departments['EE']['co2_kg'] == 4
+
+
+def test_month_rollover_needs_a_reset(budget):
+    assert not budget.needs_reset(datetime(2026, 4, 30, 23))
+    assert budget.needs_reset(datetime(2026, 5, 1))
+    assert month_start(datetime(2026, 5, 17, 8, 30)) == datetime(2026, 5, 1)
+
+
+def test_ingest_keeps_the_dashboard_budget_current(server, client, admin_headers):
+    now = datetime.utcnow()
+    before = client.get('/api/v1/metrics/budget', headers=admin_headers).json['fleet']['used_kg']
+
+    response = client.post('/api/v1/agent/report', json={
+        'mac_address': 'AA:00:00:00:00:01', 'idle_minutes': 60, 'action': 'SLEEP', 'timestamp': now.isoformat()
+    })
+    assert response.status_code == 200
+
+    with server.app.app_context():
+        stored = server.db.session.query(server.db.func.sum(server.AgentLog.co2_kg)).scalar()
+    after = client.get('/api/v1/metrics/budget', headers=admin_headers).json['fleet']['used_kg']
+    assert stored > 0
+    assert after == pytest.approx(before + stored, abs=1e-3)
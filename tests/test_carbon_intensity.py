@@ -0,0 +1,113 @@
+"""Time-varying carbon intensity: lookups, CSV import and repricing"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from carbon_intensity import CarbonIntensity, read_csv
+
+POINTS = [
+    (datetime(2026, 3, 1, 6), 0.3, None),
+    (datetime(2026, 3, 1, 0), 0.5, 10.0),
+    (datetime(2026, 3, 1, 18), None, 12.0),
+]
+
+
+@pytest.fixture
+def intensity():
+    series = CarbonIntensity(0.8, 8.0)
+    series.reset(POINTS)
+    return series
+
+
+def test_lookup_steps_and_carries_values_over(intensity):
+    assert intensity.lookup(datetime(2026, 2, 28)) == (0.8, 8.0)
+    assert intensity.lookup(datetime(2026, 3, 1, 0)) == (0.5, 10.0)
+    assert intensity.lookup(datetime(2026, 3, 1, 12)) == (0.3, 10.0)
+    assert intensity.lookup(datetime(2026, 3, 2)) == (0.3, 12.0)
+
+
+def test_price_agrees_with_lookup(intensity):
+    timestamps = [datetime(2026, 2, 28) + timedelta(hours=hours) for hours in range(0, 72, 5)]
+    energy = np.arange(len(timestamps), dtype=float)
+
+    co2_kg, cost = intensity.price(timestamps, energy)
+
+    expected = [intensity.lookup(timestamp) for timestamp in timestamps]
+    assert co2_kg.tolist() == pytest.approx([kwh * co2 for kwh, (co2, _) in zip(energy, expected)])
+    assert cost.tolist() == pytest.approx([kwh * price for kwh, (_, price) in zip(energy, expected)])
+
+
+def test_empty_series_uses_the_defaults():
+    series = CarbonIntensity(0.8, 8.0)
+
+    assert len(series) == 0
+    assert series.lookup(datetime(2026, 3, 1)) == (0.8, 8.0)
+    assert series.price([datetime(2026, 3, 1)], [2.0])[0].tolist() == [1.6]
+
+
+def test_read_csv():
+    points = read_csv([
+        'starts_at,co2_factor,cost_per_kwh',
+        '2026-03-01T00:00:00Z,0.5,',
+        '2026-03-01T06:00:00+05:30,,9.5',
+        '2026-03-01T12:00:00,,',
+    ])
+
+    assert points == [(datetime(2026, 3, 1), 0.5, None), (datetime(2026, 3, 1, 0, 30), None, 9.5)]
+
+
+@pytest.mark.parametrize('lines, message', [
+    (['starts_at,price', '2026-03-01,1'], 'starts_at column'),
+    (['starts_at,co2_factor', 'yesterday,0.5'], 'Line 2: invalid starts_at'),
+    (['starts_at,co2_factor', '2026-03-01,lots'], 'Line 2: invalid co2_factor'),
+    (['starts_at,cost_per_kwh', '2026-03-01,-1'], 'Line 2: cost_per_kwh must not be negative'),
+])
+def test_read_csv_rejects_bad_input(lines, message):
+    with pytest.raises(ValueError, match=message):
+        read_csv(lines)
+
+
+@pytest.mark.parametrize('dialect', ['native', 'portable'])
+def test_import_keeps_stored_values_left_empty(app_context, monkeypatch, dialect):
+    server = app_context
+    if dialect == 'portable':
+        monkeypatch.setattr(server.db.engine.dialect, 'name', 'other')
+
+    server.import_carbon_intensity([(datetime(2026, 3, 1), 0.5, 10.0)], source='grid.csv')
+    assert server.import_carbon_intensity([(datetime(2026, 3, 1), None, 12.0), (datetime(2026, 3, 2), 0.4, None)]) == 2
+
+    assert server.carbon_intensity.lookup(datetime(2026, 3, 1, 12)) == (0.5, 12.0)
+    assert server.carbon_intensity.lookup(datetime(2026, 3, 2)) == (0.4, 12.0)
+    assert server.IntensityPoint.query.filter_by(starts_at=datetime(2026, 3, 1)).one().source == 'grid.csv'
+
+
+def test_reports_are_priced_at_the_intensity_of_their_time(server, client, app_context):
+    now = datetime.utcnow().replace(microsecond=0)
+    server.import_carbon_intensity([(now - timedelta(hours=2), 1.0, 20.0)])
+    for timestamp in (now - timedelta(hours=3), now - timedelta(minutes=1)):
+        response = client.post('/api/v1/agent/report', json={
+            'mac_address': 'AA:00:00:00:00:01', 'idle_minutes': 60, 'action': 'SLEEP',
+            'timestamp': timestamp.isoformat()
+        })
+        assert response.status_code == 200
+
+    logs = server.AgentLog.query.order_by(server.AgentLog.timestamp).all()
+    assert [log.co2_kg / log.energy_kwh for log in logs] == pytest.approx([server.Config.CO2_FACTOR, 1.0], abs=0.01)
+
+
+def test_reprice_history_rewrites_logs_and_rollups(app_context, make_system):
+    server = app_context
+    system_id = make_system('AA:00:00:00:00:01')
+    at = datetime(2026, 3, 1, 9)
+    server.db.session.add(server.AgentLog(system_id=system_id, pc_id='PC', idle_minutes=60, idle_increment=60,
+                                          action='SLEEP', energy_kwh=1.0, co2_kg=0.8, cost_saved=8.0, timestamp=at))
+    server.db.session.commit()
+
+    server.import_carbon_intensity([(datetime(2026, 3, 1), 0.25, 5.0)])
+    assert server.reprice_history(datetime(2026, 3, 1), datetime(2026, 3, 2)) == 1
+
+    log = server.AgentLog.query.one()
+    assert (log.co2_kg, log.cost_saved) == (0.25, 5.0)
+    assert server.DailyRollup.query.one().co2_kg == pytest.approx(0.25)
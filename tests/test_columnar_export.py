@@ -0,0 +1,81 @@
+"""Columnar Parquet/Arrow export of agent logs and rollups (needs pyarrow)"""
+
+import io
+from datetime import datetime
+
+import pytest
+
+from exporters import columnar_available, write_columnar, write_monthly_partitions
+
+COLUMNS = [('id', 'int'), ('energy_kwh', 'float'), ('pc_id', 'str'), ('timestamp', 'datetime')]
+BATCHES = [
+    [(1, 0.5, 'PC-1', datetime(2026, 1, 30, 8)), (2, None, 'PC-2', datetime(2026, 1, 31, 9))],
+    [(3, 1.5, None, datetime(2026, 2, 1, 10))],
+]
+
+
+def test_export_needs_pyarrow(server, client, admin_headers, monkeypatch):
+    monkeypatch.setattr(server, 'columnar_available', lambda: False)
+
+    response = client.get('/api/v1/export/columnar', headers=admin_headers)
+
+    assert response.status_code == 501
+
+
+@pytest.mark.parametrize('params', [{'table': 'users'}, {'format': 'xlsx'}])
+def test_export_validates_table_and_format(client, admin_headers, params):
+    assert client.get('/api/v1/export/columnar', headers=admin_headers, query_string=params).status_code == 400
+
+
+@pytest.mark.parametrize('fmt', ['parquet', 'arrow'])
+def test_write_columnar_round_trip(fmt):
+    pa = pytest.importorskip('pyarrow')
+    sink = io.BytesIO()
+
+    assert write_columnar(sink, COLUMNS, BATCHES, fmt) == 3
+
+    sink.seek(0)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        table = pq.read_table(sink)
+        assert pq.ParquetFile(io.BytesIO(sink.getvalue())).num_row_groups == 2
+    else:
+        table = pa.ipc.open_file(sink).read_all()
+    assert table.column_names == [name for name, _ in COLUMNS]
+    assert table.column('energy_kwh').to_pylist() == [0.5, None, 1.5]
+    assert str(table.schema.field('timestamp').type) == 'timestamp[us]'
+
+
+def test_monthly_partitions(tmp_path):
+    pytest.importorskip('pyarrow')
+
+    written = write_monthly_partitions(str(tmp_path), 'agent_logs', COLUMNS, BATCHES, 'timestamp')
+
+    assert [(path.split('month=')[1], rows) for path, rows in written] == [
+        ('2026-01/agent_logs.parquet', 2), ('2026-02/agent_logs.parquet', 1)
+    ]
+
+
+def test_agent_log_export(server, client, admin_headers):
+    pq = pytest.importorskip('pyarrow.parquet')
+    response = client.post('/api/v1/agent/report', json={
+        'mac_address': 'AA:00:00:00:00:01', 'idle_minutes': 10, 'action': 'NONE'
+    })
+    assert response.status_code == 200
+
+    response = client.get('/api/v1/export/columnar', headers=admin_headers)
+
+    assert response.status_code == 200
+    table = pq.read_table(io.BytesIO(response.get_data()))
+    assert table.num_rows == 1
+    assert {'department', 'lab', 'idle_increment'} <= set(table.column_names)
+
+
+def test_columnar_available_matches_the_environment():
+    try:
+        import pyarrow  # noqa: F401
+        installed = True
+    except ImportError:
+        installed = False
+
+    assert columnar_available() is installed
@@ -0,0 +1,72 @@
+"""Streaming CSV export"""
+
+import csv
+import gzip
+import io
+import zlib
+from datetime import datetime, timedelta
+
+import pytest
+
+from exporters import iter_csv
+
+
+def test_iter_csv_emits_one_chunk_per_batch():
+    chunks = list(iter_csv(['a', 'b'], [[(1, 2), (3, 4)], [], [(5, 6)]], list))
+
+    assert chunks == [b'a,b\r\n', b'1,2\r\n3,4\r\n', b'5,6\r\n']
+
+
+def test_iter_csv_gzip_stream():
+    data = b''.join(iter_csv(['a'], [[(i,)] for i in range(100)], list, compress=True))
+
+    assert zlib.decompress(data, wbits=31).decode().splitlines() == ['a'] + [str(i) for i in range(100)]
+
+
+@pytest.fixture
+def logs(client, make_system, server):
+    now = datetime.utcnow().replace(microsecond=0)
+    for mac, department in (('AA:00:00:00:00:01', 'CS'), ('AA:00:00:00:00:02', 'EE')):
+        make_system(mac, department=department)
+        for minutes_ago in range(5, 0, -1):
+            response = client.post('/api/v1/agent/report', json={
+                'mac_address': mac, 'idle_minutes': 10, 'action': 'NONE',
+                'timestamp': (now - timedelta(minutes=minutes_ago)).isoformat()
+            })
+            assert response.status_code == 200
+    return now
+
+
+def rows(response, compressed=False):
+    data = response.get_data()
+    if compressed:
+        data = gzip.decompress(data)
+    return list(csv.DictReader(io.StringIO(data.decode('utf-8'))))
+
+
+def test_export_streams_in_batches(server, client, admin_headers, logs, monkeypatch):
+    monkeypatch.setattr(server.Config, 'EXPORT_BATCH_SIZE', 3)
+
+    response = client.get('/api/v1/export/csv', headers=admin_headers)
+
+    assert response.is_streamed
+    assert response.mimetype == 'text/csv'
+    exported = rows(response)
+    assert len(exported) == 10
+    assert [row['Timestamp'] for row in exported] == sorted((row['Timestamp'] for row in exported), reverse=True)
+
+
+def test_export_filters_and_gzip(client, admin_headers, logs):
+    response = client.get('/api/v1/export/csv', headers=admin_headers, query_string={
+        'department': 'CS', 'until': (logs - timedelta(minutes=2)).isoformat(), 'gzip': 'true'
+    })
+
+    assert response.mimetype == 'application/gzip'
+    assert response.headers['Content-Disposition'].endswith('.csv.gz')
+    assert len(rows(response, compressed=True)) == 3
+
+
+def test_export_rejects_bad_dates(client, admin_headers):
+    response = client.get('/api/v1/export/csv', headers=admin_headers, query_string={'since': 'yesterday'})
+
+    assert response.status_code == 400
@@ -0,0 +1,68 @@
+"""In-memory fleet index: running counts and expiry"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from fleet import FleetIndex
+
+NOW = datetime(2026, 3, 2, 9, 0)
+
+
+def ago(minutes):
+    return NOW - timedelta(minutes=minutes)
+
+
+@pytest.fixture
+def fleet():
+    index = FleetIndex(online_window=300)
+    index.load([
+        ('AA:01', 'active', ago(1), 'CS', 'L1'),
+        ('AA:02', 'idle', ago(2), 'CS', 'L2'),
+        ('AA:03', 'active', ago(60), 'EE', 'L1'),
+    ], NOW)
+    return index
+
+
+def test_load_expires_silent_systems(fleet):
+    assert fleet.status_counts(NOW) == {'active': 1, 'idle': 1, 'offline': 1}
+    assert fleet.online_count(NOW) == 2
+
+
+def test_counts_by_department_and_lab(fleet):
+    assert fleet.status_counts(NOW, department='CS') == {'active': 1, 'idle': 1}
+    assert fleet.status_counts(NOW, lab='L1') == {'active': 1, 'offline': 1}
+
+
+def test_systems_expire_as_time_passes(fleet):
+    assert fleet.status_counts(NOW + timedelta(minutes=3, seconds=30)) == {'active': 1, 'offline': 2}
+    assert fleet.status_counts(NOW + timedelta(minutes=10)) == {'offline': 3}
+
+
+def test_a_system_seen_again_is_not_expired(fleet):
+    fleet.merge('AA:01', 'active', NOW + timedelta(minutes=4))
+
+    counts = fleet.status_counts(NOW + timedelta(minutes=6))
+
+    assert counts == {'active': 1, 'offline': 2}
+    assert fleet.online_count(NOW + timedelta(minutes=6)) == 1
+
+
+def test_older_sightings_do_not_overwrite_newer_ones(fleet):
+    fleet.merge('AA:01', 'sleeping', ago(30))
+
+    assert fleet.status_counts(NOW, department='CS') == {'active': 1, 'idle': 1}
+
+
+def test_offline_system_comes_back_online(fleet):
+    fleet.merge('AA:03', 'idle', NOW, 'EE', 'L1')
+
+    assert fleet.status_counts(NOW) == {'active': 1, 'idle': 2}
+    assert fleet.placement('AA:03') == ('EE', 'L1')
+    assert fleet.placement('AA:99') == (None, None)
+
+
+def test_status_change_keeps_placement(fleet):
+    fleet.set_status('AA:02', 'sleeping')
+
+    assert fleet.status_counts(NOW, lab='L2') == {'sleeping': 1}
@@ -0,0 +1,109 @@
+"""Idle forecasting: IdleForecaster training, persistence and the predictions endpoint"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from forecasting import HISTORY_HOURS, ForecastStore, IdleForecaster
+
+START = datetime(2026, 2, 2)  # a Monday
+NIGHT = [hour < 8 or hour >= 18 for hour in range(24)]
+
+
+def timetable(systems, days, start=START):
+    """Idle fractions of systems idle at night and busy by day, with a little noise"""
+    rng = np.random.default_rng(3)
+    hours = days * 24
+    pattern = np.array([0.95 if NIGHT[(start.hour + hour) % 24] else 0.05 for hour in range(hours)])
+    return np.clip(pattern + rng.normal(0, 0.03, (systems, hours)), 0, 1)
+
+
+@pytest.fixture(scope='module')
+def trained():
+    model = IdleForecaster(half_life_days=14)
+    system_ids, groups = [1, 2, 3], [('CS', 'L1')] * 3
+    idle = timetable(3, 22)
+    # A day at a time, with the 24 hour lead-in, as train_forecast does
+    for day in range(1, 22):
+        columns = slice((day - 1) * 24, (day + 1) * 24)
+        model.update(system_ids, groups, START + timedelta(days=day - 1), idle[:, columns])
+    return model
+
+
+def test_learns_the_timetable(trained):
+    assert trained.trained_through == START + timedelta(days=22)
+
+    probabilities = trained.predict([1, 2], [('CS', 'L1')] * 2, trained.trained_through, hours=24)
+
+    assert probabilities.shape == (2, 24)
+    assert probabilities[:, NIGHT].min() > 0.8
+    assert probabilities[:, [not night for night in NIGHT]].max() < 0.2
+
+
+def test_new_systems_get_their_lab_profile(trained):
+    [new], [known] = (trained.predict([system_id], [('CS', 'L1')], trained.trained_through + timedelta(days=7), 24)
+                      for system_id in (99, 1))
+
+    assert new[2] > 0.8 and new[12] < 0.2
+    assert np.abs(new - known).max() < 0.15
+
+
+def test_update_needs_more_than_the_lead_in():
+    model = IdleForecaster()
+
+    assert model.update([1], [('CS', 'L1')], START, np.ones((1, HISTORY_HOURS))) == 0
+    assert model.trained_through is None
+
+
+def test_save_and_load_round_trip(trained, tmp_path):
+    path = str(tmp_path / 'model.npz')
+    trained.save(path)
+
+    loaded = IdleForecaster.load(path)
+
+    assert loaded.trained_through == trained.trained_through
+    assert loaded.groups == trained.groups
+    at = trained.trained_through + timedelta(hours=3)
+    assert np.allclose(loaded.predict([1, 99], [('CS', 'L1'), (None, None)], at, 12),
+                       trained.predict([1, 99], [('CS', 'L1'), (None, None)], at, 12))
+    # Training goes on from where the saved model stopped
+    assert loaded.update([1], [('CS', 'L1')], trained.trained_through - timedelta(hours=HISTORY_HOURS),
+                         timetable(1, 2, start=trained.trained_through)) == 24
+
+
+def test_store_picks_up_a_model_saved_elsewhere(trained, tmp_path):
+    path = str(tmp_path / 'model.npz')
+    store = ForecastStore(path)
+    assert store.get() is None
+
+    trained.save(path)
+    first = store.get()
+    assert first.trained_through == trained.trained_through
+    assert store.get() is first
+
+
+def test_predictions_endpoint(server, client, admin_headers, make_system, monkeypatch, tmp_path):
+    monkeypatch.setattr(server.Config, 'ENABLE_ML_PREDICTIONS', True)
+    monkeypatch.setattr(server.Config, 'FORECAST_MODEL_PATH', str(tmp_path / 'model.npz'))
+    monkeypatch.setattr(server, 'forecast_store', ForecastStore(server.Config.FORECAST_MODEL_PATH))
+    assert client.get('/api/v1/predictions', headers=admin_headers).status_code == 503
+
+    system_id = make_system('AA:00:00:00:00:01')
+    end = server.hour_bucket(datetime.utcnow())
+    with server.app.app_context():
+        server.db.session.add_all([
+            server.HourlyRollup(bucket=end - timedelta(hours=hour), system_id=system_id, department='CS', lab='L1',
+                                idle_minutes=30, samples=1)
+            for hour in range(1, 72)
+        ])
+        server.db.session.commit()
+        assert server.train_forecast() > 0
+
+    response = client.get('/api/v1/predictions', headers=admin_headers, query_string={'hours': 4})
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert [(lab['department'], lab['lab'], len(lab['idle_probability'])) for lab in data['labs']] == [('CS', 'L1', 4)]
+    assert data['systems'][0]['system_id'] == system_id
+    assert client.get('/api/v1/predictions', headers=admin_headers, query_string={'hours': 0}).status_code == 400
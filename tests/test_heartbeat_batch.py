@@ -0,0 +1,46 @@
+"""Batched heartbeat ingest (/api/v1/agent/report/batch)"""
+
+from datetime import datetime, timedelta
+
+
+def report(mac_address, minutes_ago=0, idle_minutes=0, action='NONE', **fields):
+    timestamp = datetime.utcnow() - timedelta(minutes=minutes_ago)
+    return {'mac_address': mac_address, 'idle_minutes': idle_minutes, 'action': action,
+            'timestamp': timestamp.isoformat(), **fields}
+
+
+def test_batch_stores_every_valid_report(client, server):
+    reports = [report('AA:00:00:00:00:01', minutes_ago=10 - i, idle_minutes=i) for i in range(5)]
+    reports.append(report('aa-00-00-00-00-02'))
+
+    response = client.post('/api/v1/agent/report/batch', json={'reports': reports})
+
+    assert response.status_code == 200
+    assert response.json['accepted'] == 6
+    assert response.json['rejected'] == []
+    with server.app.app_context():
+        assert server.AgentLog.query.count() == 6
+        assert server.System.query.filter_by(mac_address='AA:00:00:00:00:02').count() == 1
+
+
+def test_batch_rejects_invalid_reports_individually(client, server):
+    reports = [report('AA:00:00:00:00:01'), {'idle_minutes': 3}, report('AA:00:00:00:00:01', idle_minutes=-1)]
+
+    response = client.post('/api/v1/agent/report/batch', json=reports)
+
+    assert response.status_code == 200
+    assert response.json['accepted'] == 1
+    assert [item['index'] for item in response.json['rejected']] == [1, 2]
+
+
+def test_batch_needs_reports(client):
+    assert client.post('/api/v1/agent/report/batch', json={'reports': []}).status_code == 400
+    assert client.post('/api/v1/agent/report/batch', data='nope').status_code == 400
+
+
+def test_batch_size_is_capped(client, server, monkeypatch):
+    monkeypatch.setattr(server.Config, 'HEARTBEAT_BATCH_MAX', 2)
+
+    response = client.post('/api/v1/agent/report/batch', json=[report('AA:00:00:00:00:01')] * 3)
+
+    assert response.status_code == 413
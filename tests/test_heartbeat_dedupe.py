@@ -0,0 +1,74 @@
+"""Idempotent heartbeat ingest: retried reports are stored once"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+
+def heartbeat(client, mac_address, timestamp=None, seq=None, idle_minutes=10):
+    payload = {'mac_address': mac_address, 'idle_minutes': idle_minutes, 'action': 'NONE'}
+    if timestamp is not None:
+        payload['timestamp'] = timestamp.isoformat()
+    if seq is not None:
+        payload['seq'] = seq
+    return client.post('/api/agent/heartbeat', json=payload)
+
+
+def test_retry_is_stored_once(client, server):
+    sent_at = datetime.utcnow() - timedelta(minutes=1)
+
+    first = heartbeat(client, 'AA:00:00:00:00:01', sent_at, seq=7)
+    retry = heartbeat(client, 'AA:00:00:00:00:01', sent_at, seq=7)
+
+    assert first.json['status'] == 'ok'
+    assert retry.json['status'] == 'duplicate'
+    with server.app.app_context():
+        assert server.AgentLog.query.count() == 1
+
+
+@pytest.mark.parametrize('offset', [timedelta(minutes=20), timedelta(days=8), -timedelta(days=8)])
+def test_report_from_a_wrong_clock_is_stored_under_its_arrival_time(server, client, make_system, caplog, offset):
+    # 20 minutes ahead is past HEARTBEAT_MAX_CLOCK_SKEW; 8 days either way past HEARTBEAT_MAX_DELAY
+    make_system('AA:00:00:00:00:02', last_seen=datetime.utcnow() - timedelta(hours=2))
+    before = datetime.utcnow()
+
+    response = heartbeat(client, 'AA:00:00:00:00:02', before + offset, seq=1, idle_minutes=40)
+
+    assert response.status_code == 200
+    assert response.json['status'] == 'ok'
+    assert 'stored under its arrival time' in caplog.text
+    with server.app.app_context():
+        [row] = server.AgentLog.query.all()
+        assert before <= row.timestamp <= datetime.utcnow()
+        assert row.dedupe_key is None
+        assert server.System.query.one().last_seen >= before
+        [rollup] = server.HourlyRollup.query.all()
+        assert (rollup.bucket, rollup.samples) == (server.hour_bucket(row.timestamp), 1)
+
+        # A rebuild files the report where ingest did
+        server.rebuild_rollups(row.timestamp, row.timestamp)
+        [rebuilt] = server.HourlyRollup.query.all()
+        assert (rebuilt.bucket, rebuilt.samples) == (rollup.bucket, 1)
+
+
+def test_reports_without_timestamp_are_always_stored(client, server):
+    heartbeat(client, 'AA:00:00:00:00:04', seq=1)
+    heartbeat(client, 'AA:00:00:00:00:04', seq=1)
+
+    with server.app.app_context():
+        assert server.AgentLog.query.count() == 2
+
+
+def test_portable_fallback_matches_the_unique_index(app_context, make_system, monkeypatch):
+    server = app_context
+    system_id = make_system('AA:00:00:00:00:05')
+    sent_at = datetime.utcnow().replace(microsecond=0)
+    row = {'system_id': system_id, 'pc_id': 'PC', 'idle_minutes': 1.0, 'idle_increment': 1.0, 'action': 'NONE',
+           'reason': None, 'energy_kwh': 0.0, 'co2_kg': 0.0, 'cost_saved': 0.0, 'timestamp': sent_at,
+           'dedupe_key': 'AA:00:00:00:00:05@x'}
+    monkeypatch.setattr(server.db.engine.dialect, 'name', 'other')
+
+    assert server.insert_agent_logs([dict(row)]) != []
+    assert server.insert_agent_logs([dict(row)]) == []
+    # Same key under another timestamp is a different row, as for the index
+    assert server.insert_agent_logs([dict(row, timestamp=sent_at + timedelta(seconds=1))]) != []
@@ -0,0 +1,76 @@
+"""Single-transaction heartbeat ingest and its write-amplification controls"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+MAC = 'AA:00:00:00:00:01'
+
+
+@pytest.fixture
+def statements(server):
+    """(commits, [SQL statement]) issued by the app while the test runs"""
+    log = {'commits': 0, 'sql': []}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        log['sql'].append(statement.lstrip().upper())
+
+    def commit(conn):
+        log['commits'] += 1
+
+    with server.app.app_context():
+        engine = server.db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    event.listen(engine, 'commit', commit)
+    yield log
+    event.remove(engine, 'before_cursor_execute', record)
+    event.remove(engine, 'commit', commit)
+
+
+def report(minutes_ago=0, idle_minutes=1, mac_address=MAC):
+    timestamp = datetime.utcnow() - timedelta(minutes=minutes_ago)
+    return {'mac_address': mac_address, 'idle_minutes': idle_minutes, 'action': 'NONE',
+            'timestamp': timestamp.isoformat()}
+
+
+def writes(log, table):
+    return [sql for sql in log['sql'] if sql.startswith((f'INSERT INTO {table.upper()}', f'UPDATE {table.upper()}'))]
+
+
+def test_heartbeat_commits_once(client, statements):
+    assert client.post('/api/v1/agent/report', json=report()).status_code == 200
+
+    assert statements['commits'] == 1
+    assert len(writes(statements, 'agent_logs')) == 1
+
+
+def test_known_system_is_not_rewritten_within_the_touch_interval(server, client, statements):
+    client.post('/api/v1/agent/report', json=report(minutes_ago=1))
+    statements['sql'].clear()
+
+    client.post('/api/v1/agent/report', json=report())
+
+    assert writes(statements, 'systems') == []
+    assert len(writes(statements, 'agent_logs')) == 1
+
+
+def test_last_seen_is_refreshed_after_the_touch_interval(server, client, monkeypatch):
+    client.post('/api/v1/agent/report', json=report(minutes_ago=1))
+    with server.app.app_context():
+        first_seen = server.System.query.filter_by(mac_address=MAC).one().last_seen
+
+    monkeypatch.setattr(server.Config, 'SYSTEM_TOUCH_INTERVAL', 0)
+    client.post('/api/v1/agent/report', json=report())
+
+    with server.app.app_context():
+        assert server.System.query.filter_by(mac_address=MAC).one().last_seen > first_seen
+
+
+def test_batch_is_one_transaction_with_one_log_insert(client, statements):
+    reports = [report(minutes_ago=10 - i, mac_address=f'AA:00:00:00:00:0{i % 3 + 1}') for i in range(9)]
+
+    assert client.post('/api/v1/agent/report/batch', json=reports).status_code == 200
+
+    assert statements['commits'] == 1
+    assert len(writes(statements, 'agent_logs')) == 1
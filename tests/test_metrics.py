@@ -0,0 +1,68 @@
+"""Prometheus /metrics: incremental collectors and deprecated series"""
+
+import re
+from datetime import datetime, timedelta
+
+from prometheus_client.parser import text_string_to_metric_families
+
+
+def scrape(client):
+    """{series name: [(labels, value)]} and {family: type} from /metrics"""
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    text = response.get_data(as_text=True)
+
+    series = {}
+    for family in text_string_to_metric_families(text):
+        for sample in family.samples:
+            series.setdefault(sample.name, []).append((sample.labels, sample.value))
+    types = dict(re.findall(r'^# TYPE (\S+) (\S+)$', text, re.MULTILINE))
+    return series, types
+
+
+def total(series, name, **labels):
+    return sum(value for sample_labels, value in series.get(name, [])
+               if all(sample_labels.get(k) == v for k, v in labels.items()))
+
+
+def test_heartbeats_move_the_collectors(server, client):
+    before, _ = scrape(client)
+    response = client.post('/api/v1/agent/report', json={
+        'mac_address': 'AA:00:00:00:00:01', 'idle_minutes': 45, 'action': 'NONE'
+    })
+    assert response.status_code == 200
+
+    after, _ = scrape(client)
+    assert total(after, 'greenops_systems', status='idle') == total(before, 'greenops_systems', status='idle') + 1
+    assert total(after, 'greenops_heartbeats_total') == total(before, 'greenops_heartbeats_total') + 1
+
+
+def test_deprecated_series_are_still_exported(server, client):
+    series, types = scrape(client)
+
+    for status in ('active', 'idle', 'sleeping'):
+        assert types[f'greenops_systems_{status}'] == 'gauge'
+        assert total(series, f'greenops_systems_{status}') == total(series, 'greenops_systems', status=status)
+    assert types['greenops_carbon_emissions_kg'] == 'gauge'
+    assert types['greenops_energy_kwh'] == 'gauge'
+    assert types['greenops_energy_kwh_total'] == 'counter'
+
+
+def test_deprecated_window_gauges_refresh_at_most_once_per_interval(server, client, monkeypatch):
+    calls = []
+    rollup_totals = server.rollup_totals
+
+    def counting(*args, **kwargs):
+        calls.append(args)
+        return rollup_totals(*args, **kwargs)
+
+    monkeypatch.setattr(server, 'rollup_totals', counting)
+    monkeypatch.setattr(server.telemetry, 'legacy_synced_at', None)
+
+    scrape(client)
+    scrape(client)
+    assert len(calls) == 1
+
+    monkeypatch.setattr(server.telemetry, 'legacy_synced_at', datetime.utcnow() - timedelta(hours=1))
+    scrape(client)
+    assert len(calls) == 2
@@ -0,0 +1,63 @@
+"""SQL-side aggregation behind /api/v1/metrics/summary and /trends"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def history(app_context, make_system):
+    """One SLEEP report per system per day for the last 20 days, noon UTC"""
+    server = app_context
+    make_system('AA:00:00:00:00:01', department='CS')
+    make_system('AA:00:00:00:00:02', department='EE')
+    systems = {system.id: system for system in server.System.query.all()}
+    today = server.day_bucket(datetime.utcnow())
+
+    rows = [
+        {'system_id': system_id, 'timestamp': today - timedelta(days=day) + timedelta(hours=12),
+         'energy_kwh': 1.0, 'co2_kg': 0.5, 'cost_saved': 2.0, 'idle_increment': 60.0, 'action': 'SLEEP'}
+        for day in range(1, 21) for system_id in systems
+    ]
+    server.update_rollups(rows, systems)
+    server.db.session.commit()
+    return today
+
+
+@pytest.mark.parametrize('granularity', ['day', 'week', 'month'])
+def test_series_labels_match_the_python_bucketing(app_context, history, monkeypatch, granularity):
+    server = app_context
+    since = history - timedelta(days=30)
+    native = server.rollup_series(granularity, since)
+
+    monkeypatch.setattr(server.db.engine.dialect, 'name', 'other')
+    portable = server.rollup_series(granularity, since)
+
+    assert native == portable
+    assert sum(point['samples'] for point in native) == 40
+    if granularity == 'week':
+        assert all(datetime.fromisoformat(point['bucket']).weekday() == 0 for point in native)
+
+
+def test_summary_totals_by_department(client, admin_headers, history):
+    response = client.get('/api/v1/metrics/summary', query_string={'period': '7d', 'department': 'CS'},
+                          headers=admin_headers)
+
+    assert response.status_code == 200
+    # The window starts at this hour 7 days ago, so it holds that day's noon report until 12:59
+    days = 6 + (datetime.utcnow().hour <= 12)
+    assert response.json['total_actions'] == days
+    assert response.json['total_energy_kwh'] == pytest.approx(days)
+    assert response.json['total_cost_saved'] == pytest.approx(2 * days)
+
+
+def test_trends_by_day(client, admin_headers, history):
+    response = client.get('/api/v1/metrics/trends', query_string={'days': 3, 'granularity': 'day'},
+                          headers=admin_headers)
+
+    assert response.status_code == 200
+    trends = response.json['trends']
+    assert [point['date'] for point in trends] == [
+        (history - timedelta(days=day)).strftime('%Y-%m-%d') for day in (3, 2, 1)
+    ]
+    assert all(point['actions'] == 2 and point['idle_minutes'] == 120 for point in trends)
@@ -0,0 +1,48 @@
+"""Background offline reaper"""
+
+from datetime import datetime, timedelta
+
+
+def statuses(server):
+    with server.app.app_context():
+        return dict(server.db.session.execute(server.db.select(server.System.mac_address, server.System.status)).all())
+
+
+def test_reaps_only_systems_silent_past_the_grace_period(server, client, make_system):
+    now = datetime.utcnow()
+    grace = timedelta(seconds=server.Config.OFFLINE_GRACE_SECONDS)
+    make_system('AA:00:00:00:00:01', last_seen=now - grace - timedelta(minutes=1))
+    make_system('AA:00:00:00:00:02', last_seen=now - grace + timedelta(minutes=1))
+    make_system('AA:00:00:00:00:03', status='offline', last_seen=now - timedelta(days=1))
+
+    with server.app.app_context():
+        assert server.reap_offline_systems(now) == 1
+        assert server.reap_offline_systems(now) == 0
+
+    assert statuses(server) == {
+        'AA:00:00:00:00:01': 'offline',
+        'AA:00:00:00:00:02': 'active',
+        'AA:00:00:00:00:03': 'offline',
+    }
+
+
+def test_reaped_system_comes_back_on_its_next_heartbeat(server, client, make_system):
+    now = datetime.utcnow()
+    make_system('AA:00:00:00:00:01', last_seen=now - timedelta(hours=1))
+
+    with server.app.app_context():
+        server.reap_offline_systems(now)
+    assert server.fleet.status_counts(now)['offline'] == 1
+
+    response = client.post('/api/v1/agent/report', json={'mac_address': 'AA:00:00:00:00:01', 'idle_minutes': 0,
+                                                          'action': 'NONE'})
+    assert response.status_code == 200
+    assert statuses(server)['AA:00:00:00:00:01'] == 'active'
+
+
+def test_admin_page_load_does_not_sweep(server, client, make_system, admin_headers):
+    make_system('AA:00:00:00:00:01', last_seen=datetime.utcnow() - timedelta(hours=1))
+
+    assert client.get('/api/admin/machines', headers=admin_headers).status_code == 200
+
+    assert statuses(server)['AA:00:00:00:00:01'] == 'active'
@@ -0,0 +1,95 @@
+"""Monthly agent_logs partitions (PostgreSQL only)"""
+
+import threading
+from datetime import datetime
+
+import pytest
+
+
+@pytest.fixture
+def partitioned(app_context):
+    if not app_context.agent_logs_partitioned():
+        pytest.skip('needs GREENOPS_TEST_DATABASE_URL pointing at an empty PostgreSQL database')
+    return app_context
+
+
+def partition_names(server):
+    return {name for name, _ in server.log_partitions()}
+
+
+def default_partition_exists(server):
+    return server.db.session.execute(server.db.text("SELECT to_regclass('agent_logs_default')")).scalar() is not None
+
+
+def test_other_databases_keep_a_single_table(app_context):
+    server = app_context
+    if server.db.engine.dialect.name == 'postgresql':
+        pytest.skip('checks the fallback on databases without partitioning')
+
+    assert server.agent_logs_partitioned() is False
+    assert server.log_partitions() == []
+    assert server.ensure_log_partitions() == 0
+    assert server.purge_agent_logs(retention_days=30)['partitions_dropped'] == 0
+
+
+def test_purge_drops_expired_partitions_next_to_the_default_partition(partitioned, make_system):
+    server = partitioned
+    system_id = make_system('AA:00:00:00:10:01')
+    server.ensure_log_partitions(now=datetime(2020, 3, 1))
+    server.db.session.add(server.AgentLog(system_id=system_id, pc_id='PC', idle_minutes=5, idle_increment=5,
+                                          action='NONE', timestamp=datetime(2020, 3, 10, 12)))
+    server.db.session.commit()
+    assert 'agent_logs_p202003' in partition_names(server)
+    assert default_partition_exists(server)
+
+    summary = server.purge_agent_logs(retention_days=30)
+
+    assert summary['partitions_dropped'] >= 5
+    assert not any(name.startswith('agent_logs_p2020') for name in partition_names(server))
+    assert default_partition_exists(server)
+    assert server.AgentLog.query.count() == 0
+    # The month was rolled up before it went
+    assert server.DailyRollup.query.filter_by(bucket=datetime(2020, 3, 10)).count() == 1
+
+
+def test_drop_gives_up_while_a_reader_holds_the_table(partitioned, monkeypatch):
+    server = partitioned
+    monkeypatch.setattr(server.Config, 'PARTITION_LOCK_TIMEOUT_MS', 100)
+    server.ensure_log_partitions(now=datetime(2020, 3, 1))
+
+    reader = server.db.engine.connect()
+    transaction = reader.begin()
+    reader.execute(server.db.text('SELECT count(*) FROM agent_logs'))
+    try:
+        assert server.drop_log_partition('agent_logs_p202002', attempts=1) is False
+    finally:
+        transaction.rollback()
+        reader.close()
+
+    assert server.drop_log_partition('agent_logs_p202002', attempts=1) is True
+    assert 'agent_logs_p202002' not in partition_names(server)
+    for name in partition_names(server):
+        if name.startswith('agent_logs_p2020'):
+            server.drop_log_partition(name)
+
+
+def test_writes_continue_while_a_partition_is_dropped(partitioned, make_system):
+    server = partitioned
+    system_id = make_system('AA:00:00:00:10:02')
+    server.ensure_log_partitions(now=datetime(2020, 3, 1))
+
+    def write():
+        with server.app.app_context():
+            for _ in range(20):
+                server.db.session.add(server.AgentLog(system_id=system_id, pc_id='PC', idle_minutes=1,
+                                                      action='NONE', timestamp=datetime.utcnow()))
+                server.db.session.commit()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    for name in sorted(partition_names(server)):
+        if name.startswith('agent_logs_p2020'):
+            assert server.drop_log_partition(name)
+    writer.join()
+
+    assert server.AgentLog.query.count() == 20
@@ -0,0 +1,100 @@
+"""Hierarchical policy targeting: PolicyIndex precedence and agent placement"""
+
+from datetime import datetime
+
+import pytest
+
+from policies import PolicyCache, PolicyIndex
+
+DEFAULT = {'idle_threshold': 15}
+MAC = 'AA:00:00:00:00:01'
+
+
+def policy(id, scope='organization', priority=0, **target):
+    return {'id': id, 'scope': scope, 'priority': priority, 'idle_threshold': id, **target}
+
+
+def resolved(index, *placement):
+    return index.resolve(*placement).policy['id']
+
+
+def test_most_specific_target_wins():
+    index = PolicyIndex([
+        policy(1),
+        policy(2, 'department', department='CS'),
+        policy(3, 'lab', department='CS', lab='L1'),
+        policy(4, 'system', mac_address=MAC),
+    ], DEFAULT)
+
+    assert resolved(index, 'CS', 'L1', MAC) == 4
+    assert resolved(index, 'CS', 'L1', 'AA:00:00:00:00:02') == 3
+    assert resolved(index, 'CS', 'L2', None) == 2
+    assert resolved(index, 'EE', 'L1', None) == 1
+
+
+def test_priority_then_oldest_policy_wins_within_a_target():
+    index = PolicyIndex([
+        policy(1, 'department', department='CS'),
+        policy(2, 'department', department='CS', priority=5),
+        policy(3, 'department', department='CS', priority=5),
+    ], DEFAULT)
+
+    assert resolved(index, 'CS', None, None) == 2
+
+
+def test_lab_policy_without_department_applies_to_every_lab_of_that_name():
+    index = PolicyIndex([
+        policy(1, 'lab', lab='L1'),
+        policy(2, 'lab', department='EE', lab='L1'),
+    ], DEFAULT)
+
+    assert resolved(index, 'CS', 'L1', None) == 1
+    assert resolved(index, 'EE', 'L1', None) == 2
+
+
+def test_default_applies_without_an_organization_policy():
+    index = PolicyIndex([policy(1, 'department', department='CS')], DEFAULT)
+
+    assert index.resolve('EE', 'L1', MAC).policy == DEFAULT
+
+
+def test_cache_reloads_only_when_stale():
+    now = [0.0]
+    loads = []
+
+    def loader():
+        loads.append(now[0])
+        return [policy(1)]
+
+    cache = PolicyCache(loader, DEFAULT, ttl=30, clock=lambda: now[0])
+    first = cache.get()
+    now[0] = 10
+    assert cache.get() is first
+    now[0] = 31
+    assert cache.get() is first  # reloaded, but the policies did not change
+    assert loads == [0.0, 31]
+    assert cache.stats == {'loads': 2, 'changes': 1}
+
+
+def test_agent_gets_its_lab_policy_before_the_fleet_knows_it(server, client, admin_headers, make_system):
+    created = client.post('/api/v1/policies', headers=admin_headers, json={
+        'name': 'Lab L1', 'scope': 'lab', 'department': 'CS', 'lab': 'L1', 'idle_threshold': 7
+    })
+    assert created.status_code == 201
+    make_system(MAC, department='CS', lab='L1')
+
+    # Registered through another worker: this worker's fleet index has not synced yet
+    server.fleet.load([], datetime.utcnow())
+    assert server.fleet.placement(MAC) == (None, None)
+
+    response = client.get('/api/v1/agent/policy', query_string={'mac_address': MAC})
+
+    assert response.status_code == 200
+    assert response.get_json()['idle_threshold'] == 7
+
+
+def test_unknown_system_gets_the_organization_policy(client):
+    response = client.get('/api/v1/agent/policy', query_string={'mac_address': MAC})
+
+    assert response.status_code == 200
+    assert response.get_json()['idle_threshold'] == DEFAULT['idle_threshold']
@@ -0,0 +1,145 @@
+"""Conditional policy fetch: ETag / If-None-Match on the server and in the agent"""
+
+import importlib
+import json
+import os
+import sys
+
+import pytest
+from sqlalchemy import event
+
+from conftest import ROOT
+
+POLICY_URL = '/api/v1/agent/policy'
+MAC = 'AA:00:00:00:00:01'
+
+
+def test_unchanged_policy_is_an_empty_304(client):
+    first = client.get(POLICY_URL)
+    assert first.status_code == 200
+    assert first.headers['Cache-Control'] == 'no-cache'
+    etag = first.headers['ETag']
+    assert first.get_json()['version'] == etag.strip('"')
+
+    again = client.get(POLICY_URL, headers={'If-None-Match': etag})
+
+    assert again.status_code == 304
+    assert again.get_data() == b''
+    assert again.headers['ETag'] == etag
+
+
+def test_a_policy_change_changes_the_etag(client, admin_headers):
+    etag = client.get(POLICY_URL).headers['ETag']
+    created = client.post('/api/v1/policies', headers=admin_headers,
+                          json={'name': 'Strict', 'idle_threshold': 5, 'sleep_threshold': 10})
+    assert created.status_code == 201
+
+    response = client.get(POLICY_URL, headers={'If-None-Match': etag})
+
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.get_json()['idle_threshold'] == 5
+
+
+def test_each_placement_has_its_own_etag(client, admin_headers, make_system):
+    make_system(MAC, department='CS', lab='L1')
+    client.post('/api/v1/policies', headers=admin_headers,
+                json={'name': 'Lab', 'scope': 'lab', 'department': 'CS', 'lab': 'L1', 'idle_threshold': 7})
+    organization = client.get(POLICY_URL).headers['ETag']
+
+    response = client.get(POLICY_URL, query_string={'mac_address': MAC}, headers={'If-None-Match': organization})
+
+    assert response.status_code == 200
+    assert response.get_json()['idle_threshold'] == 7
+
+
+def test_polls_are_served_from_the_policy_cache(server, client):
+    client.get(POLICY_URL)
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if 'FROM policies' in statement:
+            statements.append(statement)
+
+    with server.app.app_context():
+        engine = server.db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        for _ in range(5):
+            assert client.get(POLICY_URL).status_code == 200
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+    assert statements == []
+
+
+# ----------------------
+# AGENT
+# ----------------------
+class FakeResponse:
+    def __init__(self, status_code, body=None, etag=None):
+        self.status_code = status_code
+        self._body = body
+        self.headers = {'ETag': etag} if etag else {}
+
+    def json(self):
+        return self._body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            import requests
+            raise requests.exceptions.HTTPError(str(self.status_code))
+
+
+class FakeSession:
+    """Stands in for requests.Session: replays canned responses, records request headers"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.sent = []
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        self.sent.append(headers or {})
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@pytest.fixture
+def agent(tmp_path, monkeypatch):
+    pytest.importorskip('requests')
+    # The agent logs to a file in the working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(os.path.join(ROOT, 'agent'))
+    module = importlib.import_module('agent')
+    monkeypatch.setattr(module.Config, 'POLICY_CACHE_FILE', str(tmp_path / 'policy_cache.json'))
+    yield module
+    sys.modules.pop('agent', None)
+
+
+def test_agent_sends_its_etag_and_keeps_the_policy_on_304(agent):
+    client = agent.ServerClient()
+    client.session = FakeSession(FakeResponse(200, {'idle_threshold': 7}, '"v1"'), FakeResponse(304))
+
+    assert client.get_policy() == {'idle_threshold': 7}
+    assert client.get_policy() == {'idle_threshold': 7}
+
+    assert client.session.sent == [{}, {'If-None-Match': '"v1"'}]
+
+
+def test_agent_starts_with_the_policy_saved_by_its_last_run(agent):
+    import requests
+
+    client = agent.ServerClient()
+    client.session = FakeSession(FakeResponse(200, {'idle_threshold': 7}, '"v1"'))
+    client.get_policy()
+    with open(agent.Config.POLICY_CACHE_FILE) as f:
+        assert json.load(f) == {'policy': {'idle_threshold': 7}, 'etag': '"v1"'}
+
+    restarted = agent.ServerClient()
+    restarted.session = FakeSession(requests.exceptions.ConnectionError('down'), FakeResponse(304))
+
+    assert restarted.get_policy() == {'idle_threshold': 7}
+    assert restarted.get_policy() == {'idle_threshold': 7}
+    assert restarted.session.sent[1] == {'If-None-Match': '"v1"'}
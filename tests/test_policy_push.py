@@ -0,0 +1,93 @@
+"""Policy push: long-poll and Server-Sent Events on /api/v1/agent/policy"""
+
+import threading
+import time
+
+POLICY_URL = '/api/v1/agent/policy'
+STREAM_URL = '/api/v1/agent/policy/stream'
+
+
+def current_etag(client):
+    response = client.get(POLICY_URL)
+    assert response.status_code == 200
+    return response.headers['ETag']
+
+
+def wait_for_subscribers(server, count, timeout=5):
+    deadline = time.monotonic() + timeout
+    while server.policy_cache.waiting < count:
+        assert time.monotonic() < deadline, 'the long-poll never started waiting'
+        time.sleep(0.01)
+
+
+def test_push_is_off_by_default(server, client):
+    assert server.Config.POLICY_PUSH_MAX_CLIENTS == 0
+    assert server.Config.POLICY_STREAM_MAX_SECONDS < 3600
+
+    assert client.get(STREAM_URL).status_code == 404
+
+    # ?wait= must not hold a (sync) worker while push is off
+    etag = current_etag(client)
+    started = time.monotonic()
+    response = client.get(POLICY_URL, query_string={'wait': 30}, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert time.monotonic() - started < 5
+
+
+def test_long_poll_answers_when_the_policy_changes(server, client, admin_headers, monkeypatch):
+    monkeypatch.setattr(server.Config, 'POLICY_PUSH_MAX_CLIENTS', 10)
+    etag = current_etag(client)
+    result = {}
+
+    def long_poll():
+        poller = server.app.test_client()
+        result['response'] = poller.get(POLICY_URL, query_string={'wait': 10}, headers={'If-None-Match': etag})
+
+    thread = threading.Thread(target=long_poll)
+    thread.start()
+    wait_for_subscribers(server, 1)
+    created = client.post('/api/v1/policies', headers=admin_headers,
+                          json={'name': 'Strict', 'idle_threshold': 5, 'sleep_threshold': 10})
+    assert created.status_code == 201
+    thread.join(10)
+
+    response = result['response']
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.get_json()['idle_threshold'] == 5
+
+
+def test_long_poll_times_out_with_304(server, client, monkeypatch):
+    monkeypatch.setattr(server.Config, 'POLICY_PUSH_MAX_CLIENTS', 10)
+    etag = current_etag(client)
+
+    response = client.get(POLICY_URL, query_string={'wait': 0.2}, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+
+
+def test_push_at_capacity_tells_agents_to_poll(server, client, monkeypatch):
+    monkeypatch.setattr(server.Config, 'POLICY_PUSH_MAX_CLIENTS', 1)
+    monkeypatch.setattr(server.policy_cache, 'waiting', 1)
+
+    response = client.get(STREAM_URL)
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
+
+
+def test_stream_sends_the_policy_and_ends_after_its_time_limit(server, client, monkeypatch):
+    monkeypatch.setattr(server.Config, 'POLICY_PUSH_MAX_CLIENTS', 10)
+    monkeypatch.setattr(server.Config, 'POLICY_STREAM_MAX_SECONDS', 0.3)
+    monkeypatch.setattr(server.Config, 'POLICY_KEEPALIVE_SECONDS', 0.1)
+    version = current_etag(client).strip('"')
+
+    response = client.get(STREAM_URL)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    body = response.get_data(as_text=True)
+    assert body.startswith(f'id: {version}\nevent: policy\n')
+    assert ': keep-alive' in body
+
+    # An agent that already has the version only gets keep-alives
+    response = client.get(STREAM_URL, headers={'Last-Event-ID': version})
+    assert 'event: policy' not in response.get_data(as_text=True)
@@ -0,0 +1,174 @@
+"""
+Query plan regression suite
+Seeds the test database with a synthetic fleet, EXPLAINs every hot query
+and fails any query whose plan falls back to a full scan of a large table.
+
+Runs against SQLite by default; set GREENOPS_TEST_DATABASE_URL to an empty
+PostgreSQL database to check the production planner before an upgrade.
+"""
+
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import reset_state
+
+# Tables that must never be read with a full scan by a hot query
+LARGE_TABLES = ('agent_logs', 'systems', 'rollup_hourly', 'rollup_daily', 'idle_sessions')
+
+SYSTEMS = 2000
+LOGS = 50000
+
+
+def seed(greenops, systems, logs):
+    """Bulk insert synthetic systems, agent logs and rollups"""
+    db = greenops.db
+    now = datetime.utcnow()
+    statuses = ('active', 'idle', 'sleeping', 'offline')
+
+    db.session.execute(db.insert(greenops.System), [
+        {
+            'pc_id': f'ORG-D{i % 10}-L{i % 40}-{i:04X}',
+            'mac_address': f'02:00:00:{i >> 16 & 0xFF:02X}:{i >> 8 & 0xFF:02X}:{i & 0xFF:02X}',
+            'department': f'D{i % 10}',
+            'lab': f'L{i % 40}',
+            'status': statuses[i % len(statuses)],
+            'is_active': True,
+            'last_seen': now - timedelta(minutes=i % 600),
+            'first_seen': now - timedelta(days=30)
+        }
+        for i in range(systems)
+    ])
+    system_ids = db.session.execute(db.select(greenops.System.id).order_by(greenops.System.id)).scalars().all()
+
+    rows = []
+    for i in range(logs):
+        rows.append({
+            'system_id': system_ids[i % systems],
+            'pc_id': 'seed',
+            'idle_minutes': i % 60,
+            'action': 'SLEEP' if i % 3 else 'NONE',
+            'energy_kwh': 0.01,
+            'co2_kg': 0.008,
+            'cost_saved': 0.08,
+            'timestamp': now - timedelta(minutes=i % (60 * 24 * 30))
+        })
+        if len(rows) == 5000:
+            db.session.execute(db.insert(greenops.AgentLog), rows)
+            rows = []
+    if rows:
+        db.session.execute(db.insert(greenops.AgentLog), rows)
+
+    # A few closed sessions per system; the latest one of every tenth system is still open
+    db.session.execute(db.insert(greenops.IdleSession), [
+        {
+            'system_id': system_ids[i % systems],
+            'kind': 'idle',
+            'started_at': now - timedelta(hours=i // systems * 2 + 1),
+            'ended_at': now - timedelta(hours=i // systems * 2),
+            'idle_minutes': 60,
+            'samples': 60,
+            'is_open': i < systems and i % 10 == 0
+        }
+        for i in range(systems * 5)
+    ])
+    db.session.commit()
+
+    greenops.rebuild_rollups(now - timedelta(days=3), now)
+    db.session.execute(db.text('ANALYZE'))
+    db.session.commit()
+
+
+def rollup_sums(g, model, now, **filters):
+    query = g.db.session.query(*[g.db.func.sum(getattr(model, column)) for column in g.ROLLUP_SUMS])
+    return g._filter_rollups(query, model, now - timedelta(days=7), **filters).statement
+
+
+def yesterday(g, now):
+    return g.day_bucket(now) - timedelta(days=1)
+
+
+# Every query on the request and background paths, built from the app module and the current time
+HOT_QUERIES = {
+    'system history': lambda g, now: g.db.select(g.AgentLog).where(g.AgentLog.system_id == 42)
+        .order_by(g.AgentLog.timestamp.desc()).limit(20),
+    'system idle sessions': lambda g, now: g.db.select(g.IdleSession).where(g.IdleSession.system_id == 42)
+        .order_by(g.IdleSession.started_at.desc()).limit(20),
+    'open idle sessions': lambda g, now: g.db.select(g.IdleSession.system_id).where(g.IdleSession.is_open == True),
+    'dashboard recent logs': lambda g, now: g.db.select(g.AgentLog).order_by(g.AgentLog.timestamp.desc()).limit(20),
+    'resolve systems by MAC': lambda g, now: g.db.select(g.System.id)
+        .where(g.System.mac_address.in_(['02:00:00:00:00:01'])),
+    'systems listing': lambda g, now: g.system_listing_query().limit(500),
+    'systems listing, next page': lambda g, now: g.system_listing_query(cursor=(now - timedelta(hours=1), 100))
+        .limit(500),
+    'systems listing by status': lambda g, now: g.system_listing_query(status='idle').limit(500),
+    'systems listing by department/lab': lambda g, now: g.system_listing_query(department='D1', lab='L1').limit(500),
+    'systems listing by id': lambda g, now: g.system_listing_query(sort='id', cursor=(100,)).limit(500),
+    'systems count': lambda g, now: g.db.select(g.db.func.count(g.System.id))
+        .where(*g.system_filters(status='idle')),
+    'offline reaper': lambda g, now: g.db.select(g.System.id)
+        .where(*g.offline_conditions(now - timedelta(minutes=5))),
+    'fleet sync': lambda g, now: g.db.select(*g.FLEET_COLUMNS)
+        .where(g.System.is_active == True, g.System.last_seen >= now - timedelta(minutes=1)),
+    'export window': lambda g, now: g.export_query('agent_logs', now - timedelta(days=7), now)[0],
+    'export window by department': lambda g, now: g.export_query('agent_logs', now - timedelta(days=7), now, 'D1')[0],
+    'retention day': lambda g, now: g.db.select(g.AgentLog.id)
+        .where(g.AgentLog.timestamp >= yesterday(g, now), g.AgentLog.timestamp < yesterday(g, now) + timedelta(days=1))
+        .limit(5000),
+    'hourly rollup totals': lambda g, now: rollup_sums(g, g.HourlyRollup, now),
+    'daily rollup totals by department': lambda g, now: rollup_sums(g, g.DailyRollup, now, department='D1'),
+    'daily rollup coverage': lambda g, now: g.db.select(g.db.func.sum(g.DailyRollup.samples))
+        .where(g.DailyRollup.bucket == yesterday(g, now)),
+}
+
+
+def sqlite_full_scans(connection, sql):
+    plan = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql).all()
+    lines = [row[-1] for row in plan]
+    # "SCAN t" reads every row; "SCAN t USING [COVERING] INDEX" walks an index in order
+    scans = [line for line in lines
+             if line.startswith('SCAN ') and 'USING' not in line and line.split()[1] in LARGE_TABLES]
+    return scans, lines
+
+
+def postgres_full_scans(connection, sql):
+    # With sequential scans priced out the planner only picks one if no index can serve the query
+    connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+    plan = connection.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + sql).scalar()
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+
+    scans, lines = [], []
+    nodes = [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        relation = node.get('Relation Name', '')
+        lines.append(f"{node['Node Type']} {relation}".strip())
+        if node['Node Type'] == 'Seq Scan' and relation.startswith(LARGE_TABLES):
+            scans.append(lines[-1])
+        nodes.extend(node.get('Plans', []))
+    return scans, lines
+
+
+@pytest.fixture(scope='module')
+def seeded(server):
+    """The app module in an app context over a seeded database"""
+    reset_state(server)
+    with server.app.app_context():
+        seed(server, SYSTEMS, LOGS)
+        yield server
+        server.db.session.remove()
+    reset_state(server)
+
+
+@pytest.mark.parametrize('name', HOT_QUERIES)
+def test_hot_query_uses_an_index(seeded, name):
+    engine = seeded.db.engine
+    explain = postgres_full_scans if engine.dialect.name == 'postgresql' else sqlite_full_scans
+    statement = HOT_QUERIES[name](seeded, datetime.utcnow())
+    sql = str(statement.compile(dialect=engine.dialect, compile_kwargs={'literal_binds': True}))
+
+    with engine.begin() as connection:
+        scans, lines = explain(connection, sql)
+
+    assert not scans, f"{name} falls back to a full scan of {', '.join(scans)}; plan: {lines}"
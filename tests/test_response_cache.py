@@ -0,0 +1,90 @@
+"""Versioned response cache: ResponseCache, its backends and cached_view"""
+
+import pytest
+
+from caching import CachedResponse, LocalCacheBackend, RedisCacheBackend, ResponseCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def cache(clock):
+    return ResponseCache(LocalCacheBackend(), default_ttl=10, clock=clock)
+
+
+def response(body, status=200):
+    return CachedResponse(body, status, 'application/json')
+
+
+def test_hit_after_miss(cache):
+    assert cache.get_or_set('k', lambda: response(b'1')) == response(b'1')
+    assert cache.get_or_set('k', lambda: response(b'2')) == response(b'1')
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'errors': 0}
+
+
+def test_bump_invalidates_the_namespace(cache):
+    cache.get_or_set('k', lambda: response(b'1'))
+    cache.bump('data')
+
+    assert cache.get_or_set('k', lambda: response(b'2')) == response(b'2')
+
+
+def test_throttled_bump_is_dropped(cache, clock):
+    cache.bump('data', min_interval=5)
+    cache.get_or_set('k', lambda: response(b'1'))
+    clock.now = 1
+    cache.bump('data', min_interval=5)
+
+    assert cache.get_or_set('k', lambda: response(b'2')) == response(b'1')
+
+
+def test_rejected_values_are_not_stored(cache):
+    def is_ok(value):
+        return value.status == 200
+
+    assert cache.get_or_set('k', lambda: response(b'no', 500), cacheable=is_ok).status == 500
+    assert cache.get_or_set('k', lambda: response(b'1'), cacheable=is_ok) == response(b'1')
+
+
+def test_backend_failures_degrade_to_computing(clock):
+    class Broken(LocalCacheBackend):
+        def get(self, key):
+            raise ConnectionError('down')
+
+    cache = ResponseCache(Broken(), clock=clock)
+    assert cache.get_or_set('k', lambda: response(b'1')) == response(b'1')
+    assert cache.errors == 1
+
+
+def test_redis_values_round_trip_without_pickle():
+    value = CachedResponse(b'{"a": 1}\n<html>\n', 200, 'text/html')
+    encoded = RedisCacheBackend.encode(value)
+
+    assert encoded.startswith(b'{"status": 200')
+    assert RedisCacheBackend.decode(encoded) == value
+
+
+def test_cached_view_caches_only_200(server, client, admin_headers, monkeypatch):
+    monkeypatch.setattr(server, 'response_cache', ResponseCache(LocalCacheBackend(), default_ttl=10))
+
+    bad = {'granularity': 'fortnight'}
+    assert client.get('/api/v1/metrics/trends', query_string=bad, headers=admin_headers).status_code == 400
+    second = client.get('/api/v1/metrics/trends', query_string=bad, headers=admin_headers)
+    assert second.status_code == 400
+    assert 'X-Cache' not in second.headers
+
+    assert client.get('/api/v1/metrics/trends', headers=admin_headers).headers['X-Cache'] == 'MISS'
+    hit = client.get('/api/v1/metrics/trends', headers=admin_headers)
+    assert hit.status_code == 200
+    assert hit.headers['X-Cache'] == 'HIT'
@@ -0,0 +1,86 @@
+"""Raw log retention: downsampling and batched purge_agent_logs"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+NOW = datetime(2026, 3, 20, 12)
+
+
+@pytest.fixture
+def retention(app_context, monkeypatch):
+    monkeypatch.setattr(app_context.Config, 'RETENTION_BATCH_PAUSE_MS', 0)
+    monkeypatch.setattr(app_context.Config, 'RETENTION_BATCH_SIZE', 2)
+    return app_context
+
+
+def add_logs(server, system_id, *timestamps):
+    """Raw logs written without touching the rollups, like logs from before rollups existed"""
+    server.db.session.add_all([
+        server.AgentLog(system_id=system_id, pc_id='PC', idle_minutes=30, idle_increment=10, action='SLEEP',
+                        energy_kwh=0.1, co2_kg=0.08, cost_saved=0.8, timestamp=timestamp)
+        for timestamp in timestamps
+    ])
+    server.db.session.commit()
+
+
+def test_expired_days_are_rolled_up_then_deleted(retention, make_system):
+    server = retention
+    system_id = make_system('AA:00:00:00:00:01')
+    old = datetime(2026, 3, 1, 9)
+    add_logs(server, system_id, old, old + timedelta(hours=1), old + timedelta(days=1), NOW - timedelta(days=1))
+
+    summary = server.purge_agent_logs(retention_days=7, now=NOW)
+
+    assert (summary['days'], summary['days_rolled_up'], summary['log_rows']) == (2, 2, 3)
+    assert [log.timestamp for log in server.AgentLog.query.all()] == [NOW - timedelta(days=1)]
+    daily = {row.bucket: row for row in server.DailyRollup.query.all()}
+    assert daily[datetime(2026, 3, 1)].samples == 2
+    assert daily[datetime(2026, 3, 1)].energy_kwh == pytest.approx(0.2)
+    assert daily[datetime(2026, 3, 2)].samples == 1
+
+
+def test_days_the_rollups_cover_are_not_rolled_up_again(retention, make_system):
+    server = retention
+    system_id = make_system('AA:00:00:00:00:01')
+    add_logs(server, system_id, datetime(2026, 3, 1, 9), datetime(2026, 3, 1, 10))
+    server.rebuild_rollups(datetime(2026, 3, 1), datetime(2026, 3, 2))
+
+    summary = server.purge_agent_logs(retention_days=7, now=NOW)
+
+    assert (summary['days'], summary['days_rolled_up'], summary['log_rows']) == (1, 0, 2)
+    assert server.DailyRollup.query.one().samples == 2
+
+
+def test_dry_run_changes_nothing(retention, make_system):
+    server = retention
+    system_id = make_system('AA:00:00:00:00:01')
+    add_logs(server, system_id, datetime(2026, 3, 1, 9), datetime(2026, 3, 1, 10), datetime(2026, 3, 1, 11))
+
+    summary = server.purge_agent_logs(retention_days=7, now=NOW, dry_run=True)
+
+    assert (summary['days'], summary['days_rolled_up'], summary['log_rows']) == (1, 1, 3)
+    assert server.AgentLog.query.count() == 3
+    assert server.DailyRollup.query.count() == 0
+
+
+def test_hourly_rollups_are_trimmed_and_daily_rollups_kept(retention, make_system):
+    server = retention
+    system_id = make_system('AA:00:00:00:00:01')
+    add_logs(server, system_id, datetime(2026, 3, 1, 9), datetime(2026, 3, 1, 10), NOW - timedelta(hours=1))
+    server.rebuild_rollups(datetime(2026, 3, 1), NOW)
+
+    summary = server.purge_agent_logs(retention_days=0, hourly_retention_days=7, now=NOW)
+
+    assert summary['hourly_rollup_rows'] == 2
+    assert [row.bucket for row in server.HourlyRollup.query.all()] == [NOW - timedelta(hours=1)]
+    assert server.DailyRollup.query.count() == 2
+    assert server.AgentLog.query.count() == 3
+
+
+def test_nothing_to_purge_without_a_window(retention, make_system):
+    server = retention
+    add_logs(server, make_system('AA:00:00:00:00:01'), datetime(2020, 1, 1))
+
+    assert server.purge_agent_logs(retention_days=0, hourly_retention_days=0, now=NOW)['log_rows'] == 0
+    assert server.AgentLog.query.count() == 1
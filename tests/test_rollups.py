@@ -0,0 +1,64 @@
+"""Hourly and daily rollups maintained at ingest"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+
+def log_row(system_id, timestamp, energy_kwh=0.5, idle_increment=10.0, action='SLEEP'):
+    return {'system_id': system_id, 'timestamp': timestamp, 'energy_kwh': energy_kwh, 'co2_kg': energy_kwh * 0.8,
+            'cost_saved': energy_kwh * 8, 'idle_increment': idle_increment, 'action': action}
+
+
+def rollups(server, model):
+    return {
+        (row.bucket, row.system_id): {column: pytest.approx(getattr(row, column)) for column in server.ROLLUP_SUMS}
+        for row in model.query.all()
+    }
+
+
+@pytest.mark.parametrize('dialect', ['native', 'portable'])
+def test_upserts_add_onto_existing_buckets(app_context, make_system, monkeypatch, dialect):
+    server = app_context
+    first, second = make_system('AA:00:00:00:00:01'), make_system('AA:00:00:00:00:02', department='EE')
+    systems = {system.id: system for system in server.System.query.all()}
+    if dialect == 'portable':
+        monkeypatch.setattr(server.db.engine.dialect, 'name', 'other')
+    at = datetime(2026, 3, 2, 9, 15)
+
+    server.update_rollups([log_row(first, at), log_row(second, at, action='NONE')], systems)
+    server.update_rollups([log_row(first, at + timedelta(minutes=30)), log_row(first, at + timedelta(hours=1))], systems)
+    server.db.session.commit()
+
+    hourly = {(row.bucket.hour, row.system_id): row for row in server.HourlyRollup.query.all()}
+    assert hourly[(9, first)].samples == 2
+    assert hourly[(9, first)].energy_kwh == pytest.approx(1.0)
+    assert hourly[(9, first)].actions == 2
+    assert hourly[(9, second)].actions == 0
+    assert hourly[(9, second)].department == 'EE'
+    assert hourly[(10, first)].samples == 1
+
+    [daily] = server.DailyRollup.query.filter_by(system_id=first).all()
+    assert daily.bucket == datetime(2026, 3, 2)
+    assert daily.samples == 3
+    assert daily.idle_minutes == pytest.approx(30)
+
+
+def test_rebuild_matches_what_ingest_maintained(server, client, app_context):
+    now = datetime.utcnow().replace(microsecond=0)
+    for mac in ('AA:00:00:00:00:01', 'AA:00:00:00:00:02'):
+        for minutes_ago, idle in ((90, 10), (60, 40), (5, 95)):
+            response = client.post('/api/v1/agent/report', json={
+                'mac_address': mac, 'idle_minutes': idle, 'action': 'SLEEP' if idle > 30 else 'NONE',
+                'timestamp': (now - timedelta(minutes=minutes_ago)).isoformat()
+            })
+            assert response.status_code == 200
+
+    server.db.session.expire_all()
+    maintained = rollups(server, server.HourlyRollup), rollups(server, server.DailyRollup)
+    assert maintained[0]
+
+    server.rebuild_rollups(now - timedelta(days=1), now + timedelta(hours=1))
+    server.db.session.expire_all()
+
+    assert (rollups(server, server.HourlyRollup), rollups(server, server.DailyRollup)) == maintained
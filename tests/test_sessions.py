@@ -0,0 +1,88 @@
+"""Idle sessions: SessionTracker.observe and idle_increment in the exports"""
+
+import csv
+import io
+from datetime import datetime, timedelta
+
+import pytest
+
+from sessions import SessionState, SessionTracker
+
+START = datetime(2026, 3, 2, 9, 0)
+
+
+def minutes(n):
+    return START + timedelta(minutes=n)
+
+
+@pytest.fixture
+def tracker():
+    return SessionTracker(min_idle_minutes=5, tolerance=60)
+
+
+def test_overlapping_reports_credit_only_new_idle_time(tracker):
+    session, closed, increment = tracker.observe(None, 1, minutes(10), 10)
+    assert (session.started_at, session.ended_at, increment) == (minutes(0), minutes(10), 10)
+
+    # Idle for 11 minutes at 10:11: only the last minute is new
+    session, closed, increment = tracker.observe(session, 1, minutes(11), 11)
+    assert closed is None
+    assert increment == pytest.approx(1)
+    assert session.idle_minutes == pytest.approx(11)
+    assert session.samples == 2
+
+
+def test_input_in_between_closes_the_session(tracker):
+    session, _, _ = tracker.observe(None, 1, minutes(10), 10)
+
+    # Idle for only 6 minutes at 10:30: there was input at 10:24
+    session, closed, increment = tracker.observe(session, 1, minutes(30), 6)
+    assert closed.is_open is False
+    assert closed.ended_at == minutes(10)
+    assert session.started_at == minutes(24)
+    assert increment == pytest.approx(6)
+
+
+def test_short_idle_stretches_open_no_session(tracker):
+    assert tracker.observe(None, 1, minutes(10), 2) == (None, None, 0.0)
+
+
+def test_late_and_repeated_reports_credit_nothing(tracker):
+    session, _, _ = tracker.observe(None, 1, minutes(10), 10)
+
+    assert tracker.observe(session, 1, minutes(10), 10) == (session, None, 0.0)
+    assert tracker.observe(session, 1, minutes(5), 5) == (session, None, 0.0)
+
+
+def test_sleep_lasts_until_the_system_wakes(tracker):
+    session, _, _ = tracker.observe(None, 1, minutes(20), 20, action='SLEEP')
+    assert session.kind == 'sleep'
+
+    # Back at 11:00, used and idle again since 10:55
+    session, closed, _ = tracker.observe(session, 1, minutes(60), 5)
+    assert closed.kind == 'sleep'
+    assert closed.ended_at == minutes(55)
+
+
+def test_apply_stores_states_observe_returned(tracker):
+    state = SessionState(1, 'idle', minutes(0), minutes(10), 10)
+    tracker.apply({'AA:00:00:00:00:01': state})
+
+    assert len(tracker) == 1
+    assert tracker.get('AA:00:00:00:00:01') is state
+
+
+def test_exports_include_idle_increment(server, client, admin_headers):
+    now = datetime.utcnow().replace(microsecond=0)
+    for offset, idle in ((2, 10), (1, 11)):
+        response = client.post('/api/v1/agent/report', json={
+            'mac_address': 'AA:00:00:00:00:01', 'idle_minutes': idle, 'action': 'NONE',
+            'timestamp': (now - timedelta(minutes=offset)).isoformat()
+        })
+        assert response.status_code == 200
+
+    response = client.get('/api/v1/export/csv', headers=admin_headers)
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert [(float(row['Idle Minutes']), float(row['Idle Increment'])) for row in rows] == [(11, 1), (10, 10)]
+
+    assert ('idle_increment', 'float') in server.export_query('agent_logs')[1]
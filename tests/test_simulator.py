@@ -0,0 +1,126 @@
+"""Policy simulator: idle traces, candidate grids and the simulate endpoint"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from simulator import IdleTraces, action_minutes, expand_grid, normalize_candidate, simulate
+
+
+def policy(**params):
+    return normalize_candidate({'warning_enabled': False, **params})
+
+
+def naive(traces, candidate, power_watts, window):
+    """Straight loop over every stretch, what simulate() vectorizes"""
+    acts_at = action_minutes(candidate)
+    acting = candidate['action_type'] in ('sleep', 'hibernate', 'shutdown')
+    kwh = actions = interruptions = warnings = 0
+    for system_id, duration, censored in zip(traces.system_ids, traces.durations, traces.censored):
+        if acting and duration >= acts_at:
+            actions += 1
+            kwh += (duration - acts_at) / 60 * power_watts[int(system_id)] / 1000
+            interruptions += not censored and duration < acts_at + window
+        warnings += candidate['warning_enabled'] and duration >= candidate['idle_threshold']
+    return round(kwh, 3), actions, interruptions, warnings
+
+
+def test_reports_become_stretches():
+    minute = 60
+    traces = IdleTraces.from_reports(
+        system_ids=[1, 1, 1, 2],
+        timestamps=[10 * minute, 20 * minute, 50 * minute, 50 * minute],
+        idle_minutes=[10, 20, 5, 30],
+        asleep=[False, False, False, True],
+        next_reports=[np.nan, np.nan, np.nan, 80 * minute]
+    )
+
+    assert traces.system_ids.tolist() == [1, 1, 2]
+    assert traces.durations.tolist() == [20, 5, 60]
+    assert traces.slept.tolist() == [False, False, True]
+    # System 1's last stretch may still be running; system 2 woke up
+    assert traces.censored.tolist() == [False, True, False]
+
+
+def test_simulate_matches_a_straight_loop():
+    rng = np.random.default_rng(7)
+    system_ids = np.sort(rng.integers(1, 20, 500))
+    traces = IdleTraces(system_ids, rng.exponential(40, 500).round(1), np.zeros(500, bool), rng.random(500) < 0.1)
+    power = {system_id: 50 + system_id * 10 for system_id in range(1, 20)}
+    candidates = expand_grid({'idle_threshold': [5, 15], 'sleep_threshold': [10, 30, 90],
+                              'warning_enabled': [True, False], 'action_type': ['sleep', 'none']})
+
+    results = simulate(traces, candidates, power, co2_factor=0.5, cost_per_kwh=10, interruption_window=15)
+
+    assert len(results) == 24
+    for candidate, result in zip(candidates, results):
+        expected = naive(traces, normalize_candidate(candidate), power, 15)
+        assert (result['energy_kwh'], result['actions'], result['interruptions'], result['warnings']) == \
+            pytest.approx(expected, abs=0.002)
+        assert result['cost_saved'] == pytest.approx(result['energy_kwh'] * 10, abs=0.05)
+
+
+def test_per_system_results_add_up():
+    traces = IdleTraces([1, 1, 2], [45, 10, 90], [False] * 3, [False] * 3)
+
+    [result] = simulate(traces, [policy(sleep_threshold=30)], {1: 600, 2: 60}, 0.5, 10, per_system=True)
+
+    assert result['systems'] == [
+        {'system_id': 1, 'energy_kwh': 0.15, 'actions': 1, 'interruptions': 0},
+        {'system_id': 2, 'energy_kwh': 0.06, 'actions': 1, 'interruptions': 0},
+    ]
+    assert result['energy_kwh'] == 0.21
+
+
+def test_no_traces_no_savings():
+    [result] = simulate(IdleTraces([], [], [], []), [policy()], {}, 0.5, 10)
+
+    assert (result['energy_kwh'], result['actions']) == (0, 0)
+
+
+def test_warnings_delay_the_action():
+    assert action_minutes(normalize_candidate({'idle_threshold': 20, 'sleep_threshold': 10})) == 25
+    assert action_minutes(policy(idle_threshold=20, sleep_threshold=10)) == 10
+
+
+@pytest.mark.parametrize('candidate', [{'idle_threshold': -1}, {'sleep_threshold': 'soon'},
+                                       {'warning_duration': True}, {'color': 'green'}, []])
+def test_invalid_candidates_are_rejected(candidate):
+    with pytest.raises(ValueError):
+        normalize_candidate(candidate)
+
+
+def test_grid_expands_scalars_and_rejects_unknown_parameters():
+    assert expand_grid({'idle_threshold': [5, 10], 'action_type': 'hibernate'}) == [
+        {'idle_threshold': 5, 'action_type': 'hibernate'}, {'idle_threshold': 10, 'action_type': 'hibernate'}
+    ]
+    with pytest.raises(ValueError):
+        expand_grid({'color': ['green']})
+
+
+def test_simulate_endpoint(client, admin_headers, make_system):
+    make_system('AA:00:00:00:00:01', power_watts=600)
+    now = datetime.utcnow().replace(microsecond=0)
+    for minutes_ago, idle in ((70, 20), (50, 40), (30, 60)):
+        response = client.post('/api/v1/agent/report', json={
+            'mac_address': 'AA:00:00:00:00:01', 'idle_minutes': idle, 'action': 'NONE',
+            'timestamp': (now - timedelta(minutes=minutes_ago)).isoformat()
+        })
+        assert response.status_code == 200
+
+    response = client.post('/api/v1/policies/simulate', headers=admin_headers, json={
+        'grid': {'sleep_threshold': [30, 50], 'warning_enabled': False}, 'days': 1
+    })
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert (data['systems'], data['stretches']) == (1, 1)
+    assert [result['energy_kwh'] for result in data['results']] == [0.3, 0.1]
+    assert data['baseline']['sleep_threshold'] == 30
+
+
+@pytest.mark.parametrize('body', [{}, {'grid': {'color': ['green']}}, {'candidates': 'all'},
+                                  {'grid': {'idle_threshold': [5]}, 'days': 0}])
+def test_simulate_endpoint_rejects_bad_requests(client, admin_headers, body):
+    assert client.post('/api/v1/policies/simulate', headers=admin_headers, json=body).status_code == 400
@@ -0,0 +1,64 @@
+"""MAC-to-System resolution cache in resolve_systems"""
+
+import pytest
+from sqlalchemy import event
+
+
+def send_report(client, mac_address, idle_minutes=0):
+    response = client.post('/api/v1/agent/report', json={
+        'mac_address': mac_address, 'idle_minutes': idle_minutes, 'action': 'NONE'
+    })
+    assert response.status_code == 200
+
+
+@pytest.fixture
+def system_writes(server):
+    """UPDATE statements sent for the systems table"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('UPDATE SYSTEMS'):
+            statements.append(statement)
+
+    with server.app.app_context():
+        engine = server.db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', record)
+
+
+def stored_status(server, mac_address):
+    with server.app.app_context():
+        return server.db.session.execute(
+            server.db.select(server.System.status).where(server.System.mac_address == mac_address)
+        ).scalar_one()
+
+
+def test_cached_system_is_not_rewritten(server, client, system_writes):
+    send_report(client, 'AA:00:00:00:00:01')
+    assert server.system_cache.get('AA:00:00:00:00:01') is not None
+    system_writes.clear()
+
+    send_report(client, 'AA:00:00:00:00:01')
+
+    assert system_writes == []
+
+
+@pytest.mark.parametrize('changed_to', ['idle', 'offline'])
+def test_status_changed_behind_the_cache_is_written(server, client, changed_to):
+    send_report(client, 'AA:00:00:00:00:01')
+    assert server.system_cache.get('AA:00:00:00:00:01').status == 'active'
+
+    # Another worker (or the reaper) changes the row without touching this cache
+    with server.app.app_context():
+        server.db.session.execute(
+            server.db.update(server.System.__table__)
+            .where(server.System.mac_address == 'AA:00:00:00:00:01').values(status=changed_to)
+        )
+        server.db.session.commit()
+    assert server.system_cache.get('AA:00:00:00:00:01').status == 'active'
+
+    send_report(client, 'AA:00:00:00:00:01')
+
+    assert stored_status(server, 'AA:00:00:00:00:01') == 'active'
+    assert server.fleet.status_counts(server.datetime.utcnow())['active'] == 1
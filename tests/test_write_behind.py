@@ -0,0 +1,136 @@
+"""Write-behind heartbeat buffer and heartbeat validation"""
+
+import json
+
+import pytest
+
+from background import WriteBehindBuffer
+
+
+class Storage:
+    """flush_fn that fails for batches containing a poisoned item, or while down"""
+
+    def __init__(self, poisoned=()):
+        self.poisoned = set(poisoned)
+        self.down = False
+        self.written = []
+        self.calls = 0
+
+    def __call__(self, batch):
+        self.calls += 1
+        if self.down or self.poisoned & set(batch):
+            raise RuntimeError('write failed')
+        self.written.extend(batch)
+
+
+def make_buffer(storage, **options):
+    options.setdefault('flush_interval', 3600)  # flushes are driven by the test
+    options.setdefault('flush_size', 1000)
+    return WriteBehindBuffer(storage, **options)
+
+
+def test_flush_writes_queued_items():
+    storage = Storage()
+    buffer = make_buffer(storage)
+    for item in range(10):
+        assert buffer.put(item)
+
+    assert buffer.flush() == 10
+    assert storage.written == list(range(10))
+    assert len(buffer) == 0
+    buffer.close()
+
+
+def test_failed_batch_is_retried_after_its_delay():
+    storage = Storage()
+    storage.down = True
+    buffer = make_buffer(storage, retry_delay=60)
+    buffer.put(1)
+
+    assert buffer.flush() == 0
+    storage.down = False
+    assert buffer.flush() == 0  # still waiting out the retry delay
+    assert len(buffer) == 1
+
+    assert buffer.flush(force=True) == 1
+    assert storage.written == [1]
+    assert buffer.stats['dropped'] == 0
+    buffer.close()
+
+
+def test_poisoned_item_is_isolated_and_dead_lettered():
+    storage = Storage(poisoned={13})
+    dead = []
+    buffer = make_buffer(storage, max_retries=2, retry_delay=0, on_failure=lambda item, error: dead.append(item))
+    for item in range(32):
+        buffer.put(item)
+
+    assert buffer.flush() == 0  # attempt 1
+    assert buffer.flush() == 0  # attempt 2
+    assert buffer.flush() == 31  # retries exhausted: written in halves
+
+    assert sorted(storage.written) == [item for item in range(32) if item != 13]
+    assert dead == [13]
+    assert buffer.stats['dropped'] == 1
+    assert len(buffer) == 0
+
+    # The queue flows again
+    buffer.put(99)
+    assert buffer.flush() == 1
+    buffer.close()
+
+
+def test_failing_hook_does_not_stop_the_flush():
+    def hook(item, error):
+        raise OSError('disk full')
+
+    storage = Storage(poisoned={'bad'})
+    buffer = make_buffer(storage, max_retries=0, on_failure=hook)
+    for item in ('a', 'bad', 'b'):
+        buffer.put(item)
+
+    assert buffer.flush() == 2
+    assert buffer.stats['dropped'] == 1
+    buffer.close()
+
+
+@pytest.mark.parametrize('field, value', [
+    ('hostname', 'h' * 256),
+    ('action', 'A' * 51),
+    ('os', ['Windows']),
+    ('department', 'D' * 101),
+    ('threshold', '15'),
+    ('mac_address', 'AA:BB:CC:DD:EE:FF:00'),
+])
+def test_parse_heartbeat_rejects_values_the_database_would_refuse(server, field, value):
+    data = {'mac_address': 'AA:BB:CC:DD:EE:FF', 'idle_minutes': 1, field: value}
+
+    with pytest.raises(ValueError):
+        server.parse_heartbeat(data)
+
+
+def test_parse_heartbeat_rejects_an_over_long_pc_id(server):
+    data = {'mac_address': 'AA:BB:CC:DD:EE:FF', 'organization': 'O' * 40, 'department': 'D' * 40, 'lab': 'L' * 40}
+
+    with pytest.raises(ValueError):
+        server.parse_heartbeat(data)
+
+
+def test_bad_report_in_a_write_behind_batch_is_dead_lettered(app_context, tmp_path, monkeypatch):
+    server = app_context
+    dead_letters = tmp_path / 'dead.jsonl'
+    monkeypatch.setattr(server.Config, 'INGEST_DEAD_LETTER_PATH', str(dead_letters))
+
+    reports = [server.parse_heartbeat({'mac_address': f'AA:00:00:00:00:0{i}', 'idle_minutes': i}) for i in range(3)]
+    reports[1]['action'] = None  # NOT NULL in agent_logs
+
+    buffer = WriteBehindBuffer(server._flush_heartbeats, flush_interval=3600, max_retries=0,
+                               on_failure=server._dead_letter_heartbeat)
+    for report in reports:
+        buffer.put(report)
+
+    assert buffer.flush() == 2
+    assert server.AgentLog.query.count() == 2
+    [line] = dead_letters.read_text().splitlines()
+    assert json.loads(line)['report']['mac_address'] == 'AA:00:00:00:00:01'
+    buffer.close()